@@ -4,6 +4,7 @@ import os
 from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
 FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:5173')
 # Base directory
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -29,7 +30,9 @@ LOGGING = {
 
 # Security Keys
 SECRET_KEY = os.getenv("DJANGO_SECRET_KEY")  # Fetching secret key
-ESEWA_SECRET_KEY = os.getenv("ESEWA_SECRET_KEY")  # Fetching eSewa key
+ESEWA_SECRET_KEY = os.getenv("ESEWA_SECRET_KEY")  # Fetching eSewa key, signs and verifies payments
+if not ESEWA_SECRET_KEY:
+    raise ImproperlyConfigured("ESEWA_SECRET_KEY is not set")
 
 # Debug mode (Set to False in production)
 DEBUG = True
@@ -46,6 +49,53 @@ CACHES = {
     }
 }
 
+# Cart storage: "db" (default) or "redis" to keep live carts in Redis hashes
+# and write them back to the database with the flush_carts command
+CART_BACKEND = os.getenv("CART_BACKEND", "db")
+CART_REDIS_TTL = 60 * 60 * 24 * 7
+
+# Idempotency-Key responses: "redis" keeps them in the default cache, "db" in
+# the IdempotencyKey table (expired rows are removed by purge_idempotency_keys)
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "redis")
+IDEMPOTENCY_TTL = 60 * 60 * 24
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+# Minutes stock stays reserved for an unpaid online order before
+# release_inventory_holds gives it back
+INVENTORY_HOLD_MINUTES = 15
+
+# "queue" makes order placement answer 202 and leaves the stock reservation
+# to the process_order_requests worker, for promotions that would otherwise
+# pile every request up on the product rows; "sync" places orders inline
+ORDER_INTAKE_MODE = os.getenv("ORDER_INTAKE_MODE", "sync")
+ORDER_INTAKE_BATCH_SIZE = 200
+ORDER_INTAKE_CLAIM_TIMEOUT = 300  # Seconds before a batch whose worker died is claimed again
+
+# Background jobs (see myapp/tasks.py and the run_tasks command)
+TASK_VISIBILITY_TIMEOUT = 300  # Seconds before a job whose worker died is run again
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_BACKOFF = 30  # Seconds before the first retry, doubled on each attempt
+
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend")
+DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "MediNest <orders@medinest.local>")
+PHARMACIST_EMAILS = [email for email in os.getenv("PHARMACIST_EMAILS", "").split(",") if email]
+REFUND_EMAILS = [email for email in os.getenv("REFUND_EMAILS", "").split(",") if email]
+
+# eSewa ePay; the defaults are the public sandbox, the key has no default
+ESEWA_PRODUCT_CODE = os.getenv("ESEWA_PRODUCT_CODE", "EPAYTEST")
+ESEWA_STATUS_URL = os.getenv("ESEWA_STATUS_URL", "https://rc.esewa.com.np/api/epay/transaction/status/")
+ESEWA_TIMEOUT = 10  # Seconds per status request
+# Minutes a payment may stay PENDING before reconcile_payments asks eSewa about it
+PAYMENT_RECONCILE_AFTER_MINUTES = 30
+
+# Admin changelists larger than this show the planner's row estimate
+# instead of running COUNT(*) (PostgreSQL only, see myapp/admin_utils.py)
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Age thresholds for the purge_carts command
+CART_ABANDONED_DAYS = 30
+EMPTY_CART_DAYS = 7
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -111,6 +161,15 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'if-match',
+    'if-none-match',
+    'idempotency-key',
+]
+
+# Cart responses carry their version as an ETag
+CORS_EXPOSE_HEADERS = [
+    'etag',
+    'idempotent-replayed',
 ]
 
 ROOT_URLCONF = 'epharm.urls'
@@ -1,14 +1,19 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.admin import AdminSite
 from django.template.response import TemplateResponse
-from django.utils.html import format_html
-from django.db.models import Sum, Count
+from django.utils.html import format_html, format_html_join
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
 from django.utils import timezone
-from django.urls import path
+from django.urls import path, reverse
 from django.http import HttpResponse
 from datetime import timedelta
 from unfold.sites import UnfoldAdminSite
-from .models import Product, CustomUser, Cart, CartItem, Order, userPayment
+from .models import Product, CustomUser, Cart, CartItem, Order, OrderLine, userPayment
+from .admin_utils import PRIMARY_KEY, TRANSACTION_ID, CsvExportMixin, IndexedSearchMixin, StatusTransitionForm
+from .order_utils import ORDER_TRANSITIONS, transition_order, transition_orders
+from .payment_utils import PAYMENT_TRANSITIONS, PaymentTransitionError, transition_payment
+from .prescription_hashing import find_similar_orders
 
 
 class MediNestAdminSite(UnfoldAdminSite):
@@ -38,7 +43,7 @@ class MediNestAdminSite(UnfoldAdminSite):
         shipped_orders = Order.objects.filter(status='shipped').count()
         delivered_orders = Order.objects.filter(status='delivered').count()
         
-        recent_orders = Order.objects.all().order_by('-created_at')[:10]
+        recent_orders = Order.objects.select_related('user').order_by('-created_at')[:10]
         low_stock_products = Product.objects.filter(stock__lt=10).exclude(stock=0)[:5]
         
         sales_data = []
@@ -248,11 +253,15 @@ class MediNestAdminSite(UnfoldAdminSite):
 admin_site = MediNestAdminSite(name='admin')
 
 
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(CsvExportMixin, admin.ModelAdmin):
     list_display = ('name', 'generic_name', 'price', 'category', 'stock', 'stock_status', 'prescription_required')
     list_editable = ('stock',)
     search_fields = ('name', 'generic_name')
     list_filter = ('category', 'prescription_required')
+    export_columns = [
+        ('ID', 'id'), ('Name', 'name'), ('Generic name', 'generic_name'), ('Category', 'category'),
+        ('Price', 'price'), ('Stock', 'stock'), ('Prescription required', 'prescription_required'),
+    ]
     
     def stock_status(self, obj):
         if obj.stock == 0:
@@ -270,19 +279,25 @@ class CustomUserAdmin(admin.ModelAdmin):
 
 class CartAdmin(admin.ModelAdmin):
     list_display = ('user', 'item_count')
-    
+    list_select_related = ('user',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(item_total=Count('cart_items'))
+
     def item_count(self, obj):
-        return obj.cart_items.count()
+        return obj.item_total
     item_count.short_description = 'Items'
+    item_count.admin_order_field = 'item_total'
 
 
-class CartItemAdmin(admin.ModelAdmin):
+class CartItemAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('product', 'quantity', 'cart_user', 'prescription_file_tag')
     search_fields = ('product__name',)
     list_filter = ('product__category',)
-    
+    list_select_related = ('product', 'cart__user')
+
     def cart_user(self, obj):
-        return obj.cart.user.username
+        return obj.cart.user.username if obj.cart_id else '-'
     cart_user.short_description = 'Cart User'
     
     def prescription_file_tag(self, obj):
@@ -313,13 +328,91 @@ class CartItemInline(admin.TabularInline):
         return False
 
 
-class OrderAdmin(admin.ModelAdmin):
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    fields = ('product_name', 'unit_price', 'quantity', 'line_total')
+    readonly_fields = fields
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class OrderAdminForm(StatusTransitionForm):
+    transitions = ORDER_TRANSITIONS
+
+
+class OrderAdmin(CsvExportMixin, IndexedSearchMixin, admin.ModelAdmin):
+    form = OrderAdminForm
     list_display = ('id', 'user', 'total_price', 'status', 'prescription_tag', 'payment_status_display', 'created_at')
     list_filter = ('status', 'created_at')
-    search_fields = ('user__username', 'user__email', 'id')
-    readonly_fields = ('created_at', 'updated_at')
-    inlines = [CartItemInline]
+    # Order numbers are also matched exactly by IndexedSearchMixin
+    search_fields = ('user__username', 'user__email')
+    list_select_related = ('user',)
+    readonly_fields = ('stock_reserved', 'created_at', 'updated_at', 'similar_prescriptions')
+    inlines = [OrderLineInline, CartItemInline]
     list_editable = ('status',)
+    actions = ['mark_processing', 'mark_paid', 'mark_shipped', 'mark_delivered', 'export_csv']
+    export_columns = [
+        ('Order', 'id'), ('Created', 'created_at'), ('Status', 'status'), ('Username', 'user__username'),
+        ('Email', 'user__email'), ('Phone', 'user__phone'), ('Total', 'total_price'), ('Address', 'address'),
+        ('Payment', 'payment_status'),
+    ]
+
+    def get_queryset(self, request):
+        # Latest payment status as a column, instead of a lookup per row
+        latest_payment = userPayment.objects.filter(order=OuterRef('pk')).order_by('-created_at', '-id')
+        return super().get_queryset(request).annotate(
+            payment_status=Subquery(latest_payment.values('status')[:1]))
+
+    def get_changelist_form(self, request, **kwargs):
+        return super().get_changelist_form(request, form=OrderAdminForm, **kwargs)
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+
+        # Only transition_order writes the status, a full save would overwrite a concurrent move
+        other_fields = [field for field in form.changed_data if field != 'status']
+        if other_fields:
+            obj.save(update_fields=[*other_fields, 'updated_at'])
+        if 'status' not in form.changed_data:
+            return
+
+        # OrderAdminForm allowed the move; transition_order logs it and gives stock back on cancel
+        new_status, obj.status = obj.status, form.initial['status']
+        if not transition_order(obj, new_status, changed_by=request.user):
+            # Another writer moved the order after the form was validated; undo the whole edit
+            transaction.set_rollback(True)
+            self.message_user(request, f"Order #{obj.id} changed status meanwhile, nothing was saved.",
+                              level=messages.ERROR)
+
+    def _transition(self, request, queryset, to_status):
+        result = transition_orders(queryset.values_list('id', flat=True), to_status, changed_by=request.user)
+        self.message_user(request, f"{len(result['updated'])} order(s) marked {to_status}.")
+        if result['rejected']:
+            self.message_user(
+                request,
+                f"{len(result['rejected'])} order(s) cannot move to {to_status} from their current status.",
+                level=messages.WARNING
+            )
+
+    @admin.action(description='Mark selected orders as processing')
+    def mark_processing(self, request, queryset):
+        self._transition(request, queryset, 'processing')
+
+    @admin.action(description='Mark selected orders as paid')
+    def mark_paid(self, request, queryset):
+        self._transition(request, queryset, 'paid')
+
+    @admin.action(description='Mark selected orders as shipped')
+    def mark_shipped(self, request, queryset):
+        self._transition(request, queryset, 'shipped')
+
+    @admin.action(description='Mark selected orders as delivered')
+    def mark_delivered(self, request, queryset):
+        self._transition(request, queryset, 'delivered')
     
     def prescription_tag(self, obj):
         if obj.prescription:
@@ -329,34 +422,56 @@ class OrderAdmin(admin.ModelAdmin):
             )
         return format_html('<span style="color: #999;">No Prescription</span>')
     prescription_tag.short_description = 'Prescription'
+
+    def similar_prescriptions(self, obj):
+        matches = find_similar_orders(obj) if obj.pk else []
+        if not matches:
+            return format_html('<span style="color: #999;">No earlier matches</span>')
+        return format_html_join(
+            format_html('<br>'),
+            '<a href="{}">Order #{}</a> ({}, {})',
+            ((reverse('admin:myapp_order_change', args=[order_id]), order_id, order_status,
+              'identical' if distance == 0 else f'{distance} bits apart')
+             for order_id, order_status, distance in matches)
+        )
+    similar_prescriptions.short_description = 'Similar Prescriptions'
     
     def payment_status_display(self, obj):
-        try:
-            payment = userPayment.objects.filter(order=obj).first()
-            if payment:
-                if payment.status == 'PAID':
-                    return format_html('<span style="color: green; font-weight: bold;">PAID</span>')
-                elif payment.status == 'PENDING':
-                    return format_html('<span style="color: orange;">PENDING</span>')
-                elif payment.status == 'FAILED':
-                    return format_html('<span style="color: red;">FAILED</span>')
-                elif payment.status == 'REFUNDED':
-                    return format_html('<span style="color: purple;">REFUNDED</span>')
-                else:
-                    return format_html('<span style="color: gray;">{}</span>', payment.status)
-        except:
-            pass
+        payment_status = getattr(obj, 'payment_status', None)
+        if payment_status == 'PAID':
+            return format_html('<span style="color: green; font-weight: bold;">PAID</span>')
+        elif payment_status == 'PENDING':
+            return format_html('<span style="color: orange;">PENDING</span>')
+        elif payment_status == 'FAILED':
+            return format_html('<span style="color: red;">FAILED</span>')
+        elif payment_status == 'REFUNDED':
+            return format_html('<span style="color: purple;">REFUNDED</span>')
+        elif payment_status:
+            return format_html('<span style="color: gray;">{}</span>', payment_status)
         return format_html('<span style="color: gray;">No Payment</span>')
     payment_status_display.short_description = 'Payment'
+    payment_status_display.admin_order_field = 'payment_status'
+
+
+class UserPaymentAdminForm(StatusTransitionForm):
+    transitions = PAYMENT_TRANSITIONS
 
 
-class UserPaymentAdmin(admin.ModelAdmin):
+class UserPaymentAdmin(CsvExportMixin, IndexedSearchMixin, admin.ModelAdmin):
+    form = UserPaymentAdminForm
     list_display = ('transaction_uuid', 'get_user', 'get_order', 'amount', 'status', 'transaction_code', 'created_at')
     list_filter = ('status', 'created_at')
     search_fields = ('transaction_uuid', 'user__username', 'transaction_code')
+    exact_search_fields = [('pk', PRIMARY_KEY.match), ('transaction_uuid', TRANSACTION_ID.match)]
+    export_columns = [
+        ('ID', 'id'), ('Transaction', 'transaction_uuid'), ('Transaction code', 'transaction_code'),
+        ('Status', 'status'), ('Amount', 'amount'), ('Tax', 'tax_amount'), ('Total', 'total_amount'),
+        ('Username', 'user__username'), ('Order', 'order_id'), ('Created', 'created_at'), ('Updated', 'updated_at'),
+    ]
     readonly_fields = ('transaction_uuid', 'created_at', 'updated_at')
     list_editable = ('status',)
-    
+    list_select_related = ('user',)
+
     def get_user(self, obj):
         if obj.user:
             return format_html(
@@ -369,11 +484,12 @@ class UserPaymentAdmin(admin.ModelAdmin):
     get_user.admin_order_field = 'user__username'
     
     def get_order(self, obj):
-        if obj.order:
+        # The id is on the payment row, no need to load the order
+        if obj.order_id:
             return format_html(
                 '<a href="/admin/myapp/order/{}/change/">Order #{}</a>',
-                obj.order.id,
-                obj.order.id
+                obj.order_id,
+                obj.order_id
             )
         return "No order"
     get_order.short_description = 'Order'
@@ -381,9 +497,33 @@ class UserPaymentAdmin(admin.ModelAdmin):
     
     def get_readonly_fields(self, request, obj=None):
         if obj:
-            return ('transaction_uuid', 'created_at', 'updated_at')
-        return ('created_at', 'updated_at')
-    
+            return ('transaction_uuid', 'version', 'created_at', 'updated_at')
+        return ('version', 'created_at', 'updated_at')
+
+    def get_changelist_form(self, request, **kwargs):
+        return super().get_changelist_form(request, form=UserPaymentAdminForm, **kwargs)
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+
+        # Only transition_payment writes status and version, a full save would revert a concurrent move
+        other_fields = [field for field in form.changed_data if field not in ('status', 'version')]
+        if other_fields:
+            obj.save(update_fields=[*other_fields, 'updated_at'])
+        if 'status' not in form.changed_data:
+            return
+
+        # UserPaymentAdminForm allowed the move; transition_payment confirms the order on PAID
+        new_status, obj.status = obj.status, form.initial['status']
+        try:
+            transition_payment(obj, new_status, changed_by=request.user)
+        except PaymentTransitionError:
+            # Another writer moved the payment after the form was validated; undo the whole edit
+            transaction.set_rollback(True)
+            self.message_user(request, f"Payment {obj.transaction_uuid} changed status meanwhile, nothing was saved.",
+                              level=messages.ERROR)
+
     def has_add_permission(self, request):
         return False
 
@@ -0,0 +1,109 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import Cart, CartItem, Order, PrescriptionBlob
+
+logger = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = 500
+
+
+def _legacy_file_size(name):
+    try:
+        return default_storage.size(name)
+    except Exception:
+        return 0
+
+
+def _delete_lines(lines):
+    """
+    Delete a small set of cart lines and their prescription files.
+
+    Blob-backed files are released by the post_delete signal; legacy files
+    that no other row points at are removed here. Returns (rows, bytes).
+    """
+    lines = list(lines.values_list('id', 'prescription_blob_id', 'prescription_file'))
+    if not lines:
+        return 0, 0
+
+    blob_sizes = dict(PrescriptionBlob.objects
+                      .filter(id__in={blob_id for _, blob_id, _ in lines if blob_id})
+                      .values_list('id', 'size'))
+    legacy_files = {name for _, blob_id, name in lines if name and not blob_id}
+
+    deleted, _ = CartItem.objects.filter(id__in=[line_id for line_id, _, _ in lines]).delete()
+
+    freed = sum(blob_sizes.values()) - sum(
+        PrescriptionBlob.objects.filter(id__in=list(blob_sizes)).values_list('size', flat=True))
+
+    shared = set(CartItem.objects.filter(prescription_file__in=legacy_files)
+                 .values_list('prescription_file', flat=True))
+    shared |= set(Order.objects.filter(prescription__in=legacy_files).values_list('prescription', flat=True))
+    for name in legacy_files - shared:
+        freed += _legacy_file_size(name)
+        transaction.on_commit(lambda name=name: default_storage.delete(name))
+
+    return deleted, freed
+
+
+def purge_orphaned_lines(batch_size=PURGE_BATCH_SIZE, dry_run=False):
+    """Lines that belong to neither a cart nor an order can never be read again"""
+    orphans = CartItem.objects.filter(cart__isnull=True, order__isnull=True).order_by('id')
+    if dry_run:
+        return {'lines': orphans.count(), 'bytes': 0}
+
+    totals = {'lines': 0, 'bytes': 0}
+    while True:
+        with transaction.atomic():
+            lines, freed = _delete_lines(CartItem.objects.filter(
+                id__in=list(orphans.values_list('id', flat=True)[:batch_size])))
+        if not lines:
+            return totals
+        totals['lines'] += lines
+        totals['bytes'] += freed
+
+
+def purge_abandoned_carts(abandoned_days=None, empty_days=None, batch_size=PURGE_BATCH_SIZE, dry_run=False):
+    """
+    Delete carts nobody has touched for a while, one short transaction per batch.
+
+    Carts holding lines expire after abandoned_days, empty carts after
+    empty_days. Order-linked lines still pointing at a purged cart are
+    detached rather than deleted, so order history is never lost.
+    """
+    now = timezone.now()
+    abandoned_before = now - timedelta(days=abandoned_days or settings.CART_ABANDONED_DAYS)
+    empty_before = now - timedelta(days=empty_days or settings.EMPTY_CART_DAYS)
+
+    has_lines = Exists(CartItem.objects.filter(cart=OuterRef('pk'), order__isnull=True))
+    stale = (Cart.objects
+             .filter(Q(updated_at__lt=abandoned_before) | Q(~has_lines, updated_at__lt=empty_before))
+             .order_by('id'))
+    if dry_run:
+        return {
+            'carts': stale.count(),
+            'lines': CartItem.objects.filter(cart__in=stale, order__isnull=True).count(),
+            'bytes': 0,
+        }
+
+    totals = {'carts': 0, 'lines': 0, 'bytes': 0}
+    while True:
+        with transaction.atomic():
+            # Carts being mutated right now are skipped instead of waited on
+            cart_ids = list(stale.select_for_update(skip_locked=True)
+                            .values_list('id', flat=True)[:batch_size])
+            if not cart_ids:
+                return totals
+            CartItem.objects.filter(cart_id__in=cart_ids, order__isnull=False).update(cart=None)
+            lines, freed = _delete_lines(CartItem.objects.filter(cart_id__in=cart_ids))
+            _, deleted = Cart.objects.filter(id__in=cart_ids).delete()
+        totals['carts'] += deleted.get(Cart._meta.label, 0)
+        totals['lines'] += lines
+        totals['bytes'] += freed
+        logger.info(f"Purged {len(cart_ids)} abandoned cart(s)")
@@ -0,0 +1,258 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Cart, CartItem, Product
+from .prescription_storage import attach_prescription, release_prescription
+
+logger = logging.getLogger(__name__)
+
+# Keeps a loaded cart's hash alive in Redis even when it holds no products
+LOADED_FIELD = '_'
+
+# Only the first concurrent loader may seed the hash from the database
+LOAD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('SET', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+# Decrement only while the line keeps at least one unit, mirroring the db path
+DECREMENT_SCRIPT = """
+local quantity = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if quantity <= 1 then
+    return 0
+end
+quantity = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+redis.call('SADD', KEYS[3], ARGV[3])
+return quantity
+"""
+
+
+def redis_cart_enabled():
+    return getattr(settings, 'CART_BACKEND', 'db') == 'redis'
+
+
+class RedisCartStore:
+    """
+    Live carts kept in Redis hashes of product id -> quantity.
+
+    Mutations are single round trips that never touch the database. Changed
+    carts are recorded in a dirty set and written back to Cart/CartItem by
+    flush_dirty (see the flush_carts command), or synchronously via persist
+    before checkout.
+    """
+    dirty_key = 'cart:dirty'
+
+    def __init__(self, connection=None, ttl=None):
+        self._connection = connection
+        self.ttl = ttl or getattr(settings, 'CART_REDIS_TTL', 60 * 60 * 24 * 7)
+
+    @property
+    def redis(self):
+        if self._connection is None:
+            from django_redis import get_redis_connection
+            self._connection = get_redis_connection('default')
+        return self._connection
+
+    def items_key(self, user_id):
+        return f"cart:{user_id}:items"
+
+    def version_key(self, user_id):
+        return f"cart:{user_id}:version"
+
+    def load(self, user_id):
+        """Seed the Redis copy of a cart from the database if it is not cached"""
+        if self.redis.exists(self.items_key(user_id)):
+            return
+
+        cart = Cart.objects.filter(user_id=user_id).only('id', 'version').first()
+        fields = [LOADED_FIELD, 0]
+        if cart:
+            for product_id, quantity in CartItem.objects.filter(
+                    cart=cart, order__isnull=True).values_list('product_id', 'quantity'):
+                fields += [product_id, quantity]
+
+        self.redis.eval(
+            LOAD_SCRIPT, 2, self.items_key(user_id), self.version_key(user_id),
+            cart.version if cart else 0, self.ttl, *fields
+        )
+
+    def _mutate(self, user_id, *commands):
+        key = self.items_key(user_id)
+        version_key = self.version_key(user_id)
+        pipe = self.redis.pipeline()
+        for command, args in commands:
+            getattr(pipe, command)(key, *args)
+        pipe.incr(version_key)
+        pipe.expire(key, self.ttl)
+        pipe.expire(version_key, self.ttl)
+        pipe.sadd(self.dirty_key, user_id)
+        return pipe.execute()
+
+    def add(self, user_id, product_id, quantity=1):
+        """Atomically add units of a product, returns the new line quantity"""
+        self.load(user_id)
+        return self._mutate(user_id, ('hincrby', (product_id, quantity)))[0]
+
+    def decrement(self, user_id, product_id):
+        """Remove one unit if more than one is left, returns 0 otherwise"""
+        self.load(user_id)
+        return self.redis.eval(
+            DECREMENT_SCRIPT, 3, self.items_key(user_id), self.version_key(user_id), self.dirty_key,
+            product_id, self.ttl, user_id
+        )
+
+    def set_quantity(self, user_id, product_id, quantity):
+        self.load(user_id)
+        self._mutate(user_id, ('hset', (product_id, quantity)))
+
+    def remove(self, user_id, product_id):
+        """Drop a line, returns False if the product was not in the cart"""
+        self.load(user_id)
+        return bool(self._mutate(user_id, ('hdel', (product_id,)))[0])
+
+    def apply(self, user_id, commands):
+        """Run several hash commands on one cart as a single MULTI/EXEC"""
+        self.load(user_id)
+        return self._mutate(user_id, *commands)
+
+    def contains(self, user_id, product_id):
+        self.load(user_id)
+        return bool(self.redis.hexists(self.items_key(user_id), product_id))
+
+    def quantities(self, user_id):
+        """Current product id -> quantity map and cart version"""
+        self.load(user_id)
+        pipe = self.redis.pipeline()
+        pipe.hgetall(self.items_key(user_id))
+        pipe.get(self.version_key(user_id))
+        items, version = pipe.execute()
+        quantities = {
+            int(product_id): int(quantity)
+            for product_id, quantity in items.items()
+            if _text(product_id) != LOADED_FIELD
+        }
+        return quantities, int(version or 0)
+
+    def lines(self, user_id, product_ids=None):
+        """Unsaved CartItem objects for the snapshot builder, plus the version"""
+        quantities, version = self.quantities(user_id)
+        if product_ids is not None:
+            quantities = {
+                product_id: quantity for product_id, quantity in quantities.items() if product_id in product_ids
+            }
+        if not quantities:
+            return [], version
+
+        products = Product.objects.in_bulk(list(quantities))
+        persisted = {
+            product_id: (item_id, prescription_file)
+            for product_id, item_id, prescription_file in CartItem.objects.filter(
+                cart__user_id=user_id, order__isnull=True, product_id__in=list(quantities)
+            ).values_list('product_id', 'id', 'prescription_file')
+        }
+
+        lines = []
+        for product_id in sorted(quantities):
+            product = products.get(product_id)
+            if product is None:
+                continue
+            item_id, prescription_file = persisted.get(product_id, (None, None))
+            lines.append(CartItem(
+                id=item_id,
+                product=product,
+                quantity=quantities[product_id],
+                prescription_file=prescription_file
+            ))
+        return lines, version
+
+    def persist(self, user_id):
+        """Write a cart back to the database; safe to call at any time"""
+        # Claim before reading: a mutation after this point marks it dirty again
+        self.redis.srem(self.dirty_key, user_id)
+        if not self.redis.exists(self.items_key(user_id)):
+            # Expired or never loaded, the database copy is already authoritative
+            return None
+
+        quantities, version = self.quantities(user_id)
+        products = set(Product.objects.filter(id__in=list(quantities)).values_list('id', flat=True))
+
+        with transaction.atomic():
+            cart, _ = Cart.objects.get_or_create(user_id=user_id)
+            existing = {
+                item.product_id: item
+                for item in CartItem.objects.filter(cart=cart, order__isnull=True)
+            }
+
+            to_create, to_update = [], []
+            for product_id, quantity in quantities.items():
+                if product_id not in products or quantity < 1:
+                    continue
+                item = existing.pop(product_id, None)
+                if item is None:
+                    to_create.append(CartItem(cart=cart, product_id=product_id, quantity=quantity))
+                elif item.quantity != quantity:
+                    item.quantity = quantity
+                    to_update.append(item)
+
+            CartItem.objects.bulk_create(to_create)
+            CartItem.objects.bulk_update(to_update, ['quantity'])
+            if existing:
+                CartItem.objects.filter(id__in=[item.id for item in existing.values()]).delete()
+            Cart.objects.filter(pk=cart.pk).update(version=version, updated_at=timezone.now())
+
+        cart.version = version
+        return cart
+
+    def attach_prescription(self, user_id, product_id, prescription_file):
+        """Files live on disk, so the line is written through before attaching"""
+        cart = self.persist(user_id)
+        item = CartItem.objects.get(cart=cart, product_id=product_id, order__isnull=True)
+        previous_blob_id = attach_prescription(item, prescription_file, 'prescription_file')
+        item.save(update_fields=['prescription_file', 'prescription_blob'])
+        release_prescription(previous_blob_id)
+        self._mutate(user_id)
+        return item
+
+    def clear(self, user_id):
+        self.redis.delete(self.items_key(user_id), self.version_key(user_id))
+        self.redis.srem(self.dirty_key, user_id)
+
+    def flush_dirty(self, batch_size=500):
+        """Write back up to batch_size dirty carts, returns how many were written"""
+        user_ids = self.redis.spop(self.dirty_key, batch_size) or []
+        flushed = 0
+        for user_id in user_ids:
+            user_id = int(user_id)
+            try:
+                self.persist(user_id)
+                flushed += 1
+            except Exception as e:
+                logger.error(f"Error persisting cart for user {user_id}: {e}")
+                self.redis.sadd(self.dirty_key, user_id)
+        return flushed
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+_store = None
+
+
+def get_cart_store():
+    global _store
+    if _store is None:
+        _store = RedisCartStore()
+    return _store
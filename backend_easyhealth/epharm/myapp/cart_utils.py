@@ -0,0 +1,306 @@
+import json
+from decimal import Decimal
+from urllib.parse import urljoin
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .cart_store import get_cart_store, redis_cart_enabled
+from .models import Cart, CartItem, Product
+from .prescription_storage import attach_prescription, release_prescription
+
+# Snapshots are keyed by cart version, so a mutation never has to delete them
+CART_SNAPSHOT_TIMEOUT = 300
+
+
+def cart_snapshot_key(user_id, version):
+    return f"cart_snapshot_{user_id}_v{version}"
+
+
+def bump_cart_version(cart):
+    """Mark the cart as changed; call after the line writes of a mutation"""
+    Cart.objects.filter(pk=cart.pk).update(version=F('version') + 1, updated_at=timezone.now())
+    cart.refresh_from_db(fields=['version'])
+    return cart.version
+
+
+def empty_cart_snapshot():
+    return {'cart_items': [], 'total_price': 0.0, 'version': 0}
+
+
+def build_cart_snapshot(cart):
+    """Load the open lines of a cart with their products in one joined query"""
+    items = (CartItem.objects
+             .filter(cart=cart, order__isnull=True)
+             .select_related('product')
+             .order_by('id'))
+    return snapshot_from_lines(items, cart.version)
+
+
+def snapshot_from_lines(items, version):
+    cart_items = []
+    total_price = Decimal('0')
+    for item in items:
+        product = item.product
+        total_item_price = product.price * item.quantity
+        total_price += total_item_price
+        cart_items.append({
+            'id': item.id,
+            'product_id': product.id,
+            'name': product.name,
+            'quantity': item.quantity,
+            'price': float(product.price),
+            'total_item_price': float(total_item_price),
+            # Media paths stay relative in the cache, see render_cart_snapshot
+            'image': product.image.url if product.image else None,
+            'prescription': item.prescription_file.url if item.prescription_file else None,
+        })
+
+    return {
+        'cart_items': cart_items,
+        'total_price': float(total_price),
+        'version': version,
+    }
+
+
+def render_cart_snapshot(request, snapshot):
+    """Turn cached media paths into absolute URLs for the current host"""
+    base_url = request.build_absolute_uri('/')
+    cart_items = [dict(
+        item,
+        image=urljoin(base_url, item['image']) if item['image'] else None,
+        prescription=urljoin(base_url, item['prescription']) if item['prescription'] else None,
+    ) for item in snapshot['cart_items']]
+    return dict(snapshot, cart_items=cart_items)
+
+
+def get_cart_snapshot(request, cart=None):
+    """Cart payload shared by every cart endpoint, cached per user and version"""
+    if redis_cart_enabled():
+        lines, version = get_cart_store().lines(request.user.id)
+        return render_cart_snapshot(request, snapshot_from_lines(lines, version))
+
+    if cart is None:
+        cart = Cart.objects.filter(user=request.user).only('id', 'user_id', 'version').first()
+    if cart is None:
+        return empty_cart_snapshot()
+
+    key = cart_snapshot_key(cart.user_id, cart.version)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_cart_snapshot(cart)
+        cache.set(key, snapshot, timeout=CART_SNAPSHOT_TIMEOUT)
+
+    return render_cart_snapshot(request, snapshot)
+
+
+def client_cart_version(request):
+    """Cart version the client last saw, from If-Match or since_version"""
+    value = request.headers.get('If-Match') or request.query_params.get('since_version')
+    if value is None and hasattr(request.data, 'get'):
+        value = request.data.get('since_version')
+    if value is None:
+        return None
+
+    value = str(value).strip()
+    if value.startswith('W/'):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        return None
+
+
+def get_cart_delta(request, cart, product_ids):
+    """
+    Response for a cart mutation that touched product_ids.
+
+    When the client sent the version it holds and this mutation is the only
+    change since, only the touched lines and the new totals are returned
+    (delta=True). Otherwise the full snapshot is returned so it can resync.
+    """
+    since = client_cart_version(request)
+    product_ids = {int(product_id) for product_id in product_ids}
+
+    if redis_cart_enabled():
+        store = get_cart_store()
+        quantities, version = store.quantities(request.user.id)
+    else:
+        version = cart.version if cart else 0
+
+    if since is None or version != since + 1:
+        return dict(get_cart_snapshot(request, cart), delta=False)
+
+    if redis_cart_enabled():
+        lines, _ = store.lines(request.user.id, product_ids)
+        prices = dict(Product.objects.filter(id__in=list(quantities)).values_list('id', 'price'))
+        total_price = sum(
+            (prices[product_id] * quantity for product_id, quantity in quantities.items() if product_id in prices),
+            Decimal('0')
+        )
+        item_count = len(prices)
+    else:
+        lines = (CartItem.objects
+                 .filter(cart=cart, order__isnull=True, product_id__in=product_ids)
+                 .select_related('product')
+                 .order_by('id'))
+        totals = CartItem.objects.filter(cart=cart, order__isnull=True).aggregate(
+            total_price=Sum(F('quantity') * F('product__price'),
+                            output_field=DecimalField(max_digits=12, decimal_places=2)),
+            item_count=Count('id')
+        )
+        total_price = totals['total_price'] or Decimal('0')
+        item_count = totals['item_count']
+
+    changed = snapshot_from_lines(lines, version)['cart_items']
+    present = {item['product_id'] for item in changed}
+    return render_cart_snapshot(request, {
+        'delta': True,
+        'version': version,
+        'cart_items': changed,
+        'removed_product_ids': sorted(product_ids - present),
+        'total_price': float(total_price),
+        'item_count': item_count,
+    })
+
+
+def cart_response(payload, status=200):
+    """Cart payload with its version exposed as an ETag for If-Match/If-None-Match"""
+    response = Response(payload, status=status)
+    response['ETag'] = f'"{payload.get("version", 0)}"'
+    return response
+
+
+CART_OPERATIONS = ('add', 'set', 'remove', 'attach_prescription')
+
+
+def parse_cart_operations(operations, files):
+    """Validate a batch of cart operations, raising ValueError on the first bad one"""
+    if isinstance(operations, str):
+        try:
+            operations = json.loads(operations)
+        except json.JSONDecodeError:
+            raise ValueError("operations must be a JSON list")
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("operations must be a non-empty list")
+
+    parsed = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATIONS:
+            raise ValueError(f"Operation {index}: op must be one of {', '.join(CART_OPERATIONS)}")
+        try:
+            product_id = int(operation.get('product_id'))
+        except (TypeError, ValueError):
+            raise ValueError(f"Operation {index}: product_id is required")
+
+        op = operation['op']
+        entry = {'op': op, 'product_id': product_id}
+        if op in ('add', 'set'):
+            try:
+                quantity = int(operation.get('quantity', 1))
+            except (TypeError, ValueError):
+                raise ValueError(f"Operation {index}: quantity must be a number")
+            if quantity < (1 if op == 'add' else 0):
+                raise ValueError(f"Operation {index}: invalid quantity {quantity}")
+            entry['quantity'] = quantity
+        elif op == 'attach_prescription':
+            prescription_file = files.get(operation.get('file') or 'prescription')
+            if prescription_file is None:
+                raise ValueError(f"Operation {index}: no uploaded file named {operation.get('file')!r}")
+            entry['file'] = prescription_file
+        parsed.append(entry)
+    return parsed
+
+
+def apply_cart_operations(user, operations):
+    """
+    Apply parsed operations in order as one unit and return the touched cart.
+
+    Quantities are folded in memory and written with one bulk insert, one bulk
+    update and one delete, whatever the number of operations.
+    """
+    product_ids = {operation['product_id'] for operation in operations}
+    products = Product.objects.in_bulk(list(product_ids))
+    missing = product_ids - set(products)
+    if missing:
+        raise Product.DoesNotExist(f"Products not found: {', '.join(map(str, sorted(missing)))}")
+
+    if redis_cart_enabled():
+        return _apply_redis_cart_operations(user, operations, products)
+
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(user=user)
+        existing = {
+            item.product_id: item
+            for item in CartItem.objects.select_for_update().filter(
+                cart=cart, order__isnull=True, product_id__in=product_ids)
+        }
+        quantities = {product_id: item.quantity for product_id, item in existing.items()}
+        prescriptions = {}
+
+        for operation in operations:
+            product_id = operation['product_id']
+            if operation['op'] == 'add':
+                quantities[product_id] = quantities.get(product_id, 0) + operation['quantity']
+            elif operation['op'] == 'set':
+                quantities[product_id] = operation['quantity']
+            elif operation['op'] == 'remove':
+                quantities.pop(product_id, None)
+                prescriptions.pop(product_id, None)
+            elif products[product_id].prescription_required and quantities.get(product_id):
+                prescriptions[product_id] = operation['file']
+
+        to_create, to_update, to_delete, released_blob_ids = [], [], [], []
+        for product_id in product_ids:
+            quantity = quantities.get(product_id, 0)
+            item = existing.get(product_id)
+            if quantity < 1:
+                if item:
+                    to_delete.append(item.id)
+                continue
+            if item is None:
+                item = CartItem(cart=cart, product=products[product_id], quantity=quantity)
+                to_create.append(item)
+            elif item.quantity != quantity or product_id in prescriptions:
+                item.quantity = quantity
+                to_update.append(item)
+            if product_id in prescriptions:
+                # Bulk writes skip file storage, so store the upload up front
+                released_blob_ids.append(
+                    attach_prescription(item, prescriptions[product_id], 'prescription_file'))
+
+        CartItem.objects.bulk_create(to_create)
+        CartItem.objects.bulk_update(to_update, ['quantity', 'prescription_file', 'prescription_blob'])
+        CartItem.objects.filter(id__in=to_delete).delete()
+        for blob_id in released_blob_ids:
+            release_prescription(blob_id)
+        bump_cart_version(cart)
+
+    return cart
+
+
+def _apply_redis_cart_operations(user, operations, products):
+    commands = []
+    prescriptions = {}
+    for operation in operations:
+        product_id = operation['product_id']
+        if operation['op'] == 'add':
+            commands.append(('hincrby', (product_id, operation['quantity'])))
+        elif operation['op'] == 'set' and operation['quantity'] > 0:
+            commands.append(('hset', (product_id, operation['quantity'])))
+        elif operation['op'] in ('set', 'remove'):
+            commands.append(('hdel', (product_id,)))
+            prescriptions.pop(product_id, None)
+        elif products[product_id].prescription_required:
+            prescriptions[product_id] = operation['file']
+
+    store = get_cart_store()
+    store.apply(user.id, commands)
+    quantities, _ = store.quantities(user.id)
+    for product_id, upload in prescriptions.items():
+        if quantities.get(product_id):
+            store.attach_prescription(user.id, product_id, upload)
+    return None
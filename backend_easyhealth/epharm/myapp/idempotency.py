@@ -0,0 +1,175 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 100
+
+
+def idempotency_ttl():
+    return getattr(settings, 'IDEMPOTENCY_TTL', 60 * 60 * 24)
+
+
+def idempotency_lock_timeout():
+    return getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60)
+
+
+class CacheIdempotencyStore:
+    """
+    Keys live in the default cache (Redis in production).
+
+    cache.add is a SET NX, so exactly one request claims a key; the claim
+    expires after the lock timeout in case its worker dies mid-request.
+    """
+
+    def cache_key(self, scope):
+        return f"idempotency:{scope}"
+
+    def begin(self, scope, fingerprint):
+        claim = {'fingerprint': fingerprint, 'status': None, 'body': None}
+        if cache.add(self.cache_key(scope), claim, timeout=idempotency_lock_timeout()):
+            return None
+        record = cache.get(self.cache_key(scope))
+        if record is None and cache.add(self.cache_key(scope), claim, timeout=idempotency_lock_timeout()):
+            # The previous claim expired between the two calls
+            return None
+        return record or claim
+
+    def complete(self, scope, fingerprint, response_status, body):
+        record = {'fingerprint': fingerprint, 'status': response_status, 'body': body}
+        cache.set(self.cache_key(scope), record, timeout=idempotency_ttl())
+
+    def release(self, scope):
+        cache.delete(self.cache_key(scope))
+
+
+class DatabaseIdempotencyStore:
+    """Keys kept in the IdempotencyKey table, the unique scope column acts as the lock"""
+
+    def begin(self, scope, fingerprint):
+        now = timezone.now()
+        lock = {
+            'fingerprint': fingerprint,
+            'response_status': None,
+            'response_body': None,
+            'locked_until': now + timedelta(seconds=idempotency_lock_timeout()),
+            'expires_at': now + timedelta(seconds=idempotency_ttl()),
+        }
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(scope=scope, **lock)
+            return None
+        except IntegrityError:
+            pass
+
+        # Take over a stored response that expired or a claim whose request died
+        stale = Q(expires_at__lte=now) | Q(response_status__isnull=True, locked_until__lte=now)
+        if IdempotencyKey.objects.filter(stale, scope=scope).update(**lock):
+            return None
+
+        record = IdempotencyKey.objects.filter(scope=scope).values(
+            'fingerprint', 'response_status', 'response_body').first()
+        if record is None:
+            return self.begin(scope, fingerprint)
+        return {'fingerprint': record['fingerprint'], 'status': record['response_status'],
+                'body': record['response_body']}
+
+    def complete(self, scope, fingerprint, response_status, body):
+        IdempotencyKey.objects.filter(scope=scope).update(
+            response_status=response_status,
+            response_body=body,
+            expires_at=timezone.now() + timedelta(seconds=idempotency_ttl())
+        )
+
+    def release(self, scope):
+        IdempotencyKey.objects.filter(scope=scope, response_status__isnull=True).delete()
+
+    def purge_expired(self):
+        deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+        return deleted
+
+
+def get_idempotency_store():
+    if getattr(settings, 'IDEMPOTENCY_BACKEND', 'redis') == 'db':
+        return DatabaseIdempotencyStore()
+    return CacheIdempotencyStore()
+
+
+def request_fingerprint(request):
+    """Hash of the request body, so a key reused for a different request is caught"""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = {key: values for key, values in data.lists() if key not in request.FILES}
+    files = {
+        key: [(upload.name, upload.size) for upload in request.FILES.getlist(key)]
+        for key in request.FILES
+    }
+    payload = json.dumps([request.path, data, files], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def idempotent(view_method):
+    """
+    Honour an Idempotency-Key header on an APIView handler.
+
+    The first request with a key runs normally and its response is stored
+    for IDEMPOTENCY_TTL seconds; retries get that response replayed without
+    running the view again. A retry that arrives while the first request is
+    still running gets a 409. Server errors are not stored, so they can be
+    retried with the same key. Requests without the header are untouched.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        user_id = request.user.id if request.user.is_authenticated else 'anon'
+        scope = f"{user_id}:{request.path}:{key}"
+        fingerprint = request_fingerprint(request)
+        store = get_idempotency_store()
+
+        record = store.begin(scope, fingerprint)
+        if record is not None:
+            if record['status'] is None:
+                response = Response({'error': 'A request with this Idempotency-Key is still being processed'},
+                                    status=status.HTTP_409_CONFLICT)
+                response['Retry-After'] = '1'
+                return response
+            if record['fingerprint'] != fingerprint:
+                return Response({'error': f'{HEADER} was already used for a different request'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            response = Response(record['body'], status=record['status'])
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            store.release(scope)
+            raise
+
+        if response.status_code >= 500:
+            store.release(scope)
+        else:
+            # Stored as the JSON the client saw, so replays render identically
+            body = json.loads(json.dumps(response.data, cls=JSONEncoder))
+            store.complete(scope, fingerprint, response.status_code, body)
+        return response
+
+    return wrapper
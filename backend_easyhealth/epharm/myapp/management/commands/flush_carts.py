@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.cart_store import get_cart_store, redis_cart_enabled
+
+
+class Command(BaseCommand):
+    help = "Write carts changed in Redis back to the Cart/CartItem tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=5,
+                            help="Seconds to sleep between passes when the dirty set is drained")
+        parser.add_argument('--once', action='store_true', help="Drain the dirty set once and exit")
+
+    def handle(self, *args, **options):
+        if not redis_cart_enabled():
+            self.stdout.write("CART_BACKEND is not 'redis', nothing to flush.")
+            return
+
+        store = get_cart_store()
+        while True:
+            flushed = store.flush_dirty(batch_size=options['batch_size'])
+            if flushed:
+                self.stdout.write(f"Persisted {flushed} cart(s)")
+                if flushed == options['batch_size']:
+                    continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.prescription_hashing import hash_pending_blobs
+
+
+class Command(BaseCommand):
+    help = "Compute perceptual hashes for stored prescription images in a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+        parser.add_argument('--interval', type=float, default=30,
+                            help="Seconds to sleep when there is nothing to hash")
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new uploads")
+
+    def handle(self, *args, **options):
+        while True:
+            hashed = hash_pending_blobs(batch_size=options['batch_size'], workers=options['workers'])
+            if hashed:
+                self.stdout.write(f"Hashed {hashed} prescription(s)")
+                continue
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
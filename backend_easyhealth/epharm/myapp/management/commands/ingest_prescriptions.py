@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from myapp.prescription_storage import INGEST_BATCH_SIZE, ingest_legacy_prescriptions
+
+
+class Command(BaseCommand):
+    help = "Move prescriptions uploaded before the blob store into it, run hash_prescriptions afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=INGEST_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        counts = ingest_legacy_prescriptions(batch_size=options['batch_size'])
+        self.stdout.write(
+            f"Ingested {counts['ingested']} prescription(s), {counts['missing']} file(s) missing"
+        )
@@ -0,0 +1,49 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+
+from myapp.order_intake import process_order_requests, purge_finished_requests
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF = 30  # Seconds
+
+
+class Command(BaseCommand):
+    help = "Place orders accepted in queued intake mode (ORDER_INTAKE_MODE=queue)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.ORDER_INTAKE_BATCH_SIZE,
+                            help="Requests placed per transaction")
+        parser.add_argument('--interval', type=float, default=0.2,
+                            help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--loop', action='store_true', help="Keep processing instead of exiting")
+        parser.add_argument('--purge-days', type=int, default=7,
+                            help="Delete finished requests older than this many days on start")
+
+    def handle(self, *args, **options):
+        purged = purge_finished_requests(options['purge_days'])
+        if purged:
+            self.stdout.write(f"Purged {purged} finished request(s)")
+
+        failures = 0
+        while True:
+            try:
+                handled = process_order_requests(batch_size=options['batch_size'])
+            except OperationalError as e:
+                # e.g. "database is locked" while another worker writes; claimed requests are taken over later
+                failures += 1
+                delay = min(options['interval'] * 2 ** failures, MAX_BACKOFF)
+                logger.warning(f"Order intake hit a database error, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                continue
+            failures = 0
+            if handled:
+                self.stdout.write(f"Handled {handled} order request(s)")
+                continue
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from myapp.cart_purge import PURGE_BATCH_SIZE, purge_abandoned_carts, purge_orphaned_lines
+
+
+class Command(BaseCommand):
+    help = "Delete abandoned carts and orphaned cart lines in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--abandoned-days', type=int,
+                            help="Age of a cart with lines before it is purged (default CART_ABANDONED_DAYS)")
+        parser.add_argument('--empty-days', type=int,
+                            help="Age of an empty cart before it is purged (default EMPTY_CART_DAYS)")
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be deleted")
+
+    def handle(self, *args, **options):
+        carts = purge_abandoned_carts(
+            abandoned_days=options['abandoned_days'],
+            empty_days=options['empty_days'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run']
+        )
+        orphans = purge_orphaned_lines(batch_size=options['batch_size'], dry_run=options['dry_run'])
+
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(
+            f"{verb} {carts['carts']} cart(s) and {carts['lines'] + orphans['lines']} cart line(s), "
+            f"freeing {carts['bytes'] + orphans['bytes']} bytes of prescription files"
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from myapp.idempotency import DatabaseIdempotencyStore
+
+
+class Command(BaseCommand):
+    help = "Delete expired Idempotency-Key responses stored in the database"
+
+    def handle(self, *args, **options):
+        deleted = DatabaseIdempotencyStore().purge_expired()
+        self.stdout.write(f"Deleted {deleted} expired idempotency key(s)")
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.payment_reconcile import RECONCILE_BATCH_SIZE, RECONCILE_CONCURRENCY, reconcile_pending_payments
+
+
+class Command(BaseCommand):
+    help = "Settle payments stuck in PENDING from the eSewa transaction status API"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=None,
+                            help="Minutes a payment must have been pending (default PAYMENT_RECONCILE_AFTER_MINUTES)")
+        parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE)
+        parser.add_argument('--concurrency', type=int, default=RECONCILE_CONCURRENCY,
+                            help="Status requests in flight at once")
+        parser.add_argument('--interval', type=float, default=300,
+                            help="Seconds between runs with --loop")
+        parser.add_argument('--loop', action='store_true', help="Keep reconciling instead of exiting")
+
+    def handle(self, *args, **options):
+        while True:
+            totals = reconcile_pending_payments(older_than_minutes=options['older_than'],
+                                                batch_size=options['batch_size'],
+                                                concurrency=options['concurrency'])
+            self.stdout.write(", ".join(f"{count} {outcome}" for outcome, count in totals.items()))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
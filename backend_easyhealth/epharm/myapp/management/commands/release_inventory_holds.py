@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.order_utils import HOLD_RELEASE_BATCH_SIZE, release_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Return stock held by unpaid online orders whose hold has expired"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=HOLD_RELEASE_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=30,
+                            help="Seconds to sleep when nothing has expired")
+        parser.add_argument('--loop', action='store_true', help="Keep sweeping instead of exiting")
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_holds(batch_size=options['batch_size'])
+            if released:
+                self.stdout.write(f"Released {released} hold(s)")
+                continue
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,64 @@
+import logging
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+
+from myapp.tasks import purge_finished, run_pending
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF = 30  # Seconds
+
+
+def work(batch_size, interval, once):
+    failures = 0
+    while True:
+        try:
+            handled = run_pending(batch_size=batch_size)
+        except OperationalError as e:
+            # e.g. "database is locked" while another worker writes; a lost job's lease runs out and it is retried
+            failures += 1
+            delay = min(interval * 2 ** failures, MAX_BACKOFF)
+            logger.warning(f"Task worker hit a database error, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+            continue
+        failures = 0
+        if handled:
+            continue
+        if once:
+            return
+        time.sleep(interval)
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (order emails, invoices, pharmacist notifications)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help="Worker processes to run")
+        parser.add_argument('--batch-size', type=int, default=10, help="Jobs leased per claim")
+        parser.add_argument('--interval', type=float, default=2, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Drain the queue and exit")
+        parser.add_argument('--purge-days', type=int, default=7,
+                            help="Delete finished jobs older than this many days on start")
+
+    def handle(self, *args, **options):
+        purged = purge_finished(options['purge_days'])
+        if purged:
+            self.stdout.write(f"Purged {purged} finished job(s)")
+
+        worker_args = (options['batch_size'], options['interval'], options['once'])
+        if options['workers'] <= 1:
+            work(*worker_args)
+            return
+
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+        workers = [multiprocessing.Process(target=work, args=worker_args, daemon=True)
+                   for _ in range(options['workers'])]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {len(workers)} worker(s)")
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+def populate_generic_key(apps, schema_editor):
+    Product = apps.get_model('myapp', 'Product')
+    products = []
+    for product in Product.objects.only('id', 'generic_name').iterator(chunk_size=500):
+        product.generic_key = ' '.join((product.generic_name or '').lower().split())
+        products.append(product)
+    Product.objects.bulk_update(products, ['generic_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0033_remove_booking_service_remove_userpayment_booking_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='generic_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(populate_generic_key, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['generic_key', 'price'], name='product_generic_price_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_open_lines(apps, schema_editor):
+    CartItem = apps.get_model('myapp', 'CartItem')
+    duplicates = (CartItem.objects
+                  .filter(order__isnull=True)
+                  .values('cart_id', 'product_id')
+                  .annotate(lines=Count('id'), keep_id=Min('id'), quantity=Sum('quantity'))
+                  .filter(lines__gt=1))
+
+    for duplicate in duplicates:
+        lines = CartItem.objects.filter(
+            order__isnull=True,
+            cart_id=duplicate['cart_id'],
+            product_id=duplicate['product_id']
+        )
+        lines.filter(id=duplicate['keep_id']).update(quantity=duplicate['quantity'])
+        lines.exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0035_cart_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_open_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(order__isnull=True),
+                fields=('cart', 'product'),
+                name='unique_open_cart_line'
+            ),
+        ),
+    ]
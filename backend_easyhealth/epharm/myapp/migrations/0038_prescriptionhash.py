@@ -0,0 +1,27 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0037_prescriptionblob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrescriptionHash',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phash', models.BigIntegerField(blank=True, null=True)),
+                ('dhash', models.BigIntegerField(blank=True, null=True)),
+                ('band0', models.PositiveIntegerField(db_index=True, null=True)),
+                ('band1', models.PositiveIntegerField(db_index=True, null=True)),
+                ('band2', models.PositiveIntegerField(db_index=True, null=True)),
+                ('band3', models.PositiveIntegerField(db_index=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE,
+                                              related_name='perceptual_hash', to='myapp.prescriptionblob')),
+            ],
+        ),
+    ]
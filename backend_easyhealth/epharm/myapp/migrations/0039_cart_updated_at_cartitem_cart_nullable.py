@@ -0,0 +1,32 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def detach_order_lines(apps, schema_editor):
+    # Order-linked lines were created with the default cart=1; they belong to the order only
+    CartItem = apps.get_model('myapp', 'CartItem')
+    CartItem.objects.filter(order__isnull=False).update(cart=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0038_prescriptionhash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='cartitem',
+            name='cart',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    related_name='cart_items', to='myapp.cart'),
+        ),
+        migrations.RunPython(detach_order_lines, migrations.RunPython.noop),
+    ]
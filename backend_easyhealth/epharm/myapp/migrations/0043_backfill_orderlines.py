@@ -0,0 +1,43 @@
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+
+def backfill_order_lines(apps, schema_editor):
+    """
+    Copy order-linked cart lines into OrderLine, one short transaction per batch.
+
+    Prices were never recorded, so the current product price is the best
+    snapshot available for historical orders.
+    """
+    CartItem = apps.get_model('myapp', 'CartItem')
+    OrderLine = apps.get_model('myapp', 'OrderLine')
+
+    last_id = 0
+    while True:
+        rows = list(CartItem.objects
+                    .filter(id__gt=last_id, order__isnull=False)
+                    .order_by('id')
+                    .values_list('id', 'order_id', 'product_id', 'product__name', 'product__price', 'quantity')
+                    [:BATCH_SIZE])
+        if not rows:
+            return
+        with transaction.atomic():
+            OrderLine.objects.bulk_create([
+                OrderLine(order_id=order_id, product_id=product_id, product_name=name or '',
+                          unit_price=price, quantity=quantity)
+                for _, order_id, product_id, name, price, quantity in rows
+            ])
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('myapp', '0042_orderline'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_order_lines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('myapp', '0047_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', models.TextField()),
+                ('items', models.JSONField()),
+                ('payment_method', models.CharField(blank=True, max_length=20)),
+                ('prescription', models.FileField(blank=True, null=True, upload_to='prescriptions/')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('placed', 'Placed'),
+                                                     ('rejected', 'Rejected')],
+                                            default='queued', max_length=20)),
+                ('error', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                                               related_name='request', to='myapp.order')),
+                ('prescription_blob', models.ForeignKey(blank=True, null=True,
+                                                        on_delete=django.db.models.deletion.PROTECT,
+                                                        related_name='order_requests', to='myapp.prescriptionblob')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_requests',
+                                           to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='order_request_status_idx')],
+            },
+        ),
+    ]
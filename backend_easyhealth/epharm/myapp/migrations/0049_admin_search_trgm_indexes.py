@@ -0,0 +1,44 @@
+from django.db import migrations
+
+# Columns searched with icontains from the admin. Django compares
+# UPPER(column::text), so the trigram indexes are built on that expression.
+# PostgreSQL only; other databases keep plain scans.
+TRIGRAM_INDEXES = [
+    ('customuser_username_trgm', 'myapp_customuser', 'username'),
+    ('customuser_email_trgm', 'myapp_customuser', 'email'),
+    ('userpayment_uuid_trgm', 'myapp_userpayment', 'transaction_uuid'),
+    ('userpayment_code_trgm', 'myapp_userpayment', 'transaction_code'),
+    ('product_name_trgm', 'myapp_product', 'name'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, table, column in TRIGRAM_INDEXES:
+        # CONCURRENTLY keeps the tables writable while large indexes build
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} '
+            f'USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('myapp', '0048_orderrequest'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+# Callbacks used to store the gateway's status verbatim
+LEGACY_STATUSES = {
+    'PAID': ['SUCCESS', 'COMPLETE'],
+    'FAILED': ['FAILURE', 'CANCELED', 'CANCELLED', 'NOT_FOUND'],
+}
+
+
+def normalize_payment_statuses(apps, schema_editor):
+    userPayment = apps.get_model('myapp', 'userPayment')
+    for status, legacy in LEGACY_STATUSES.items():
+        userPayment.objects.filter(status__in=legacy).update(status=status)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0049_admin_search_trgm_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userpayment',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(normalize_payment_statuses, migrations.RunPython.noop),
+    ]
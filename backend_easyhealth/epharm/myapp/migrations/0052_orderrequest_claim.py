@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0051_userpayment_admin_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderrequest',
+            name='claim_token',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderrequest',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='orderrequest',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('placing', 'Placing'), ('placed', 'Placed'), ('rejected', 'Rejected')], default='queued', max_length=20),
+        ),
+    ]
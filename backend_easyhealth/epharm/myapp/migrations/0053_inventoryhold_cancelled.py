@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0052_orderrequest_claim'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='inventoryhold',
+            name='status',
+            field=models.CharField(choices=[('active', 'Active'), ('confirmed', 'Confirmed'),
+                                            ('released', 'Released'), ('cancelled', 'Cancelled')],
+                                   default='active', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0053_inventoryhold_cancelled'),
+    ]
+
+    operations = [
+        # Existing orders default to False: checkouts never took stock and the
+        # older ones cannot be told apart, so cancelling them returns nothing
+        migrations.AddField(
+            model_name='order',
+            name='stock_reserved',
+            field=models.BooleanField(default=False),
+        ),
+    ]
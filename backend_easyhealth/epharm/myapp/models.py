@@ -19,6 +19,13 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.username
 
+def normalize_generic_name(value):
+    """Lower-case and collapse whitespace so brand spellings of a generic group together"""
+    if not value:
+        return ''
+    return ' '.join(value.lower().split())
+
+
 # Product model
 class Product(models.Model):
     CATEGORIES = (
@@ -35,6 +42,7 @@ class Product(models.Model):
 
     id = models.AutoField(primary_key=True)
     generic_name = models.CharField(max_length=200, null=True, blank=True)
+    generic_key = models.CharField(max_length=200, blank=True, default='', editable=False)  # Normalized generic_name
     name = models.CharField(max_length=200, blank=True, null=True)
     image = models.ImageField(upload_to='products/', null=True, blank=True)
     category = models.CharField(max_length=50, choices=CATEGORIES)
@@ -45,11 +53,65 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Serves "same generic, cheapest first" lookups for substitutions
+            models.Index(fields=['generic_key', 'price'], name='product_generic_price_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.generic_key = normalize_generic_name(self.generic_name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'generic_name' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'generic_key'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.generic_name if self.generic_name else self.name if self.name else "Unnamed Product"
 
 
 
+class PrescriptionBlob(models.Model):
+    """One stored copy of an uploaded prescription, shared by every line and order that uploaded it"""
+    digest = models.CharField(max_length=64, unique=True)  # SHA-256 of the contents
+    file = models.FileField(upload_to='prescription_blobs/')
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.ref_count} refs)"
+
+
+class PrescriptionHash(models.Model):
+    """
+    Perceptual hashes of a prescription image, for spotting re-photographed duplicates.
+
+    The 64-bit pHash is also split into four 16-bit bands, each indexed: two
+    hashes within Hamming distance 7 always have a band at most one bit
+    apart, so near-duplicate candidates come from indexed IN lookups over
+    each band and its one-bit neighbours (see prescription_hashing).
+    """
+    blob = models.OneToOneField(PrescriptionBlob, on_delete=models.CASCADE, related_name='perceptual_hash')
+    phash = models.BigIntegerField(null=True, blank=True)  # Null when the file is not an image
+    dhash = models.BigIntegerField(null=True, blank=True)  # Confirms pHash candidates
+    band0 = models.PositiveIntegerField(null=True, db_index=True)
+    band1 = models.PositiveIntegerField(null=True, db_index=True)
+    band2 = models.PositiveIntegerField(null=True, db_index=True)
+    band3 = models.PositiveIntegerField(null=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Hashes of {self.blob}"
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_lines(self):
+        """Customer and lines loaded up front: two queries however many orders are serialized"""
+        return self.select_related('user').prefetch_related(
+            models.Prefetch('lines', queryset=OrderLine.objects.order_by('id')))
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -57,6 +119,7 @@ class Order(models.Model):
         ('paid', 'Paid'),
         ('shipped', 'Shipped'),
         ('delivered', 'Delivered'),
+        ('cancelled', 'Cancelled'),
     ]
     
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
@@ -64,38 +127,154 @@ class Order(models.Model):
     status = models.CharField(max_length=50, choices=STATUS_CHOICES, default='pending')
     address = models.TextField(null=False, default="Unknown Address")  # Add a default value
     prescription = models.FileField(upload_to='prescriptions/', null=True, blank=True)  # Ensure this exists
+    prescription_blob = models.ForeignKey(PrescriptionBlob, on_delete=models.PROTECT, null=True, blank=True,
+                                          related_name='orders')
+    # Set when placing the order took its stock off the shelf; cancelling gives back only what was taken
+    stock_reserved = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Order history pages: newest first per user, see pagination.keyset_page
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_idx'),
+            # Admin order list filtered by status
+            models.Index(fields=['status', 'created_at', 'id'], name='order_status_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='order_created_idx'),
+        ]
+
     def __str__(self):
-        cart_items = self.cartitem_set.all()  # Get related cart items
-        cart_items_str = ", ".join([f"{item.quantity} x {item.product.name}" for item in cart_items])
-        return (f"Order {self.id} - {self.user.first_name} {self.user.last_name} ({self.user.phone}) "
-                f"Status: {self.status} - Address: {self.address} - Cart Items: {cart_items_str}")
+        # Rendered for every option of order dropdowns, so only the row's own columns
+        return f"Order #{self.id} ({self.status})"
 
 # CartItem model\
 
 class Cart(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='cart')
+    version = models.PositiveIntegerField(default=0)  # Bumped on every cart mutation
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Cart of {self.user.username}"
 
 
 class CartItem(models.Model):
-    cart = models.ForeignKey(Cart, related_name='cart_items', on_delete=models.CASCADE,default=1)
+    cart = models.ForeignKey(Cart, related_name='cart_items', on_delete=models.CASCADE, null=True, blank=True)  # None once linked to an order
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True)  # Link to the order
     prescription_file = models.FileField(upload_to='cart_prescriptions/', null=True, blank=True)
+    prescription_blob = models.ForeignKey(PrescriptionBlob, on_delete=models.PROTECT, null=True, blank=True,
+                                          related_name='cart_items')
+
+    class Meta:
+        constraints = [
+            # One open line per product; order-linked lines are free to repeat
+            models.UniqueConstraint(
+                fields=['cart', 'product'],
+                condition=models.Q(order__isnull=True),
+                name='unique_open_cart_line'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
 
 
+class OrderLine(models.Model):
+    """What was bought, copied from the product at purchase time so history never changes"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True)
+    product_name = models.CharField(max_length=200)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Order lines are immutable once written")
+        super().save(*args, **kwargs)
+
+    @property
+    def line_total(self):
+        return self.unit_price * self.quantity
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_name}"
+
+
+class OrderStatusEvent(models.Model):
+    """Append-only history of order status changes"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_events')
+    from_status = models.CharField(max_length=50)
+    to_status = models.CharField(max_length=50)
+    changed_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'created_at'], name='status_event_order_idx'),
+            # "Time in status" reports scan events by target status and date
+            models.Index(fields=['to_status', 'created_at'], name='status_event_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Order {self.order_id}: {self.from_status} -> {self.to_status}"
+
+
+class InventoryHold(models.Model):
+    """Stock taken by an order awaiting online payment, given back if it expires unpaid"""
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('confirmed', 'Confirmed'),
+        ('released', 'Released'),
+        ('cancelled', 'Cancelled'),  # The order was cancelled by staff and its stock given back
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='inventory_holds')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='hold_status_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for order {self.order_id} ({self.status})"
+
+
 
 from django.utils import timezone
 
+
+class PaymentQuerySet(models.QuerySet):
+    def for_listing(self):
+        """Payer, order and order lines loaded up front, for serializing many payments"""
+        return self.select_related('user', 'order').prefetch_related(
+            models.Prefetch('order__lines', queryset=OrderLine.objects.order_by('id')))
+
+    def admin_rows(self):
+        """
+        Plain dicts for the admin payments list, payer and order columns joined in.
+
+        Skips building model instances and serializer fields per row; see
+        serializers.admin_payment_row for the response shape.
+        """
+        return self.values(
+            'id', 'transaction_uuid', 'transaction_code', 'amount', 'tax_amount', 'total_amount', 'status',
+            'product_code', 'order_id', 'created_at', 'updated_at',
+            user_username=models.F('user__username'),
+            user_email=models.F('user__email'),
+            order_status=models.F('order__status'),
+            order_total=models.F('order__total_price'),
+        )
+
+
 class userPayment(models.Model):
     STATUS_CHOICES = [
         ('PENDING', 'Pending'),
@@ -113,14 +292,100 @@ class userPayment(models.Model):
     transaction_uuid = models.CharField(max_length=100, unique=True)
     transaction_code = models.CharField(max_length=100, null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    version = models.PositiveIntegerField(default=0)  # Bumped on every status change, see payment_utils
     product_code = models.CharField(max_length=50, default='EPAYTEST')
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
-    
+
+    objects = PaymentQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.transaction_uuid} - {self.status}"
 
+    class Meta:
+        indexes = [
+            # Admin payments list, newest first, optionally filtered by status
+            models.Index(fields=['status', 'created_at', 'id'], name='payment_status_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='payment_created_idx'),
+        ]
+
     def get_order_details(self):
         if self.order:
             return f"Order ID: {self.order.id}, Status: {self.order.status}, Address: {self.order.address}, Total: {self.order.total_price}"
         return "No order details available"
+
+
+class IdempotencyKey(models.Model):
+    """Stored responses for Idempotency-Key requests when they are not kept in Redis"""
+    scope = models.CharField(max_length=255, unique=True)  # user, endpoint and client key
+    fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)  # None while in progress
+    response_body = models.JSONField(null=True, blank=True)
+    locked_until = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.scope} - {self.response_status or 'in progress'}"
+
+
+class Task(models.Model):
+    """A background job in the database-backed queue, see tasks.py"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    available_at = models.DateTimeField(default=timezone.now)  # Not run before this, pushed back on retry
+    locked_until = models.DateTimeField(null=True, blank=True)  # Lease of the worker running it
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='task_status_available_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+
+
+class OrderRequest(models.Model):
+    """An order accepted in queued intake mode and waiting to be placed, see order_intake.py"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('placing', 'Placing'),  # Claimed by an intake worker
+        ('placed', 'Placed'),
+        ('rejected', 'Rejected'),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='order_requests')
+    address = models.TextField()
+    items = models.JSONField()  # {product_id: quantity} as validated by parse_order_items
+    payment_method = models.CharField(max_length=20, blank=True)
+    prescription = models.FileField(upload_to='prescriptions/', null=True, blank=True)
+    prescription_blob = models.ForeignKey(PrescriptionBlob, on_delete=models.PROTECT, null=True, blank=True,
+                                          related_name='order_requests')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    order = models.OneToOneField(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='request')
+    error = models.JSONField(null=True, blank=True)  # Same body the synchronous path would have returned
+    claim_token = models.UUIDField(null=True, blank=True)  # The worker batch placing it
+    claimed_until = models.DateTimeField(null=True, blank=True)  # Another worker may take over after this
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='order_request_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Order request #{self.id} by {self.user_id} ({self.status})"
@@ -0,0 +1,186 @@
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import InventoryHold, Order, OrderLine, OrderRequest, Product
+from .order_utils import _per_product, line_for
+from .prescription_storage import attach_prescription, release_prescription
+from .tasks import order_created
+
+logger = logging.getLogger(__name__)
+
+
+class BatchConflict(Exception):
+    """Stock or the claim moved under the batch (only possible without row locks); the batch is retried"""
+
+
+def queued_intake_enabled():
+    return getattr(settings, 'ORDER_INTAKE_MODE', 'sync') == 'queue'
+
+
+def submit_order_request(user, address, quantities, payment_method='', prescription=None):
+    """
+    Record an order to be placed by the intake worker, returns the OrderRequest.
+
+    Only a plain INSERT, no product row is locked, so a burst of checkouts
+    costs the database no more than a burst of page views.
+    """
+    with transaction.atomic():
+        order_request = OrderRequest(user=user, address=address, payment_method=payment_method or '',
+                                     items={str(product_id): quantity for product_id, quantity in quantities.items()})
+        if prescription:
+            attach_prescription(order_request, prescription, 'prescription')
+        order_request.save()
+    return order_request
+
+
+def _reject(order_request, error):
+    order_request.status = 'rejected'
+    order_request.error = error
+    if order_request.prescription_blob_id:
+        release_prescription(order_request.prescription_blob_id)
+        order_request.prescription_blob = None
+        order_request.prescription = None
+
+
+def place_order_batch(order_requests):
+    """
+    Place a batch of requests first come, first served; returns (placed, rejected).
+
+    Every product the batch needs is locked once, in id order, and stock is
+    handed out in memory in request order. Requests that no longer fit are
+    rejected with the same error body the synchronous path would return.
+    The accepted ones are then written with one stock UPDATE and one bulk
+    INSERT per table, however many requests the batch holds. Call inside
+    transaction.atomic().
+    """
+    product_ids = sorted({int(product_id) for order_request in order_requests for product_id in order_request.items})
+    products = {
+        product.id: product
+        for product in Product.objects.select_for_update().filter(id__in=product_ids).order_by('id')
+    }
+    remaining = {product_id: product.stock for product_id, product in products.items()}
+
+    accepted, rejected, taken = [], [], {}
+    for order_request in order_requests:
+        quantities = {int(product_id): quantity for product_id, quantity in order_request.items.items()}
+        missing = [product_id for product_id in sorted(quantities) if product_id not in products]
+        if missing:
+            _reject(order_request, {'detail': 'Product not found.', 'product_id': missing[0]})
+            rejected.append(order_request)
+            continue
+        short = next((product_id for product_id in sorted(quantities)
+                      if remaining[product_id] < quantities[product_id]), None)
+        if short is not None:
+            _reject(order_request, {'detail': f"Not enough stock for {products[short].name}.", 'product_id': short})
+            rejected.append(order_request)
+            continue
+
+        for product_id, quantity in quantities.items():
+            remaining[product_id] -= quantity
+            taken[product_id] = taken.get(product_id, 0) + quantity
+        accepted.append((order_request, quantities))
+
+    if taken:
+        requested = _per_product(taken)
+        reserved = Product.objects.filter(id__in=taken, stock__gte=requested).update(stock=F('stock') - requested)
+        if reserved != len(taken):
+            raise BatchConflict()
+
+    orders = Order.objects.bulk_create([
+        Order(user_id=order_request.user_id, address=order_request.address,
+              prescription=order_request.prescription.name or None,
+              prescription_blob_id=order_request.prescription_blob_id, stock_reserved=True,
+              total_price=sum(products[product_id].price * quantity for product_id, quantity in quantities.items()))
+        for order_request, quantities in accepted
+    ])
+
+    lines, holds = [], []
+    expires_at = timezone.now() + timedelta(minutes=settings.INVENTORY_HOLD_MINUTES)
+    for order, (order_request, quantities) in zip(orders, accepted):
+        lines.extend(line_for(order, products[product_id], quantity) for product_id, quantity in quantities.items())
+        if order_request.payment_method == 'online':
+            holds.extend(InventoryHold(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                         for product_id, quantity in quantities.items())
+        order_request.status = 'placed'
+        order_request.order = order
+        # The order now owns the prescription reference
+        order_request.prescription_blob = None
+    OrderLine.objects.bulk_create(lines)
+    InventoryHold.objects.bulk_create(holds)
+    if orders:
+        order_created(*orders)
+
+    placed = [order_request for order_request, _ in accepted]
+    for order_request in placed + rejected:
+        order_request.updated_at = timezone.now()
+    OrderRequest.objects.bulk_update(placed + rejected,
+                                     ['status', 'order', 'error', 'prescription', 'prescription_blob', 'updated_at'])
+    return placed, rejected
+
+
+def claim_order_requests(batch_size):
+    """
+    Claim the oldest queued requests for this worker, returns (token, requests).
+
+    One conditional UPDATE moves them to 'placing' under a fresh token; a
+    request another worker claimed in between no longer matches, so each is
+    claimed exactly once even without row locks (SQLite). A claim older than
+    ORDER_INTAKE_CLAIM_TIMEOUT, left by a worker that died, can be taken over.
+    """
+    now = timezone.now()
+    claimable = Q(status='queued') | Q(status='placing', claimed_until__lte=now)
+    ids = list(OrderRequest.objects.filter(claimable).order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return None, []
+
+    token = uuid.uuid4()
+    claimed = OrderRequest.objects.filter(claimable, id__in=ids).update(
+        status='placing', claim_token=token,
+        claimed_until=now + timedelta(seconds=settings.ORDER_INTAKE_CLAIM_TIMEOUT))
+    if not claimed:
+        return token, []
+    return token, list(OrderRequest.objects.filter(claim_token=token, status='placing').order_by('id'))
+
+
+def process_order_requests(batch_size=None):
+    """
+    Place the oldest batch of queued requests, returns how many were handled.
+
+    Requests are claimed with claim_order_requests, so several workers can
+    drain the queue side by side; a batch whose stock moved underneath it
+    is put back in the queue for the next round.
+    """
+    batch_size = batch_size or settings.ORDER_INTAKE_BATCH_SIZE
+    token, order_requests = claim_order_requests(batch_size)
+    if not order_requests:
+        return 0
+
+    try:
+        with transaction.atomic():
+            # Renewing the claim first holds it until commit; a claim that ran out and was taken over is dropped
+            renewed = OrderRequest.objects.filter(claim_token=token, status='placing').update(
+                claimed_until=timezone.now() + timedelta(seconds=settings.ORDER_INTAKE_CLAIM_TIMEOUT))
+            if renewed != len(order_requests):
+                raise BatchConflict()
+            placed, rejected = place_order_batch(order_requests)
+    except BatchConflict:
+        logger.warning("Stock or claims changed while placing a batch of order requests, retrying")
+        OrderRequest.objects.filter(claim_token=token, status='placing').update(
+            status='queued', claim_token=None, claimed_until=None)
+        return 0
+
+    logger.info(f"Placed {len(placed)} queued order(s), rejected {len(rejected)}")
+    return len(order_requests)
+
+
+def purge_finished_requests(older_than_days=7):
+    """Placed and rejected requests are only kept for clients still polling"""
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    deleted, _ = OrderRequest.objects.filter(status__in=['placed', 'rejected'], updated_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,290 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import InventoryHold, Order, OrderLine, OrderStatusEvent, Product
+from .tasks import order_created
+
+logger = logging.getLogger(__name__)
+
+HOLD_RELEASE_BATCH_SIZE = 500
+
+# Orders only move forward along pending -> processing -> paid -> shipped ->
+# delivered, steps may be skipped (cash on delivery is never "paid" before
+# shipping) and anything not yet shipped can be cancelled
+ORDER_FLOW = ['pending', 'processing', 'paid', 'shipped', 'delivered']
+ORDER_TRANSITIONS = {
+    status: set(ORDER_FLOW[index + 1:]) | ({'cancelled'} if status in ('pending', 'processing', 'paid') else set())
+    for index, status in enumerate(ORDER_FLOW)
+}
+MAX_BULK_TRANSITION = 1000
+
+
+class StockShortfall(Exception):
+    """Raised inside the placement transaction so every reservation rolls back"""
+
+    def __init__(self, product):
+        super().__init__(f"Not enough stock for {product.name}.")
+        self.product = product
+
+
+def parse_order_items(cart_items):
+    """
+    Turn the posted cart_items list into {product_id: quantity}.
+
+    Lines copied from the server cart carry product_id (their id is the cart
+    line), products from the client-side cart only carry id. Repeated
+    products are merged so each row is reserved once. Raises ValueError for
+    anything that is not a positive quantity of a product.
+    """
+    if not isinstance(cart_items, list) or not cart_items:
+        raise ValueError("Missing cart items or address.")
+
+    quantities = {}
+    for item in cart_items:
+        if not isinstance(item, dict):
+            raise ValueError("Each cart item must be an object.")
+        try:
+            product_id = int(item.get('product_id', item.get('id')))
+            quantity = int(item.get('quantity'))
+        except (TypeError, ValueError):
+            raise ValueError("Each cart item needs a product id and a quantity.")
+        if quantity < 1:
+            raise ValueError("Quantity must be at least 1.")
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def _per_product(quantities):
+    return Case(
+        *[When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=IntegerField()
+    )
+
+
+def reserve_stock(quantities):
+    """
+    Decrement stock for every product in one statement, returns {id: Product}.
+
+    Rows are locked in id order first, so concurrent orders over overlapping
+    products queue up instead of deadlocking. The UPDATE keeps its own
+    stock >= quantity guard and must touch every row, otherwise nothing is
+    reserved. Call inside transaction.atomic().
+    """
+    product_ids = sorted(quantities)
+    products = {
+        product.id: product
+        for product in Product.objects.select_for_update().filter(id__in=product_ids).order_by('id')
+    }
+    missing = [product_id for product_id in product_ids if product_id not in products]
+    if missing:
+        raise Product.DoesNotExist(f"Product {missing[0]} not found.")
+
+    for product_id in product_ids:
+        if products[product_id].stock < quantities[product_id]:
+            raise StockShortfall(products[product_id])
+
+    requested = _per_product(quantities)
+    reserved = Product.objects.filter(id__in=product_ids, stock__gte=requested).update(stock=F('stock') - requested)
+    if reserved != len(product_ids):
+        # Only reachable on backends without row locks; report whichever row ran out
+        current = dict(Product.objects.filter(id__in=product_ids).values_list('id', 'stock'))
+        short = next((product_id for product_id in product_ids if current[product_id] < quantities[product_id]),
+                     product_ids[0])
+        raise StockShortfall(products[short])
+
+    for product_id, quantity in quantities.items():
+        products[product_id].stock -= quantity
+    return products
+
+
+def line_for(order, product, quantity):
+    """Snapshot of a product as bought, unsaved"""
+    return OrderLine(order=order, product=product, product_name=product.name or '',
+                     unit_price=product.price, quantity=quantity)
+
+
+def serialize_line(line):
+    return {
+        'product_id': line.product_id,
+        'product_name': line.product_name,
+        'quantity': line.quantity,
+        'price': float(line.unit_price),
+        'total_price': float(line.line_total),
+    }
+
+
+def place_order(user, address, quantities, hold=False):
+    """
+    Reserve stock and create the order with its lines, all or nothing.
+
+    With hold=True (online payment) the reservation is also recorded as
+    InventoryHold rows that expire after INVENTORY_HOLD_MINUTES unless the
+    payment confirms them. The number of queries does not depend on how many
+    products are ordered. Raises StockShortfall or Product.DoesNotExist with
+    nothing written.
+    """
+    with transaction.atomic():
+        products = reserve_stock(quantities)
+        total_price = sum(products[product_id].price * quantity for product_id, quantity in quantities.items())
+        order = Order.objects.create(user=user, total_price=total_price, address=address, stock_reserved=True)
+        OrderLine.objects.bulk_create([
+            line_for(order, products[product_id], quantity) for product_id, quantity in quantities.items()
+        ])
+        if hold:
+            expires_at = timezone.now() + timedelta(minutes=settings.INVENTORY_HOLD_MINUTES)
+            InventoryHold.objects.bulk_create([
+                InventoryHold(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                for product_id, quantity in quantities.items()
+            ])
+        order_created(order)
+    return order
+
+
+def confirm_holds(order):
+    """
+    Make an order's stock reservation permanent once its payment succeeds.
+
+    If the sweeper already gave the stock back, it is reserved again; when
+    that is no longer possible, or staff cancelled the order, the order
+    stays cancelled and False is returned so the payment is refunded.
+    """
+    with transaction.atomic():
+        if InventoryHold.objects.filter(order=order, status='cancelled').exists():
+            logger.error(f"Order {order.id} was paid after staff cancelled it")
+            return False
+        InventoryHold.objects.filter(order=order, status='active').update(status='confirmed')
+        released = dict(InventoryHold.objects.filter(order=order, status='released')
+                        .values_list('product_id', 'quantity'))
+        if not released:
+            return True
+        try:
+            with transaction.atomic():
+                reserve_stock(released)
+                InventoryHold.objects.filter(order=order, status='released').update(status='confirmed')
+                if Order.objects.filter(pk=order.pk, status='cancelled').update(status='pending'):
+                    OrderStatusEvent.objects.create(order=order, from_status='cancelled', to_status='pending')
+            return True
+        except StockShortfall as e:
+            logger.error(f"Order {order.id} was paid after its hold expired and {e.product.name} is out of stock")
+            return False
+
+
+def release_expired_holds(batch_size=HOLD_RELEASE_BATCH_SIZE):
+    """
+    Give the stock of one batch of expired holds back, returns how many were released.
+
+    Orders left with nothing held are cancelled. Holds are claimed with
+    SKIP LOCKED so several sweepers, or a payment confirming at the same
+    moment, never double-release.
+    """
+    with transaction.atomic():
+        holds = list(InventoryHold.objects
+                     .select_for_update(skip_locked=True)
+                     .filter(status='active', expires_at__lte=timezone.now())
+                     .order_by('id')
+                     .values_list('id', 'order_id', 'product_id', 'quantity')[:batch_size])
+        if not holds:
+            return 0
+
+        restock = {}
+        for _, _, product_id, quantity in holds:
+            restock[product_id] = restock.get(product_id, 0) + quantity
+        # Same lock order as reserve_stock
+        list(Product.objects.select_for_update().filter(id__in=restock).order_by('id').values_list('id'))
+        Product.objects.filter(id__in=restock).update(stock=F('stock') + _per_product(restock))
+
+        InventoryHold.objects.filter(id__in=[hold[0] for hold in holds]).update(status='released')
+        order_ids = {hold[1] for hold in holds}
+        cancelled = list(Order.objects.filter(id__in=order_ids, status='pending').exclude(
+            inventory_holds__status__in=['active', 'confirmed']).values_list('id', flat=True))
+        Order.objects.filter(id__in=cancelled).update(status='cancelled', updated_at=timezone.now())
+        OrderStatusEvent.objects.bulk_create([
+            OrderStatusEvent(order_id=order_id, from_status='pending', to_status='cancelled')
+            for order_id in cancelled
+        ])
+
+    logger.info(f"Released {len(holds)} expired inventory hold(s)")
+    return len(holds)
+
+
+def return_stock(order_ids):
+    """
+    Give back the stock of orders being cancelled. Call inside their transaction.
+
+    Online orders took their stock through InventoryHold rows: active and
+    confirmed holds are returned (released ones already were, when they
+    expired) and every hold is marked cancelled, so a late payment is
+    refunded instead of reserving it again. Other orders placed with
+    stock_reserved took it straight off the shelf, so the quantities in
+    their line snapshots are returned. Cart checkouts and older orders never
+    took any stock and get nothing back.
+    """
+    held = list(InventoryHold.objects.filter(order_id__in=order_ids)
+                .values_list('order_id', 'product_id', 'quantity', 'status'))
+    restock = {}
+    for _, product_id, quantity, hold_status in held:
+        if hold_status in ('active', 'confirmed'):
+            restock[product_id] = restock.get(product_id, 0) + quantity
+    lines = (OrderLine.objects
+             .filter(order_id__in=order_ids, order__stock_reserved=True, product__isnull=False)
+             .exclude(order_id__in={hold[0] for hold in held})
+             .values_list('product_id', 'quantity'))
+    for product_id, quantity in lines:
+        restock[product_id] = restock.get(product_id, 0) + quantity
+
+    if held:
+        InventoryHold.objects.filter(order_id__in=order_ids).update(status='cancelled')
+    if restock:
+        # Same lock order as reserve_stock
+        list(Product.objects.select_for_update().filter(id__in=restock).order_by('id').values_list('id'))
+        Product.objects.filter(id__in=restock).update(stock=F('stock') + _per_product(restock))
+
+
+def transition_orders(order_ids, to_status, changed_by=None):
+    """
+    Move many orders to to_status at once, recording an OrderStatusEvent for each.
+
+    Current statuses are read (and locked) in one query, the allowed orders
+    move with a single UPDATE and their events are bulk inserted; cancelled
+    orders get their stock back in the same transaction (return_stock).
+    Orders that cannot make the transition are left alone and returned in
+    rejected as {order_id: current_status or None if it does not exist}.
+    """
+    allowed_from = [status for status, targets in ORDER_TRANSITIONS.items() if to_status in targets]
+    order_ids = set(order_ids)
+
+    with transaction.atomic():
+        current = dict(Order.objects.select_for_update().filter(id__in=order_ids).values_list('id', 'status'))
+        movable = sorted(order_id for order_id, status in current.items() if status in allowed_from)
+        rejected = {order_id: current.get(order_id) for order_id in order_ids if order_id not in movable}
+
+        now = timezone.now()
+        Order.objects.filter(id__in=movable).update(status=to_status, updated_at=now)
+        if to_status == 'cancelled' and movable:
+            return_stock(movable)
+        OrderStatusEvent.objects.bulk_create([
+            OrderStatusEvent(order_id=order_id, from_status=current[order_id], to_status=to_status,
+                             changed_by=changed_by, created_at=now)
+            for order_id in movable
+        ])
+
+    return {'updated': movable, 'rejected': rejected}
+
+
+def transition_order(order, to_status, changed_by=None):
+    """
+    transition_orders for a single order, returns False if the move is not allowed.
+
+    order.status is refreshed either way. Moving to the status it already
+    has is a no-op that counts as allowed.
+    """
+    if order.status == to_status:
+        return True
+    result = transition_orders([order.id], to_status, changed_by=changed_by)
+    order.refresh_from_db(fields=['status', 'updated_at'])
+    return bool(result['updated'])
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .esewa import get_gateway
+from .models import userPayment
+from .payment_utils import PaymentTransitionError, payment_status_for_callback, transition_payment
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_BATCH_SIZE = 200
+RECONCILE_CONCURRENCY = 20
+
+
+async def _fetch_statuses(gateway, payments, concurrency):
+    """
+    Ask the gateway about every payment, at most concurrency requests in flight.
+
+    Requests share one pooled session, so connections are reused instead of
+    paying a TLS handshake per payment. Returns {payment_id: status or None}.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    with gateway.session(pool_size=concurrency) as session, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        async def check(payment):
+            async with semaphore:
+                try:
+                    return payment.id, await loop.run_in_executor(
+                        executor, gateway.check_status, session, payment.transaction_uuid, payment.total_amount)
+                except Exception as e:
+                    logger.warning(f"Status check failed for payment {payment.transaction_uuid}: {e}")
+                    return payment.id, None
+
+        return dict(await asyncio.gather(*(check(payment) for payment in payments)))
+
+
+def reconcile_pending_payments(older_than_minutes=None, batch_size=RECONCILE_BATCH_SIZE,
+                               concurrency=RECONCILE_CONCURRENCY):
+    """
+    Settle PENDING payments older than older_than_minutes from the gateway's status API.
+
+    Payments are read in id-ordered batches; each batch is checked
+    concurrently, then settled through transition_payment, so a callback
+    landing at the same moment is never overwritten. No transaction is held
+    open while waiting on the network. Returns counts per outcome.
+    """
+    minutes = older_than_minutes if older_than_minutes is not None else settings.PAYMENT_RECONCILE_AFTER_MINUTES
+    cutoff = timezone.now() - timedelta(minutes=minutes)
+    gateway = get_gateway()
+    totals = {'checked': 0, 'paid': 0, 'failed': 0, 'unchanged': 0, 'errors': 0}
+
+    last_id = 0
+    while True:
+        payments = list(userPayment.objects
+                        .filter(status='PENDING', created_at__lt=cutoff, id__gt=last_id)
+                        .select_related('order')
+                        .order_by('id')[:batch_size])
+        if not payments:
+            return totals
+        last_id = payments[-1].id
+
+        statuses = asyncio.run(_fetch_statuses(gateway, payments, concurrency))
+        for payment in payments:
+            totals['checked'] += 1
+            gateway_status = statuses.get(payment.id)
+            if gateway_status is None:
+                totals['errors'] += 1
+                continue
+            new_status = payment_status_for_callback(gateway_status)
+            try:
+                if new_status and transition_payment(payment, new_status):
+                    totals[new_status.lower()] += 1
+                else:
+                    totals['unchanged'] += 1
+            except PaymentTransitionError:
+                # Settled some other way while we were asking
+                totals['unchanged'] += 1
+
+        logger.info(f"Reconciled {len(payments)} pending payment(s)")
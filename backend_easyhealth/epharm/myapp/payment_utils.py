@@ -0,0 +1,95 @@
+import logging
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Order, OrderStatusEvent, userPayment
+from .order_utils import confirm_holds
+from .tasks import payment_confirmed, payment_needs_refund
+
+logger = logging.getLogger(__name__)
+
+# A payment never goes back to PENDING. A success reported after a failure
+# wins, since the gateway has taken the money; only a paid payment can be
+# refunded.
+PAYMENT_TRANSITIONS = {
+    'PENDING': {'PAID', 'FAILED'},
+    'FAILED': {'PAID'},
+    'PAID': {'REFUNDED'},
+    'REFUNDED': set(),
+}
+
+# Callback statuses that mean the customer has paid, or that the attempt is over
+PAYMENT_SUCCESS_STATUSES = ('SUCCESS', 'COMPLETE', 'PAID')
+PAYMENT_FAILURE_STATUSES = ('FAILED', 'FAILURE', 'CANCELED', 'CANCELLED', 'NOT_FOUND', 'AMBIENT_FAILED')
+
+# Order statuses a confirmed payment moves to 'paid'
+ORDER_PAYABLE_STATUSES = ('pending', 'processing')
+
+
+class PaymentTransitionError(Exception):
+    def __init__(self, payment, to_status):
+        super().__init__(f"Payment {payment.transaction_uuid} cannot go from {payment.status} to {to_status}.")
+        self.payment = payment
+        self.to_status = to_status
+
+
+def payment_status_for_callback(callback_status):
+    """The userPayment status a gateway callback status maps to, None if it settles nothing"""
+    callback_status = (callback_status or '').upper()
+    if callback_status in PAYMENT_SUCCESS_STATUSES:
+        return 'PAID'
+    if callback_status in PAYMENT_FAILURE_STATUSES:
+        return 'FAILED'
+    return None
+
+
+def _mark_order_paid(order_id, changed_by):
+    now = timezone.now()
+    current = Order.objects.filter(pk=order_id).values_list('status', flat=True).first()
+    if current in ORDER_PAYABLE_STATUSES and Order.objects.filter(
+            pk=order_id, status=current).update(status='paid', updated_at=now):
+        OrderStatusEvent.objects.create(order_id=order_id, from_status=current, to_status='paid',
+                                        changed_by=changed_by, created_at=now)
+
+
+def transition_payment(payment, to_status, changed_by=None, **fields):
+    """
+    Move payment to to_status, returns False when it already was there.
+
+    The write is a conditional UPDATE on the status and version that were
+    read, so two callbacks or a callback and an admin edit can never both
+    win. The loser re-reads the row: a duplicate finds the status already
+    set and becomes a no-op without writing anything. Reaching PAID confirms
+    the order's stock holds, moves the order to 'paid' and queues the
+    payment emails in the same transaction; when the stock cannot be held
+    again the order stays cancelled and a refund notice is queued instead. Raises PaymentTransitionError
+    for a move the state machine does not allow. Extra fields (e.g.
+    transaction_code) are written with the status.
+    """
+    while True:
+        if payment.status == to_status:
+            return False
+        if to_status not in PAYMENT_TRANSITIONS.get(payment.status, set()):
+            raise PaymentTransitionError(payment, to_status)
+
+        with transaction.atomic():
+            updated = userPayment.objects.filter(
+                pk=payment.pk, status=payment.status, version=payment.version
+            ).update(status=to_status, version=F('version') + 1, updated_at=timezone.now(), **fields)
+            if updated:
+                if to_status == 'PAID' and payment.order_id:
+                    order = payment.order
+                    if confirm_holds(order):
+                        _mark_order_paid(order.id, changed_by)
+                        payment_confirmed(order)
+                    else:
+                        # The stock went to someone else; the order stays cancelled and the money goes back
+                        payment_needs_refund(order, payment)
+                payment.refresh_from_db(fields=['status', 'version', 'updated_at', *fields])
+                logger.info(f"Payment {payment.transaction_uuid} moved to {to_status}")
+                return True
+
+        # Someone else changed the payment since it was read; decide again on the fresh row
+        payment.refresh_from_db(fields=['status', 'version'])
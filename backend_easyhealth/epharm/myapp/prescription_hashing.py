@@ -0,0 +1,186 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.db.models import Q
+
+from .models import Order, PrescriptionBlob, PrescriptionHash
+
+logger = logging.getLogger(__name__)
+
+BANDS = 4
+BAND_BITS = 64 // BANDS
+# Hashes up to 2 * BANDS - 1 bits apart differ by at most one bit in some band,
+# so probing each band and its one-bit neighbours finds them all; keep the
+# threshold inside that
+NEAR_DUPLICATE_DISTANCE = 6
+# Second opinion from the dHash, drops pHash collisions between different documents
+DHASH_DISTANCE = 12
+CANDIDATE_BATCH_SIZE = 500
+
+
+def dhash(image, size=8):
+    """Difference hash: one bit per horizontally adjacent pixel pair"""
+    pixels = list(image.convert('L').resize((size + 1, size)).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def phash(image, size=8, scale=4):
+    """DCT hash: low-frequency coefficients of a 32x32 thumbnail against their median"""
+    import numpy
+
+    side = size * scale
+    pixels = numpy.asarray(image.convert('L').resize((side, side)), dtype=numpy.float64)
+    n = numpy.arange(side)
+    dct = numpy.cos(numpy.pi * numpy.outer(n, 2 * n + 1) / (2 * side))
+    low = (dct @ pixels @ dct.T)[:size, :size].flatten()
+    median = numpy.median(low[1:])  # The DC term only reflects overall brightness
+    value = 0
+    for coefficient in low:
+        value = (value << 1) | int(coefficient > median)
+    return value
+
+
+def compute_hashes(path):
+    """(phash, dhash) of an image file, or (None, None) for PDFs and unreadable files"""
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image)
+            return phash(image), dhash(image)
+    except Exception:
+        return None, None
+
+
+def to_signed(value):
+    """Fit an unsigned 64-bit hash into a BigIntegerField"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def bands(value):
+    return [(value >> (BAND_BITS * index)) & ((1 << BAND_BITS) - 1) for index in range(BANDS)]
+
+
+def probes(band):
+    """A band value and every value one bit away from it"""
+    return [band] + [band ^ (1 << bit) for bit in range(BAND_BITS)]
+
+
+def hamming(a, b):
+    return (to_unsigned(a) ^ to_unsigned(b)).bit_count()
+
+
+def build_hash_row(blob_id, hashes):
+    phash_value, dhash_value = hashes
+    row = PrescriptionHash(blob_id=blob_id)
+    if phash_value is not None:
+        row.phash = to_signed(phash_value)
+        row.dhash = to_signed(dhash_value)
+        for index, band in enumerate(bands(phash_value)):
+            setattr(row, f'band{index}', band)
+    return row
+
+
+def hash_pending_blobs(batch_size=200, workers=None):
+    """
+    Hash one batch of blobs that have no perceptual hash yet, returns the count.
+
+    Decoding and DCTs are CPU bound, so they run in a process pool; the
+    workers only read files and never touch the database.
+    """
+    blobs = list(PrescriptionBlob.objects
+                 .filter(perceptual_hash__isnull=True)
+                 .order_by('id')
+                 .values_list('id', 'file')[:batch_size])
+    if not blobs:
+        return 0
+
+    paths = [default_storage.path(name) for _, name in blobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(compute_hashes, paths, chunksize=8))
+
+    PrescriptionHash.objects.bulk_create(
+        [build_hash_row(blob_id, hashes) for (blob_id, _), hashes in zip(blobs, results)],
+        ignore_conflicts=True
+    )
+    return len(blobs)
+
+
+def find_similar_blobs(blob_ids, max_distance=NEAR_DUPLICATE_DISTANCE, limit=50):
+    """
+    Blobs whose pHash is within max_distance of any of blob_ids.
+
+    Returns (blob_id, distance) pairs, closest first. Candidates come from
+    the band indexes, BAND_BITS + 1 probed values per band. Real photos
+    crowd some buckets, so every candidate is compared bit by bit, read in
+    keyset pages of CANDIDATE_BATCH_SIZE rows newest first; a popular
+    bucket costs more queries but never hides an older approval. A match
+    must also have a dHash within DHASH_DISTANCE of the same source.
+    """
+    sources = list(PrescriptionHash.objects.filter(blob_id__in=blob_ids, phash__isnull=False))
+    if not sources:
+        return []
+
+    band_filter = Q()
+    for index in range(BANDS):
+        values = {value for source in sources for value in probes(getattr(source, f'band{index}'))}
+        band_filter |= Q(**{f'band{index}__in': sorted(values)})
+    candidates = PrescriptionHash.objects.filter(band_filter).exclude(blob_id__in=blob_ids).order_by('-id')
+
+    best, scanned, last_id = {}, 0, None
+    while True:
+        page = candidates if last_id is None else candidates.filter(id__lt=last_id)
+        rows = list(page.values_list('id', 'blob_id', 'phash', 'dhash')[:CANDIDATE_BATCH_SIZE])
+        for _, blob_id, candidate_phash, candidate_dhash in rows:
+            distances = [hamming(candidate_phash, source.phash) for source in sources
+                         if hamming(candidate_dhash, source.dhash) <= DHASH_DISTANCE]
+            distance = min(distances, default=max_distance + 1)
+            if distance <= max_distance and distance < best.get(blob_id, max_distance + 1):
+                best[blob_id] = distance
+        scanned += len(rows)
+        if len(rows) < CANDIDATE_BATCH_SIZE:
+            break
+        last_id = rows[-1][0]
+
+    if scanned > CANDIDATE_BATCH_SIZE:
+        logger.info(f"Compared {scanned} candidate prescription hashes for blobs {sorted(blob_ids)}")
+
+    return sorted(best.items(), key=lambda match: match[1])[:limit]
+
+
+def find_similar_orders(order, max_distance=NEAR_DUPLICATE_DISTANCE, limit=20):
+    """Other orders whose prescriptions are byte-identical (distance 0) or near-duplicates"""
+    blob_ids = set(order.cartitem_set.exclude(prescription_blob=None).values_list('prescription_blob_id', flat=True))
+    if order.prescription_blob_id:
+        blob_ids.add(order.prescription_blob_id)
+    if not blob_ids:
+        return []
+
+    distances = {blob_id: 0 for blob_id in blob_ids}
+    distances.update(find_similar_blobs(blob_ids, max_distance))
+
+    matches = {}
+    rows = (Order.objects
+            .filter(Q(prescription_blob_id__in=distances) | Q(cartitem__prescription_blob_id__in=distances))
+            .exclude(pk=order.pk)
+            .values_list('id', 'status', 'prescription_blob_id', 'cartitem__prescription_blob_id'))
+    for order_id, order_status, order_blob_id, line_blob_id in rows:
+        distance = min(distances.get(order_blob_id, 64), distances.get(line_blob_id, 64))
+        if distance < matches.get(order_id, (None, 65))[1]:
+            matches[order_id] = (order_status, distance)
+
+    return sorted(
+        [(order_id, order_status, distance) for order_id, (order_status, distance) in matches.items()],
+        key=lambda match: (match[2], -match[0])
+    )[:limit]
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import os
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.deletion import ProtectedError
+
+from .models import CartItem, Order, PrescriptionBlob
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+INGEST_BATCH_SIZE = 200
+# Models that stored uploads in their own FileField before blobs existed
+LEGACY_PRESCRIPTION_FIELDS = [(Order, 'prescription'), (CartItem, 'prescription_file')]
+
+
+def hash_upload(upload):
+    """SHA-256 of an upload, read in chunks so large files never sit in memory"""
+    digest = hashlib.sha256()
+    for chunk in upload.chunks(chunk_size=CHUNK_SIZE):
+        digest.update(chunk)
+    upload.seek(0)
+    return digest.hexdigest()
+
+
+def blob_name(digest, filename):
+    extension = os.path.splitext(filename or '')[1].lower()[:10]
+    return f"prescription_blobs/{digest[:2]}/{digest}{extension}"
+
+
+def store_prescription(upload):
+    """
+    Store an upload once per distinct content and take a reference on it.
+
+    A repeated upload only costs the hashing pass: the existing blob gets its
+    ref_count bumped and nothing is written to the media volume.
+    """
+    digest = hash_upload(upload)
+
+    if PrescriptionBlob.objects.filter(digest=digest).update(ref_count=F('ref_count') + 1):
+        return PrescriptionBlob.objects.get(digest=digest)
+
+    # Storage streams the upload in chunks, or moves it if Django spooled it to disk
+    name = default_storage.save(blob_name(digest, upload.name), upload)
+    try:
+        with transaction.atomic():
+            return PrescriptionBlob.objects.create(digest=digest, file=name, size=upload.size, ref_count=1)
+    except IntegrityError:
+        # Another request stored the same content first, keep theirs
+        default_storage.delete(name)
+        PrescriptionBlob.objects.filter(digest=digest).update(ref_count=F('ref_count') + 1)
+        return PrescriptionBlob.objects.get(digest=digest)
+
+
+def release_prescription(blob_id):
+    """Drop one reference; the blob and its file go away with the last one. Returns bytes freed."""
+    if blob_id is None:
+        return 0
+
+    with transaction.atomic():
+        PrescriptionBlob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        blob = PrescriptionBlob.objects.select_for_update().filter(pk=blob_id, ref_count=0).first()
+        if blob is None:
+            return 0
+        try:
+            blob.delete()
+        except ProtectedError:
+            logger.warning(f"Prescription blob {blob_id} reached zero references while still linked")
+            return 0
+
+    name, size = blob.file.name, blob.size
+    transaction.on_commit(lambda: default_storage.delete(name))
+    return size
+
+
+def attach_prescription(instance, upload, file_field):
+    """
+    Point instance (a CartItem or Order) at the shared blob for upload.
+
+    The legacy FileField is set to the blob's path so existing readers keep
+    working. Returns the id of the blob previously attached, which the caller
+    should release once the instance is saved.
+    """
+    blob = store_prescription(upload)
+    previous_blob_id = instance.prescription_blob_id
+    instance.prescription_blob = blob
+    getattr(instance, file_field).name = blob.file.name
+
+    if previous_blob_id == blob.id:
+        # Same content uploaded again for the same line, keep a single reference
+        release_prescription(blob.id)
+        return None
+    return previous_blob_id
+
+
+def _still_referenced(name):
+    return any(model.objects.filter(**{field: name}).exists() for model, field in LEGACY_PRESCRIPTION_FIELDS)
+
+
+def ingest_legacy_prescriptions(batch_size=INGEST_BATCH_SIZE):
+    """
+    Move uploads made before blobs existed into the blob store, returns counts.
+
+    Each order and cart line whose FileField is set but has no blob is
+    pointed at the blob for its file's contents, taking a reference like a
+    new upload would, so it is deduplicated and picked up by
+    hash_pending_blobs. The legacy file is deleted once nothing points at it.
+    Rows whose file is gone are counted as missing and left alone.
+    """
+    counts = {'ingested': 0, 'missing': 0}
+    for model, field in LEGACY_PRESCRIPTION_FIELDS:
+        pending = (model.objects
+                   .filter(prescription_blob__isnull=True, **{f'{field}__isnull': False})
+                   .exclude(**{field: ''})
+                   .order_by('pk'))
+        last_pk = 0
+        while True:
+            rows = list(pending.filter(pk__gt=last_pk).values_list('pk', field)[:batch_size])
+            for pk, name in rows:
+                try:
+                    legacy = default_storage.open(name)
+                except OSError:
+                    logger.warning(f"Prescription file {name} of {model.__name__} {pk} is missing")
+                    counts['missing'] += 1
+                    continue
+                with legacy, transaction.atomic():
+                    blob = store_prescription(File(legacy, name=name))
+                    if not model.objects.filter(pk=pk, prescription_blob__isnull=True).update(
+                            prescription_blob=blob, **{field: blob.file.name}):
+                        # Re-uploaded since it was read, the new upload holds its own reference
+                        release_prescription(blob.id)
+                        continue
+                    if not _still_referenced(name):
+                        transaction.on_commit(lambda name=name: default_storage.delete(name))
+                counts['ingested'] += 1
+            if len(rows) < batch_size:
+                break
+            last_pk = rows[-1][0]
+    return counts
@@ -3,7 +3,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .models import Product, CustomUser, Cart, CartItem, Order
+from .models import Product, CustomUser, Cart, CartItem, Order, OrderLine
 from rest_framework import generics
 
 
@@ -122,19 +122,26 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', 'items']
 
 
-# Order Serializer (includes CartItem details for the order)
+# Order line snapshot, priced as it was bought
+class OrderLineSerializer(serializers.ModelSerializer):
+    price = serializers.FloatField(source='unit_price')
+    total_price = serializers.FloatField(source='line_total')
+
+    class Meta:
+        model = OrderLine
+        fields = ['product_id', 'product_name', 'quantity', 'price', 'total_price']
+
+
+# Order Serializer (includes the order lines). Lines come from the prefetch
+# cache when present, so serialize querysets built with Order.objects.with_lines()
+# or userPayment.objects.for_listing() to keep lists at a constant query count
 class OrderSerializer(serializers.ModelSerializer):
-    items = serializers.SerializerMethodField()
+    items = OrderLineSerializer(source='lines', many=True, read_only=True)
 
     class Meta:
         model = Order
         fields = ['id', 'user', 'items', 'total_price', 'status', 'created_at']
 
-    def get_items(self, obj):
-        # Fetch related CartItems for the order
-        cart_items = CartItem.objects.filter(order=obj)
-        return CartItemSerializer(cart_items, many=True).data
-
 
 
 
@@ -166,35 +173,17 @@ class UserPaymentSerializer(serializers.ModelSerializer):
         ]
 
 
-# Admin Payment Serializer - Detailed payment info for admin
-class AdminPaymentSerializer(serializers.ModelSerializer):
-    user_username = serializers.CharField(source='user.username', read_only=True, allow_null=True)
-    user_email = serializers.CharField(source='user.email', read_only=True, allow_null=True)
-    order_id = serializers.IntegerField(source='order.id', read_only=True, allow_null=True)
-    order_status = serializers.CharField(source='order.status', read_only=True, allow_null=True)
-    order_total = serializers.DecimalField(
-        source='order.total_price', max_digits=10, decimal_places=2, read_only=True, allow_null=True
-    )
+# Admin Payment rows - Detailed payment info for admin. Rows come from
+# userPayment.objects.admin_rows(), so this only formats the money columns
+# the way DecimalField serializes them.
+ADMIN_PAYMENT_MONEY_FIELDS = ('amount', 'tax_amount', 'total_amount', 'order_total')
 
-    class Meta:
-        model = userPayment
-        fields = [
-            'id',
-            'transaction_uuid',
-            'transaction_code',
-            'amount',
-            'tax_amount',
-            'total_amount',
-            'status',
-            'product_code',
-            'user_username',
-            'user_email',
-            'order_id',
-            'order_status',
-            'order_total',
-            'created_at',
-            'updated_at',
-        ]
+
+def admin_payment_row(row):
+    for name in ADMIN_PAYMENT_MONEY_FIELDS:
+        if row[name] is not None:
+            row[name] = f"{row[name]:.2f}"
+    return row
 
 
 # Order Payment Status Serializer - Simplified for order payment lookup
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import CartItem, Order, OrderRequest
+from .prescription_storage import release_prescription
+
+
+@receiver(post_delete, sender=CartItem)
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=OrderRequest)
+def release_prescription_blob(sender, instance, **kwargs):
+    # Keeps blob reference counts right for every delete path, including cascades
+    if instance.prescription_blob_id:
+        release_prescription(instance.prescription_blob_id)
@@ -0,0 +1,247 @@
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.mail import send_mail
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Order, Task
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+
+def task(name):
+    """Register a function as a queue job under name"""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, delay=0, max_attempts=None, **payload):
+    """
+    Queue a job; call inside the transaction that produced the event.
+
+    The row commits or rolls back with that transaction, so a worker only
+    ever sees jobs for orders that really exist, and nothing runs if the
+    request fails halfway.
+    """
+    return enqueue_many([(name, payload)], delay=delay, max_attempts=max_attempts)[0]
+
+
+def enqueue_many(jobs, delay=0, max_attempts=None):
+    """Queue several (name, payload) jobs with a single INSERT"""
+    for name, _ in jobs:
+        if name not in TASKS:
+            raise ValueError(f"Unknown task '{name}'")
+    available_at = timezone.now() + timedelta(seconds=delay)
+    return Task.objects.bulk_create([
+        Task(name=name, payload=payload, available_at=available_at,
+             max_attempts=max_attempts or settings.TASK_MAX_ATTEMPTS)
+        for name, payload in jobs
+    ])
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter: about 30s, 1m, 2m, 4m ... capped at an hour"""
+    delay = min(settings.TASK_RETRY_BACKOFF * 2 ** (attempts - 1), 60 * 60)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim_task(pk, from_status, attempts, locked_until):
+    """
+    Lease one job if nobody else has since it was read, returns True if we got it.
+
+    The UPDATE only matches the status and attempt count that were read, so
+    of several workers racing for a row exactly one sees a row count of 1.
+    """
+    return Task.objects.filter(pk=pk, status=from_status, attempts=attempts).update(
+        status='running', attempts=attempts + 1, locked_until=locked_until, updated_at=timezone.now()) == 1
+
+
+def claim_tasks(batch_size=10):
+    """
+    Lease up to batch_size due jobs to this worker.
+
+    A job whose worker died is picked up again once its lease
+    (TASK_VISIBILITY_TIMEOUT) runs out. Each row is claimed with a
+    conditional UPDATE (claim_task) rather than row locks, which SQLite
+    does not have, so concurrent workers never run the same job.
+    """
+    now = timezone.now()
+    due = list(Task.objects
+               .filter(Q(status='queued', available_at__lte=now) |
+                       Q(status='running', locked_until__lte=now))
+               .order_by('available_at', 'id')
+               .values_list('id', 'status', 'attempts')[:batch_size])
+    if not due:
+        return []
+
+    locked_until = now + timedelta(seconds=settings.TASK_VISIBILITY_TIMEOUT)
+    claimed = [pk for pk, from_status, attempts in due if claim_task(pk, from_status, attempts, locked_until)]
+    return list(Task.objects.filter(id__in=claimed).order_by('available_at', 'id'))
+
+
+def run_task(claimed):
+    """Run one leased job and record the outcome, returns True on success"""
+    # Only the worker still holding the lease may record the outcome
+    lease = Task.objects.filter(pk=claimed.pk, status='running', locked_until=claimed.locked_until)
+    try:
+        TASKS[claimed.name](**claimed.payload)
+    except Exception as e:
+        logger.error(f"Task {claimed} failed on attempt {claimed.attempts}: {e}")
+        error = traceback.format_exc()[-4000:]
+        if claimed.attempts >= claimed.max_attempts:
+            lease.update(status='failed', last_error=error, locked_until=None, updated_at=timezone.now())
+        else:
+            lease.update(
+                status='queued',
+                last_error=error,
+                locked_until=None,
+                available_at=timezone.now() + timedelta(seconds=retry_delay(claimed.attempts)),
+                updated_at=timezone.now()
+            )
+        return False
+
+    lease.update(status='done', locked_until=None, updated_at=timezone.now())
+    return True
+
+
+def run_pending(batch_size=10):
+    """Claim and run one batch, returns how many jobs were attempted"""
+    claimed = claim_tasks(batch_size)
+    for job in claimed:
+        run_task(job)
+    return len(claimed)
+
+
+def purge_finished(older_than_days=7):
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    deleted, _ = Task.objects.filter(status='done', updated_at__lt=cutoff).delete()
+    return deleted
+
+
+# Order pipeline
+
+def order_created(*orders):
+    enqueue_many([
+        job
+        for order in orders
+        for job in (
+            ('send_order_confirmation', {'order_id': order.id}),
+            ('generate_invoice', {'order_id': order.id}),
+            ('notify_pharmacist', {'order_id': order.id}),
+        )
+    ])
+
+
+def payment_confirmed(order):
+    enqueue_many([
+        ('send_payment_confirmation', {'order_id': order.id}),
+        ('generate_invoice', {'order_id': order.id}),
+    ])
+
+
+def payment_needs_refund(order, payment):
+    enqueue('send_refund_notice', order_id=order.id, payment_id=payment.id)
+
+
+def _order_summary(order):
+    lines = "\n".join(f"  {line.quantity} x {line.product_name} @ Rs. {line.unit_price}" for line in order.lines.all())
+    return f"{lines}\n\nTotal: Rs. {order.total_price}\nDelivery address: {order.address}"
+
+
+@task('send_order_confirmation')
+def send_order_confirmation(order_id):
+    order = Order.objects.with_lines().get(pk=order_id)
+    if not order.user.email:
+        return
+    send_mail(
+        f"MediNest order #{order.id} received",
+        f"Hi {order.user.first_name or order.user.username},\n\nWe have received your order:\n\n{_order_summary(order)}",
+        settings.DEFAULT_FROM_EMAIL,
+        [order.user.email],
+    )
+
+
+@task('send_payment_confirmation')
+def send_payment_confirmation(order_id):
+    order = Order.objects.select_related('user').get(pk=order_id)
+    if not order.user.email:
+        return
+    send_mail(
+        f"Payment received for MediNest order #{order.id}",
+        f"Hi {order.user.first_name or order.user.username},\n\n"
+        f"Your payment of Rs. {order.total_price} for order #{order.id} has been confirmed.",
+        settings.DEFAULT_FROM_EMAIL,
+        [order.user.email],
+    )
+
+
+@task('send_refund_notice')
+def send_refund_notice(order_id, payment_id):
+    """A payment landed on an order whose stock is gone: tell the customer, and staff to refund it"""
+    order = Order.objects.select_related('user').get(pk=order_id)
+    payment = order.userpayment_set.get(pk=payment_id)
+    if order.user.email:
+        send_mail(
+            f"MediNest order #{order.id} could not be fulfilled",
+            f"Hi {order.user.first_name or order.user.username},\n\n"
+            f"Your payment of Rs. {payment.total_amount} arrived after the items in order #{order.id} "
+            f"sold out, so the order was cancelled. The payment will be refunded.",
+            settings.DEFAULT_FROM_EMAIL,
+            [order.user.email],
+        )
+    if not settings.REFUND_EMAILS:
+        logger.warning(f"Payment {payment.transaction_uuid} needs a refund but REFUND_EMAILS is empty")
+        return
+    send_mail(
+        f"Refund needed for order #{order.id}",
+        f"Payment {payment.transaction_uuid} (Rs. {payment.total_amount}) was confirmed for cancelled "
+        f"order #{order.id}. Refund it through eSewa and mark it REFUNDED.",
+        settings.DEFAULT_FROM_EMAIL,
+        settings.REFUND_EMAILS,
+    )
+
+
+@task('generate_invoice')
+def generate_invoice(order_id):
+    """Render the invoice to invoices/; re-running overwrites it, e.g. once payment lands"""
+    order = Order.objects.with_lines().get(pk=order_id)
+    html = render_to_string('invoices/order_invoice.html', {
+        'order': order,
+        'lines': order.lines.all(),
+        'payment': order.userpayment_set.order_by('-created_at').first(),
+        'generated_at': timezone.now(),
+    })
+    name = f"invoices/order_{order.id}.html"
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, ContentFile(html.encode()))
+
+
+@task('notify_pharmacist')
+def notify_pharmacist(order_id):
+    """Orders with a prescription or prescription-only products need a pharmacist's review"""
+    order = Order.objects.select_related('user').prefetch_related('lines__product').get(pk=order_id)
+    needs_review = bool(order.prescription) or any(
+        line.product and line.product.prescription_required for line in order.lines.all())
+    if not needs_review:
+        return
+    if not settings.PHARMACIST_EMAILS:
+        logger.warning(f"Order {order.id} needs prescription review but PHARMACIST_EMAILS is empty")
+        return
+    send_mail(
+        f"Prescription review needed for order #{order.id}",
+        f"Customer: {order.user.username} ({order.user.email})\n\n{_order_summary(order)}",
+        settings.DEFAULT_FROM_EMAIL,
+        settings.PHARMACIST_EMAILS,
+    )
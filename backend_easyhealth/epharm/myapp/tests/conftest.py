@@ -0,0 +1,79 @@
+import json
+
+import pytest
+from rest_framework.test import APIClient
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from myapp.models import Product
+
+User = get_user_model()
+
+
+@pytest.fixture
+def customer():
+    return User.objects.create_user(
+        username='customer',
+        email='customer@example.com',
+        password='customerpassword123'
+    )
+
+
+@pytest.fixture
+def staff_user():
+    return User.objects.create_user(
+        username='staff',
+        email='staff@example.com',
+        password='staffpassword123',
+        is_staff=True
+    )
+
+
+@pytest.fixture
+def customer_client(customer):
+    client = APIClient()
+    client.force_authenticate(user=customer)
+    return client
+
+
+@pytest.fixture
+def staff_client(staff_user):
+    client = APIClient()
+    client.force_authenticate(user=staff_user)
+    return client
+
+
+@pytest.fixture
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    return tmp_path
+
+
+@pytest.fixture
+def make_product():
+    def make(**fields):
+        return Product.objects.create(**{
+            'name': 'Paracetamol', 'generic_name': 'Paracetamol', 'price': '10.00', 'stock': 5, 'category': 'OTC',
+            **fields
+        })
+    return make
+
+
+@pytest.fixture
+def product(make_product):
+    return make_product()
+
+
+@pytest.fixture
+def stocked_products(make_product):
+    return [make_product(name=f'Product {i}') for i in range(6)]
+
+
+def place(client, items, payment_method='cod', idempotency_key=None, **extra):
+    """POST items ([{'id': ..., 'quantity': ...}]) to the place order endpoint"""
+    headers = {'HTTP_IDEMPOTENCY_KEY': idempotency_key} if idempotency_key else {}
+    return client.post(reverse('myapp:order-place'), {
+        'cart_items': json.dumps(items),
+        'address': '123 Test Street',
+        'payment_method': payment_method,
+        **extra,
+    }, **headers)
@@ -0,0 +1,94 @@
+"""A local stand-in for the eSewa status API and success redirects, for tests"""
+import base64
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from myapp.esewa import RESPONSE_SIGNED_FIELDS, get_gateway
+
+
+def callback_data(transaction_uuid, total_amount, status='COMPLETE', transaction_code='000AE01'):
+    """The base64 data parameter eSewa appends to its success redirect, signed like eSewa signs it"""
+    gateway = get_gateway()
+    payload = {
+        'transaction_code': transaction_code,
+        'status': status,
+        'total_amount': str(total_amount),
+        'transaction_uuid': transaction_uuid,
+        'product_code': gateway.product_code,
+        'signed_field_names': ",".join(RESPONSE_SIGNED_FIELDS),
+    }
+    payload['signature'] = gateway.signature(",".join(f"{name}={payload[name]}" for name in RESPONSE_SIGNED_FIELDS))
+    return base64.b64encode(json.dumps(payload).encode()).decode()
+
+
+class StandInGateway:
+    """
+    Serves /api/epay/transaction/status/ on a free localhost port.
+
+    statuses maps transaction_uuid to the status to report, unknown ones get
+    NOT_FOUND; requests records every lookup and connections every TCP
+    connection accepted, so tests can check concurrency and pooling.
+    """
+
+    def __init__(self):
+        self.statuses = {}
+        self.requests = []
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.delay = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/epay/transaction/status/"
+
+    def _handler(self):
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, so connection reuse is visible
+
+            def setup(self):
+                super().setup()
+                with gateway._lock:
+                    gateway.connections += 1
+
+            def do_GET(self):
+                params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                with gateway._lock:
+                    gateway.requests.append(params)
+                    gateway.in_flight += 1
+                    gateway.max_in_flight = max(gateway.max_in_flight, gateway.in_flight)
+                try:
+                    if gateway.delay:
+                        threading.Event().wait(gateway.delay)
+                    uuid = params.get('transaction_uuid')
+                    body = json.dumps({
+                        'product_code': params.get('product_code'),
+                        'transaction_uuid': uuid,
+                        'total_amount': params.get('total_amount'),
+                        'status': gateway.statuses.get(uuid, 'NOT_FOUND'),
+                        'ref_id': None,
+                    }).encode()
+                finally:
+                    with gateway._lock:
+                        gateway.in_flight -= 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
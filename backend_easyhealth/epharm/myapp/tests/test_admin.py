@@ -0,0 +1,302 @@
+import csv
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.db import connection, transaction
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from myapp import admin_utils
+from myapp.admin import admin_site
+from myapp.models import Cart, CartItem, Order, OrderLine, OrderStatusEvent, Product, userPayment
+from myapp.payment_utils import transition_payment
+
+User = get_user_model()
+
+
+@pytest.fixture
+def admin_client():
+    client = Client()
+    client.force_login(User.objects.create_superuser(username='root', email='root@example.com', password='x'))
+    return client
+
+
+def populate(rows, prefix='user'):
+    product = Product.objects.create(name='Paracetamol', price='10.00', stock=100, category='OTC')
+    users = User.objects.bulk_create([
+        User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com') for i in range(rows)
+    ])
+    carts = Cart.objects.bulk_create([Cart(user=user) for user in users])
+    CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=2) for cart in carts])
+    orders = Order.objects.bulk_create([Order(user=user, total_price=20, stock_reserved=True) for user in users])
+    OrderLine.objects.bulk_create([
+        OrderLine(order=order, product=product, product_name='Paracetamol', unit_price=10, quantity=2)
+        for order in orders
+    ])
+    userPayment.objects.bulk_create([
+        userPayment(order=order, user=order.user, amount=20, total_amount=20, transaction_uuid=f'txn-{order.id}',
+                    status='PAID')
+        for order in orders
+    ])
+
+
+def changelist_queries(client, model):
+    with CaptureQueriesContext(connection) as captured:
+        response = client.get(reverse(f'admin:myapp_{model}_changelist'))
+    assert response.status_code == 200
+    return len(captured)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('model', ['order', 'cart', 'cartitem', 'userpayment'])
+def test_changelist_query_count_does_not_grow_with_rows(admin_client, model):
+    populate(3)
+    few = changelist_queries(admin_client, model)
+    populate(30, prefix='more')
+    assert changelist_queries(admin_client, model) == few
+
+
+@pytest.mark.django_db
+def test_order_changelist_shows_latest_payment_status(admin_client):
+    populate(1)
+    order = Order.objects.get()
+    userPayment.objects.create(order=order, user=order.user, amount=20, total_amount=20, transaction_uuid='txn-retry',
+                               status='REFUNDED')
+
+    response = admin_client.get(reverse('admin:myapp_order_changelist'))
+
+    assert 'REFUNDED' in response.content.decode()
+    assert str(order) == f'Order #{order.id} (pending)'
+
+
+@pytest.mark.django_db
+def test_search_matches_ids_exactly(admin_client):
+    populate(12)
+    order = Order.objects.order_by('id')[1]
+    payment = userPayment.objects.get(order=order)
+
+    response = admin_client.get(reverse('admin:myapp_order_changelist'), {'q': str(order.id)})
+    found = list(response.context['cl'].result_list)
+    assert order in found
+    # Anything else matched on the username, see test_numeric_search_also_matches_usernames
+    assert all(str(order.id) in other.user.username for other in found if other != order)
+
+    response = admin_client.get(reverse('admin:myapp_userpayment_changelist'), {'q': payment.transaction_uuid})
+    assert list(response.context['cl'].result_list) == [payment]
+
+    response = admin_client.get(reverse('admin:myapp_order_changelist'), {'q': 'user1'})
+    assert response.context['cl'].result_count == 3  # user1, user10, user11
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('model', ['order', 'cartitem', 'userpayment'])
+@pytest.mark.parametrize('term', ['²', '١٢', '9' * 40])
+def test_search_ignores_terms_that_are_not_primary_keys(admin_client, model, term):
+    populate(2)
+    response = admin_client.get(reverse(f'admin:myapp_{model}_changelist'), {'q': term})
+    assert response.status_code == 200
+    assert response.context['cl'].result_count == 0
+
+
+@pytest.mark.django_db
+def test_numeric_search_also_matches_usernames(admin_client):
+    order = Order.objects.create(user=User.objects.create(username='alice'), total_price=10)
+    numeric = Order.objects.create(user=User.objects.create(username=f'{order.id}42'), total_price=10)
+    Order.objects.create(user=User.objects.create(username='bob'), total_price=10)
+
+    response = admin_client.get(reverse('admin:myapp_order_changelist'), {'q': str(order.id)})
+    assert set(response.context['cl'].result_list) == {order, numeric}
+
+
+@pytest.mark.django_db
+def test_paginator_uses_the_estimate_only_for_large_tables(monkeypatch, settings):
+    populate(3)
+    settings.ADMIN_EXACT_COUNT_LIMIT = 1000
+    assert admin_utils.estimated_count(Order.objects.all()) is None  # No planner estimate on SQLite
+    assert admin_utils.EstimatedCountPaginator(Order.objects.order_by('id'), 2).count == 3
+
+    monkeypatch.setattr(admin_utils, 'estimated_count', lambda queryset: 5_000_000)
+    assert admin_utils.EstimatedCountPaginator(Order.objects.order_by('id'), 2).count == 5_000_000
+
+    monkeypatch.setattr(admin_utils, 'estimated_count', lambda queryset: 500)
+    assert admin_utils.EstimatedCountPaginator(Order.objects.order_by('id'), 2).count == 3
+
+
+def read_csv(response):
+    assert response.streaming
+    return list(csv.reader(line.decode() for line in response.streaming_content))
+
+
+@pytest.mark.django_db
+def test_export_action_streams_selected_rows(admin_client):
+    populate(5)
+    selected = list(Order.objects.order_by('id').values_list('id', flat=True)[:2])
+
+    response = admin_client.post(reverse('admin:myapp_order_changelist'), {
+        'action': 'export_csv', '_selected_action': selected,
+    })
+
+    rows = read_csv(response)
+    assert rows[0][:3] == ['Order', 'Created', 'Status']
+    assert [int(row[0]) for row in rows[1:]] == selected
+    assert rows[1][3:5] == ['user0', 'user0@example.com']
+    assert rows[1][-1] == 'PAID'
+
+
+@pytest.mark.django_db
+def test_export_view_honours_changelist_filters(admin_client):
+    populate(4)
+    userPayment.objects.filter(order__user__username='user2').update(status='FAILED')
+    userPayment.objects.filter(order__user__username='user3').update(transaction_code='=HYPERLINK("x")')
+
+    with CaptureQueriesContext(connection) as captured:
+        rows = read_csv(admin_client.get(reverse('admin:myapp_userpayment_export'), {'status__exact': 'PAID'}))
+
+    assert [row[7] for row in rows[1:]] == ['user0', 'user1', 'user3']
+    assert rows[3][2] == '\'=HYPERLINK("x")'
+    # One streamed SELECT however many rows are exported, and no changelist counts
+    assert len([query for query in captured if 'myapp_userpayment' in query['sql']]) == 1
+
+
+@pytest.mark.django_db
+def test_changelist_links_the_export_with_its_filters(admin_client):
+    populate(1)
+    response = admin_client.get(reverse('admin:myapp_userpayment_changelist'), {'status__exact': 'PAID'})
+    assert f'{reverse("admin:myapp_userpayment_export")}?status__exact=PAID' in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_export_view_redirects_bad_filters(admin_client):
+    response = admin_client.get(reverse('admin:myapp_order_export'), {'no_such_field': 'x'})
+    assert response.status_code == 302
+    assert response['Location'] == f"{reverse('admin:myapp_order_changelist')}?e=1"
+
+
+@pytest.mark.django_db
+def test_export_view_requires_admin(customer):
+    client = Client()
+    client.force_login(customer)
+    response = client.get(reverse('admin:myapp_product_export'))
+    assert response.status_code == 302
+
+
+@pytest.mark.django_db
+def test_admin_cancel_returns_stock_and_rejects_backward_moves(admin_client):
+    populate(1)
+    order = Order.objects.get()
+    url = reverse('admin:myapp_order_changelist')
+
+    def edit(to_status):
+        return admin_client.post(url, {
+            'form-TOTAL_FORMS': '1', 'form-INITIAL_FORMS': '1',
+            'form-0-id': order.id, 'form-0-status': to_status, '_save': 'Save',
+        }, follow=True)
+
+    edit('cancelled')
+    assert Order.objects.get().status == 'cancelled'
+    assert Product.objects.get().stock == 102
+    assert order.status_events.get().to_status == 'cancelled'
+
+    assert 'Cannot go from cancelled to pending' in edit('pending').content.decode()
+    assert Order.objects.get().status == 'cancelled'
+    assert Product.objects.get().stock == 102
+
+
+@pytest.mark.django_db
+def test_changelist_status_edit_uses_the_payment_state_machine(admin_client):
+    populate(1)
+    payment = userPayment.objects.get()
+
+    response = admin_client.post(reverse('admin:myapp_userpayment_changelist'), {
+        'form-TOTAL_FORMS': '1', 'form-INITIAL_FORMS': '1',
+        'form-0-id': payment.id, 'form-0-status': 'PENDING', '_save': 'Save',
+    }, follow=True)
+
+    content = response.content.decode()
+    assert 'Cannot go from PAID to PENDING' in content
+    assert 'changed successfully' not in content
+    assert userPayment.objects.get().status == 'PAID'
+
+
+@pytest.mark.django_db
+def test_rejected_payment_status_edit_saves_nothing(admin_client):
+    populate(1)
+    payment = userPayment.objects.get()
+    payment_admin = admin_site._registry[userPayment]
+    request = RequestFactory().get('/')
+    request.user = User.objects.get(username='root')
+
+    form = payment_admin.get_form(request, payment)(instance=payment, data={
+        'amount': '20.00', 'tax_amount': '0', 'total_amount': '20.00', 'transaction_code': 'EDITED',
+        'status': 'PENDING', 'product_code': payment.product_code, 'user': payment.user_id,
+        'order': payment.order_id,
+    })
+
+    # The change form fails validation as a whole, so save_model never runs
+    assert not form.is_valid()
+    assert form.errors['status'] == ['Cannot go from PAID to PENDING.']
+    payment.refresh_from_db()
+    assert (payment.status, payment.transaction_code, payment.version) == ('PAID', None, 0)
+
+
+def validated_change_form(model, obj, **changes):
+    """(model_admin, request, form) for a change form that passed validation, before save_model runs"""
+    model_admin = admin_site._registry[model]
+    request = RequestFactory().post('/')
+    request.user = User.objects.get(username='root')
+    request.session = {}
+    request._messages = FallbackStorage(request)
+    form_class = model_admin.get_form(request, obj)
+    data = {name: value for name, value in form_class(instance=obj).initial.items() if value is not None}
+    data.pop('prescription', None)
+    form = form_class(instance=obj, data={**data, **changes})
+    assert form.is_valid(), form.errors
+    return model_admin, request, form
+
+
+def save(model_admin, request, form):
+    with transaction.atomic():
+        model_admin.save_model(request, form.save(commit=False), form, change=True)
+
+
+@pytest.mark.django_db
+def test_order_status_edit_losing_a_race_saves_nothing(admin_client):
+    populate(1)
+    order_admin, request, form = validated_change_form(Order, Order.objects.get(), status='cancelled',
+                                                       address='Edited')
+
+    # Shipped by someone else after the form was validated
+    Order.objects.update(status='shipped')
+    save(order_admin, request, form)
+
+    order = Order.objects.get()
+    assert (order.status, order.address) == ('shipped', 'Unknown Address')
+    assert Product.objects.get().stock == 100
+    assert not OrderStatusEvent.objects.exists()
+    assert [str(message) for message in request._messages] == [
+        f"Order #{order.id} changed status meanwhile, nothing was saved."
+    ]
+
+
+@pytest.mark.django_db
+def test_order_edit_without_status_keeps_a_concurrent_move(admin_client):
+    populate(1)
+    order_admin, request, form = validated_change_form(Order, Order.objects.get(), address='Edited')
+
+    Order.objects.update(status='shipped')
+    save(order_admin, request, form)
+
+    assert Order.objects.values_list('status', 'address').get() == ('shipped', 'Edited')
+
+
+@pytest.mark.django_db
+def test_payment_edit_without_status_keeps_a_concurrent_move(admin_client):
+    populate(1)
+    payment_admin, request, form = validated_change_form(userPayment, userPayment.objects.get(),
+                                                         transaction_code='EDITED')
+
+    transition_payment(userPayment.objects.get(), 'REFUNDED')
+    save(payment_admin, request, form)
+
+    assert userPayment.objects.values_list('status', 'version', 'transaction_code').get() == ('REFUNDED', 1, 'EDITED')
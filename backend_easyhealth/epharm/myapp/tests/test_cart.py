@@ -0,0 +1,192 @@
+import json
+import pytest
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+from rest_framework import status
+from myapp.models import Cart, CartItem, Order, Product
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
+@pytest.fixture
+def products():
+    return [Product.objects.create(
+        name=f'Product {i}',
+        price=f'{i + 1}.50',
+        stock=100,
+        category='OTC'
+    ) for i in range(20)]
+
+
+@pytest.fixture
+def full_cart(customer, products):
+    cart = Cart.objects.create(user=customer)
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product=product, quantity=2) for product in products
+    ])
+    return cart
+
+
+@pytest.mark.django_db
+def test_view_cart_without_cart_is_empty(customer_client):
+    response = customer_client.get(reverse('myapp:cart'))
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['cart_items'] == []
+    assert response.data['total_price'] == 0
+
+
+@pytest.mark.django_db
+def test_view_cart_query_count_is_constant(customer_client, full_cart, django_assert_max_num_queries):
+    with django_assert_max_num_queries(2):
+        response = customer_client.get(reverse('myapp:cart'))
+
+    assert len(response.data['cart_items']) == 20
+    assert response.data['total_price'] == sum(2 * (i + 1.5) for i in range(20))
+
+    # Second read is served from the versioned snapshot
+    with django_assert_max_num_queries(1):
+        customer_client.get(reverse('myapp:cart'))
+
+
+@pytest.mark.django_db
+def test_cart_mutations_refresh_snapshot(customer_client, full_cart, products):
+    customer_client.get(reverse('myapp:cart'))
+
+    url = reverse('myapp:remove-from-cart', kwargs={'product_id': products[0].id})
+    response = customer_client.delete(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.data['cart_items']) == 19
+    assert response.data['version'] == 1
+
+    response = customer_client.get(reverse('myapp:cart'))
+    assert len(response.data['cart_items']) == 19
+
+
+@pytest.mark.django_db
+def test_add_to_cart_returns_snapshot(customer_client, products):
+    url = reverse('myapp:add-to-cart', kwargs={'product_id': products[0].id})
+    customer_client.post(url)
+    response = customer_client.post(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['cart_items'][0]['quantity'] == 2
+    assert response.data['total_price'] == 3.0
+
+
+@pytest.mark.django_db
+def test_cart_batch_applies_operations_in_order(customer_client, full_cart, products):
+    operations = [
+        {'op': 'add', 'product_id': products[0].id, 'quantity': 3},
+        {'op': 'set', 'product_id': products[1].id, 'quantity': 7},
+        {'op': 'remove', 'product_id': products[2].id},
+        {'op': 'set', 'product_id': products[3].id, 'quantity': 0},
+        {'op': 'add', 'product_id': products[2].id},
+    ]
+    response = customer_client.post(reverse('myapp:cart-batch'), {'operations': operations}, format='json')
+
+    assert response.status_code == status.HTTP_200_OK
+    quantities = {item['product_id']: item['quantity'] for item in response.data['cart_items']}
+    assert quantities[products[0].id] == 5
+    assert quantities[products[1].id] == 7
+    assert quantities[products[2].id] == 1
+    assert products[3].id not in quantities
+    assert len(quantities) == 19
+    assert response.data['version'] == 1
+
+
+@pytest.mark.django_db
+def test_cart_batch_rejects_invalid_operation(customer_client, full_cart, products):
+    operations = [
+        {'op': 'add', 'product_id': products[0].id},
+        {'op': 'explode', 'product_id': products[1].id},
+    ]
+    response = customer_client.post(reverse('myapp:cart-batch'), {'operations': operations}, format='json')
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert CartItem.objects.get(cart=full_cart, product=products[0]).quantity == 2
+
+
+@pytest.mark.django_db
+def test_cart_batch_attaches_prescription(customer_client, products, settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    rx_product = products[0]
+    rx_product.prescription_required = True
+    rx_product.save()
+
+    operations = [
+        {'op': 'add', 'product_id': rx_product.id},
+        {'op': 'attach_prescription', 'product_id': rx_product.id, 'file': 'rx'},
+    ]
+    response = customer_client.post(reverse('myapp:cart-batch'), {
+        'operations': json.dumps(operations),
+        'rx': SimpleUploadedFile('rx.png', b'prescription-bytes', content_type='image/png'),
+    }, format='multipart')
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['cart_items'][0]['prescription'].endswith('.png')
+    item = CartItem.objects.get(product=rx_product)
+    assert item.prescription_file.read() == b'prescription-bytes'
+
+
+@pytest.mark.django_db
+def test_cart_quantity_updates_are_conditional(customer_client, full_cart, products):
+    url = reverse('myapp:update-cart-item', kwargs={'product_id': products[0].id})
+
+    assert customer_client.post(url, {'action': 'decrease'}).status_code == status.HTTP_200_OK
+    response = customer_client.post(url, {'action': 'decrease'})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert CartItem.objects.get(cart=full_cart, product=products[0]).quantity == 1
+
+    missing = reverse('myapp:update-cart-item', kwargs={'product_id': 999999})
+    assert customer_client.post(missing, {'action': 'increase'}).status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_open_cart_lines_are_unique(full_cart, products):
+    with pytest.raises(IntegrityError), transaction.atomic():
+        CartItem.objects.create(cart=full_cart, product=products[0])
+
+    # Lines already linked to an order do not count against the constraint
+    order = Order.objects.create(user=full_cart.user, total_price=0)
+    CartItem.objects.create(cart=full_cart, product=products[0], order=order)
+    CartItem.objects.create(cart=full_cart, product=products[0], order=order)
+
+
+@pytest.mark.django_db
+def test_cart_mutation_returns_delta_for_current_client(customer_client, full_cart, products):
+    url = reverse('myapp:update-cart-item', kwargs={'product_id': products[0].id})
+    response = customer_client.post(url, {'action': 'increase'}, HTTP_IF_MATCH='"0"')
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['delta'] is True
+    assert response.data['version'] == 1
+    assert response['ETag'] == '"1"'
+    assert [item['quantity'] for item in response.data['cart_items']] == [3]
+    assert response.data['item_count'] == 20
+    assert response.data['total_price'] == sum(2 * (i + 1.5) for i in range(20)) + 1.5
+
+    url = reverse('myapp:remove-from-cart', kwargs={'product_id': products[1].id})
+    response = customer_client.delete(f'{url}?since_version=1')
+    assert response.data['delta'] is True
+    assert response.data['cart_items'] == []
+    assert response.data['removed_product_ids'] == [products[1].id]
+
+
+@pytest.mark.django_db
+def test_cart_mutation_resyncs_stale_client(customer_client, full_cart, products):
+    url = reverse('myapp:update-cart-item', kwargs={'product_id': products[0].id})
+    customer_client.post(url, {'action': 'increase'})
+
+    # The client still holds version 0, so it receives the whole cart
+    response = customer_client.post(url, {'action': 'increase'}, HTTP_IF_MATCH='"0"')
+    assert response.data['delta'] is False
+    assert len(response.data['cart_items']) == 20
+
+    response = customer_client.get(reverse('myapp:cart'), HTTP_IF_NONE_MATCH='"2"')
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
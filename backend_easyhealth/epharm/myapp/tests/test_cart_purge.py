@@ -0,0 +1,79 @@
+from datetime import timedelta
+
+import pytest
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.utils import timezone
+from myapp.cart_purge import purge_abandoned_carts, purge_orphaned_lines
+from myapp.models import Cart, CartItem, CustomUser, Order, PrescriptionBlob
+from myapp.prescription_storage import attach_prescription
+
+
+pytestmark = pytest.mark.usefixtures('media_root')
+
+
+@pytest.fixture
+def product(make_product):
+    return make_product(name='Antibiotic', price='12.00', stock=10, category='RX', prescription_required=True)
+
+
+def make_cart(username, product=None, days_old=0, prescription=None):
+    user = CustomUser.objects.create_user(username=username, email=f'{username}@example.com', password='x')
+    cart = Cart.objects.create(user=user)
+    if product:
+        item = CartItem(cart=cart, product=product)
+        if prescription:
+            attach_prescription(item, SimpleUploadedFile('rx.jpg', prescription), 'prescription_file')
+        item.save()
+    Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now() - timedelta(days=days_old))
+    return cart
+
+
+@pytest.mark.django_db
+def test_purge_respects_age_thresholds(product, django_capture_on_commit_callbacks):
+    fresh = make_cart('fresh', product, days_old=1)
+    idle_empty = make_cart('idle_empty', days_old=10)
+    idle_full = make_cart('idle_full', product, days_old=10)
+    abandoned = make_cart('abandoned', product, days_old=40, prescription=b'only here')
+    shared = make_cart('shared', product, days_old=1, prescription=b'shared')
+    make_cart('old_shared', product, days_old=40, prescription=b'shared')
+    blob_path = PrescriptionBlob.objects.get(ref_count=1, size=len(b'only here')).file.name
+
+    with django_capture_on_commit_callbacks(execute=True):
+        totals = purge_abandoned_carts(abandoned_days=30, empty_days=7, batch_size=1)
+
+    assert totals == {'carts': 3, 'lines': 2, 'bytes': len(b'only here')}
+    assert set(Cart.objects.values_list('id', flat=True)) == {fresh.id, idle_full.id, shared.id}
+    assert not Cart.objects.filter(id__in=[idle_empty.id, abandoned.id]).exists()
+    assert not default_storage.exists(blob_path)
+    assert PrescriptionBlob.objects.get().ref_count == 1
+
+
+@pytest.mark.django_db
+def test_purge_keeps_order_lines(customer, product):
+    cart = make_cart('abandoned', product, days_old=40)
+    order = Order.objects.create(user=customer, total_price=12)
+    line = CartItem.objects.create(cart=cart, product=product, order=order)
+    orphan = CartItem.objects.create(product=product)
+
+    purge_abandoned_carts(abandoned_days=30)
+    assert purge_orphaned_lines() == {'lines': 1, 'bytes': 0}
+
+    line.refresh_from_db()
+    assert line.cart_id is None and line.order_id == order.id
+    assert not CartItem.objects.filter(pk=orphan.pk).exists()
+
+
+@pytest.mark.django_db
+def test_order_lines_are_not_filed_under_a_cart(customer, product):
+    order = Order.objects.create(user=customer, total_price=12)
+    assert CartItem.objects.create(product=product, order=order).cart_id is None
+
+
+@pytest.mark.django_db
+def test_purge_command_dry_run(product, capsys):
+    make_cart('abandoned', product, days_old=40)
+    call_command('purge_carts', '--dry-run')
+    assert 'Would delete 1 cart(s) and 1 cart line(s)' in capsys.readouterr().out
+    assert Cart.objects.count() == 1
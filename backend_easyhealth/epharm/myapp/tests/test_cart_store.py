@@ -0,0 +1,90 @@
+import pytest
+from django.urls import reverse
+from rest_framework import status
+from myapp import cart_store
+from myapp.cart_store import RedisCartStore
+from myapp.models import Cart, CartItem, Product
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def store(settings, monkeypatch):
+    settings.CART_BACKEND = 'redis'
+    store = RedisCartStore(connection=fakeredis.FakeRedis())
+    monkeypatch.setattr(cart_store, '_store', store)
+    return store
+
+
+@pytest.fixture
+def product():
+    return Product.objects.create(name='Cetamol', price='4.00', stock=10, category='OTC')
+
+
+@pytest.mark.django_db
+def test_redis_cart_mutations_skip_the_database(customer, customer_client, store, product):
+    url = reverse('myapp:add-to-cart', kwargs={'product_id': product.id})
+    customer_client.post(url)
+    response = customer_client.post(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['cart_items'][0]['quantity'] == 2
+    assert response.data['total_price'] == 8.0
+    assert not CartItem.objects.exists()
+
+    url = reverse('myapp:update-cart-item', kwargs={'product_id': product.id})
+    response = customer_client.post(url, {'action': 'decrease'})
+    assert response.data['cart_items'][0]['quantity'] == 1
+
+    response = customer_client.post(url, {'action': 'decrease'})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_flush_dirty_writes_carts_back(customer, store, product):
+    store.add(customer.id, product.id, 3)
+    assert store.flush_dirty() == 1
+
+    item = CartItem.objects.get(cart__user=customer)
+    assert item.quantity == 3
+    assert Cart.objects.get(user=customer).version == 1
+
+    store.remove(customer.id, product.id)
+    store.flush_dirty()
+    assert not CartItem.objects.filter(cart__user=customer).exists()
+    assert store.flush_dirty() == 0
+
+
+@pytest.mark.django_db
+def test_checkout_persists_redis_cart_first(customer, customer_client, store, product):
+    store.add(customer.id, product.id, 2)
+
+    response = customer_client.post(reverse('myapp:checkout'), {'address': 'Kathmandu'})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert store.quantities(customer.id)[0] == {}
+
+
+@pytest.mark.django_db
+def test_redis_cart_batch(customer, customer_client, store, product):
+    operations = [
+        {'op': 'add', 'product_id': product.id, 'quantity': 4},
+        {'op': 'set', 'product_id': product.id, 'quantity': 2},
+    ]
+    response = customer_client.post(reverse('myapp:cart-batch'), {'operations': operations}, format='json')
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['cart_items'][0]['quantity'] == 2
+    assert store.quantities(customer.id) == ({product.id: 2}, 1)
+
+
+@pytest.mark.django_db
+def test_redis_cart_delta_response(customer, customer_client, store, product):
+    store.add(customer.id, product.id)
+
+    url = reverse('myapp:add-to-cart', kwargs={'product_id': product.id})
+    response = customer_client.post(url, HTTP_IF_MATCH='"1"')
+
+    assert response.data['delta'] is True
+    assert response.data['cart_items'][0]['quantity'] == 2
+    assert response.data['total_price'] == 8.0
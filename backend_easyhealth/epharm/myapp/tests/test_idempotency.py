@@ -0,0 +1,60 @@
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+from myapp.idempotency import get_idempotency_store
+from myapp.models import IdempotencyKey, Order, Product, userPayment
+from myapp.tests.conftest import place
+
+
+@pytest.fixture(params=['redis', 'db'])
+def backend(request, settings):
+    settings.IDEMPOTENCY_BACKEND = request.param
+    cache.clear()
+    return request.param
+
+
+@pytest.mark.django_db
+def test_retried_order_is_replayed(customer_client, product, backend):
+    first = place(customer_client, [{'id': product.id, 'quantity': 1}], idempotency_key='order-attempt-1')
+    retry = place(customer_client, [{'id': product.id, 'quantity': 1}], idempotency_key='order-attempt-1')
+
+    assert first.status_code == retry.status_code == status.HTTP_201_CREATED
+    assert retry.data == {'order_id': first.data['order_id']}
+    assert retry['Idempotent-Replayed'] == 'true'
+    assert Order.objects.count() == 1
+    assert Product.objects.get(id=product.id).stock == 4
+
+    another = place(customer_client, [{'id': product.id, 'quantity': 1}], idempotency_key='order-attempt-2')
+    assert another.data['order_id'] != first.data['order_id']
+    assert IdempotencyKey.objects.count() == (2 if backend == 'db' else 0)
+
+
+@pytest.mark.django_db
+def test_key_reused_for_another_request_is_rejected(customer_client, product, backend):
+    place(customer_client, [{'id': product.id, 'quantity': 1}], idempotency_key='order-attempt-1')
+    response = place(customer_client, [{'id': product.id, 'quantity': 2}], idempotency_key='order-attempt-1')
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert Order.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_retry_while_first_request_runs_gets_conflict(customer, customer_client, product, backend):
+    scope = f"{customer.id}:{reverse('myapp:order-place')}:order-attempt-1"
+    get_idempotency_store().begin(scope, 'fingerprint of the running request')
+
+    response = place(customer_client, [{'id': product.id, 'quantity': 1}], idempotency_key='order-attempt-1')
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert not Order.objects.exists()
+
+
+@pytest.mark.django_db
+def test_retried_payment_initiation_is_replayed(customer_client, backend):
+    payload = {'amount': 100, 'tax_amount': 10, 'transaction_uuid': 'txn-1'}
+    url = reverse('myapp:payment-process')
+    first = customer_client.post(url, payload, HTTP_IDEMPOTENCY_KEY='pay-1')
+    retry = customer_client.post(url, payload, HTTP_IDEMPOTENCY_KEY='pay-1')
+
+    assert first.status_code == retry.status_code == status.HTTP_200_OK
+    assert retry.data['signature'] == first.data['signature']
+    assert userPayment.objects.count() == 1
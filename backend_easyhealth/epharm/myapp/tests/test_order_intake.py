@@ -0,0 +1,143 @@
+import uuid
+from datetime import timedelta
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+from rest_framework import status
+from myapp.models import InventoryHold, Order, OrderRequest, PrescriptionBlob, Product, Task
+from myapp import order_intake
+from myapp.order_intake import claim_order_requests, process_order_requests
+from myapp.tests.conftest import place
+
+
+@pytest.fixture(autouse=True)
+def queued_intake(settings, media_root):
+    settings.ORDER_INTAKE_MODE = 'queue'
+
+
+def poll(client, response):
+    return client.get(response['Location'])
+
+
+@pytest.mark.django_db
+def test_queued_order_is_accepted_without_touching_stock(customer_client, stocked_products,
+                                                         django_assert_max_num_queries):
+    product = stocked_products[0]
+    with django_assert_max_num_queries(4):
+        response = place(customer_client, [{'id': product.id, 'quantity': 2}])
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.data['status_url'] == response['Location']
+    assert Product.objects.get(id=product.id).stock == 5
+    assert not Order.objects.exists()
+
+    queued = poll(customer_client, response)
+    assert queued.data['status'] == 'queued'
+    assert queued['Retry-After'] == '1'
+
+    assert process_order_requests() == 1
+    placed = poll(customer_client, response)
+    order = Order.objects.get()
+    assert placed.data['status'] == 'placed'
+    assert placed.data['order_id'] == order.id
+    assert order.total_price == 20
+    assert dict(order.lines.values_list('product_id', 'quantity')) == {product.id: 2}
+    assert Product.objects.get(id=product.id).stock == 3
+    assert Task.objects.filter(payload={'order_id': order.id}).count() == 3
+
+
+@pytest.mark.django_db
+def test_batch_serves_requests_in_arrival_order(customer, customer_client, stocked_products,
+                                                django_assert_max_num_queries):
+    first, second = stocked_products[0], stocked_products[1]
+    responses = [place(customer_client, [{'id': first.id, 'quantity': 2}, {'id': second.id, 'quantity': 1}])
+                 for _ in range(3)]
+    responses.append(place(customer_client, [{'id': second.id, 'quantity': 1}], payment_method='online'))
+
+    # Claim, locks, one stock UPDATE and bulk inserts: the count does not grow with the batch
+    with django_assert_max_num_queries(15):
+        assert process_order_requests() == 4
+
+    statuses = [poll(customer_client, response).data for response in responses]
+    assert [entry['status'] for entry in statuses] == ['placed', 'placed', 'rejected', 'placed']
+    assert statuses[2]['product_id'] == first.id
+    assert statuses[2]['detail'] == 'Not enough stock for Product 0.'
+    assert statuses[3]['message'] == 'Proceed to eSewa payment'
+    assert Product.objects.get(id=first.id).stock == 1
+    assert Product.objects.get(id=second.id).stock == 2
+    assert Order.objects.count() == 3
+    assert list(InventoryHold.objects.values_list('order_id', 'quantity')) == [(statuses[3]['order_id'], 1)]
+
+
+@pytest.mark.django_db
+def test_requests_are_claimed_once(customer_client, stocked_products):
+    responses = [place(customer_client, [{'id': stocked_products[0].id, 'quantity': 1}]) for _ in range(3)]
+
+    token, first = claim_order_requests(2)
+    _, second = claim_order_requests(2)
+    assert [order_request.id for order_request in first] == [response.data['request_id'] for response in responses[:2]]
+    assert [order_request.id for order_request in second] == [responses[2].data['request_id']]
+    assert claim_order_requests(2) == (None, [])
+    # Claimed requests still look queued to the client
+    assert poll(customer_client, responses[0]).data['status'] == 'queued'
+
+
+@pytest.mark.django_db
+def test_abandoned_claim_is_taken_over(customer_client, stocked_products):
+    response = place(customer_client, [{'id': stocked_products[0].id, 'quantity': 1}])
+    claim_order_requests(10)
+    assert process_order_requests() == 0
+
+    # The worker died; once its claim runs out another one places the request
+    OrderRequest.objects.update(claimed_until=timezone.now() - timedelta(seconds=1))
+    assert process_order_requests() == 1
+    assert poll(customer_client, response).data['status'] == 'placed'
+    assert Order.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_batch_taken_over_mid_placement_is_dropped(customer_client, stocked_products, monkeypatch):
+    place(customer_client, [{'id': stocked_products[0].id, 'quantity': 1}])
+    claim = order_intake.claim_order_requests
+
+    def claim_then_lose(batch_size):
+        token, order_requests = claim(batch_size)
+        OrderRequest.objects.update(claim_token=uuid.uuid4())
+        return token, order_requests
+
+    monkeypatch.setattr(order_intake, 'claim_order_requests', claim_then_lose)
+    assert process_order_requests() == 0
+    assert not Order.objects.exists()
+    assert OrderRequest.objects.get().status == 'placing'
+    assert Product.objects.get(id=stocked_products[0].id).stock == 5
+
+
+@pytest.mark.django_db
+def test_queued_order_validates_the_payload(customer_client, stocked_products):
+    assert place(customer_client, [{'id': stocked_products[0].id, 'quantity': 0}]).status_code == 400
+    assert place(customer_client, [{'id': 12345, 'quantity': 1}]).status_code == 404
+    assert not OrderRequest.objects.exists()
+
+
+@pytest.mark.django_db
+def test_prescription_moves_to_the_order_or_is_released(customer_client, stocked_products):
+    product = stocked_products[0]
+    upload = lambda: SimpleUploadedFile('rx.jpg', b'scan', content_type='image/jpeg')
+    placed = place(customer_client, [{'id': product.id, 'quantity': 5}], prescription=upload())
+    rejected = place(customer_client, [{'id': product.id, 'quantity': 1}], prescription=upload())
+    assert PrescriptionBlob.objects.get().ref_count == 2
+
+    process_order_requests()
+
+    order = Order.objects.get(id=poll(customer_client, placed).data['order_id'])
+    assert poll(customer_client, rejected).data['status'] == 'rejected'
+    assert order.prescription_blob.ref_count == 1
+    assert order.prescription.name == order.prescription_blob.file.name
+    assert not OrderRequest.objects.filter(prescription_blob__isnull=False).exists()
+
+
+@pytest.mark.django_db
+def test_request_status_is_private(customer_client, staff_client, stocked_products):
+    response = place(customer_client, [{'id': stocked_products[0].id, 'quantity': 1}])
+    assert poll(staff_client, response).status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,475 @@
+import importlib
+from datetime import timedelta
+
+import pytest
+from django.apps import apps
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from myapp.models import Cart, CartItem, InventoryHold, Order, OrderLine, OrderStatusEvent, Product, Task, userPayment
+from myapp.order_utils import release_expired_holds, transition_orders
+from myapp.serializers import OrderSerializer, UserPaymentSerializer
+from myapp.tasks import send_refund_notice
+from myapp.tests.conftest import place
+from myapp.tests.esewa_standin import callback_data
+
+
+def pay(client, order_id, callback_status='COMPLETE'):
+    url = reverse('myapp:payment-process')
+    total = Order.objects.get(id=order_id).total_price
+    client.post(url, {'amount': total, 'tax_amount': 0, 'transaction_uuid': f'txn-{order_id}', 'order_id': order_id})
+    return client.post(url, {'status': callback_status, 'data': callback_data(f'txn-{order_id}', total),
+                             'transaction_uuid': f'txn-{order_id}'})
+
+
+def expire_holds():
+    InventoryHold.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+
+@pytest.mark.django_db
+def test_place_order_reserves_stock_and_creates_lines(customer_client, stocked_products):
+    response = place(customer_client, [
+        {'id': stocked_products[0].id, 'quantity': 2},
+        {'product_id': stocked_products[1].id, 'id': 999, 'quantity': 1},
+        {'id': stocked_products[0].id, 'quantity': 1},
+    ])
+
+    assert response.status_code == status.HTTP_201_CREATED
+    order = Order.objects.get(id=response.data['order_id'])
+    assert order.total_price == 40
+    assert dict(order.lines.values_list('product_id', 'quantity')) == {
+        stocked_products[0].id: 3, stocked_products[1].id: 1
+    }
+    assert not CartItem.objects.exists()
+    assert Product.objects.get(id=stocked_products[0].id).stock == 2
+
+
+@pytest.mark.django_db
+def test_shortfall_rolls_back_every_reservation(customer_client, stocked_products):
+    first, short = stocked_products[0], stocked_products[1]
+    response = place(customer_client, [
+        {'id': first.id, 'quantity': 2},
+        {'id': short.id, 'quantity': 6},
+    ])
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['product_id'] == short.id
+    assert first.id in [alternative['id'] for alternative in response.data['alternatives']]
+    assert Product.objects.get(id=first.id).stock == 5
+    assert not Order.objects.exists()
+    assert not OrderLine.objects.exists()
+
+
+@pytest.mark.django_db
+def test_place_order_rejects_bad_items(customer_client, stocked_products):
+    assert place(customer_client, [{'id': stocked_products[0].id, 'quantity': 0}]).status_code == 400
+    assert place(customer_client, [{'id': 12345, 'quantity': 1}]).status_code == 404
+    assert not Order.objects.exists()
+
+
+@pytest.mark.django_db
+def test_place_order_query_count_is_flat(customer_client, stocked_products, django_assert_max_num_queries):
+    with django_assert_max_num_queries(9):
+        response = place(customer_client, [{'id': product.id, 'quantity': 1} for product in stocked_products])
+    assert response.status_code == status.HTTP_201_CREATED
+    assert set(Product.objects.values_list('stock', flat=True)) == {4}
+
+
+@pytest.mark.django_db
+def test_unpaid_online_order_releases_its_stock(customer_client, stocked_products):
+    product = stocked_products[0]
+    order_id = place(customer_client, [{'id': product.id, 'quantity': 2}], 'online').data['order_id']
+    assert InventoryHold.objects.get(order_id=order_id).status == 'active'
+    assert place(customer_client, [{'id': product.id, 'quantity': 1}]).status_code == status.HTTP_201_CREATED
+    assert not InventoryHold.objects.exclude(order_id=order_id).exists()
+
+    assert release_expired_holds() == 0
+    expire_holds()
+    call_command('release_inventory_holds')
+
+    assert Product.objects.get(id=product.id).stock == 4
+    assert Order.objects.get(id=order_id).status == 'cancelled'
+    assert InventoryHold.objects.get(order_id=order_id).status == 'released'
+    assert release_expired_holds() == 0
+
+
+@pytest.mark.django_db
+def test_successful_payment_confirms_the_hold(customer_client, stocked_products):
+    product = stocked_products[0]
+    order_id = place(customer_client, [{'id': product.id, 'quantity': 2}], 'online').data['order_id']
+
+    assert pay(customer_client, order_id).status_code == status.HTTP_200_OK
+    assert userPayment.objects.get().order_id == order_id
+    expire_holds()
+
+    assert release_expired_holds() == 0
+    assert InventoryHold.objects.get(order_id=order_id).status == 'confirmed'
+    assert Product.objects.get(id=product.id).stock == 3
+
+
+@pytest.mark.django_db
+def test_late_payment_reserves_stock_again(customer_client, stocked_products):
+    product = stocked_products[0]
+    order_id = place(customer_client, [{'id': product.id, 'quantity': 2}], 'online').data['order_id']
+    expire_holds()
+    release_expired_holds()
+
+    pay(customer_client, order_id)
+
+    assert Order.objects.get(id=order_id).status == 'paid'
+    assert list(OrderStatusEvent.objects.filter(order_id=order_id).values_list('from_status', 'to_status')) == [
+        ('pending', 'cancelled'), ('cancelled', 'pending'), ('pending', 'paid')
+    ]
+    assert InventoryHold.objects.get(order_id=order_id).status == 'confirmed'
+    assert Product.objects.get(id=product.id).stock == 3
+
+
+@pytest.mark.django_db
+def test_late_payment_for_sold_out_stock_queues_a_refund(customer, customer_client, stocked_products, settings, mailoutbox):
+    settings.REFUND_EMAILS = ['payments@medinest.local']
+    product = stocked_products[0]
+    order_id = place(customer_client, [{'id': product.id, 'quantity': 2}], 'online').data['order_id']
+    expire_holds()
+    release_expired_holds()
+    Product.objects.filter(id=product.id).update(stock=1)
+
+    assert pay(customer_client, order_id).status_code == status.HTTP_200_OK
+
+    assert userPayment.objects.get().status == 'PAID'
+    assert Order.objects.get(id=order_id).status == 'cancelled'
+    assert InventoryHold.objects.get(order_id=order_id).status == 'released'
+    assert Product.objects.get(id=product.id).stock == 1
+    assert not Task.objects.filter(name='send_payment_confirmation').exists()
+
+    send_refund_notice(**Task.objects.get(name='send_refund_notice').payload)
+    assert [mail.to for mail in mailoutbox] == [[customer.email], ['payments@medinest.local']]
+
+
+@pytest.mark.django_db
+def test_payment_cannot_link_someone_elses_order(customer_client, staff_user, stocked_products):
+    order = Order.objects.create(user=staff_user, total_price=10)
+    response = customer_client.post(reverse('myapp:payment-process'), {
+        'amount': 10, 'tax_amount': 0, 'transaction_uuid': 'txn-1', 'order_id': order.id
+    })
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert not userPayment.objects.exists()
+
+
+@pytest.mark.django_db
+def test_payment_must_cover_the_linked_order(customer_client, stocked_products):
+    order_id = place(customer_client, [{'id': stocked_products[0].id, 'quantity': 2}], 'online').data['order_id']
+    url = reverse('myapp:payment-process')
+
+    response = customer_client.post(url, {'amount': 1, 'tax_amount': 0, 'transaction_uuid': 'txn-low',
+                                          'order_id': order_id})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert not userPayment.objects.exists()
+
+    response = customer_client.post(url, {'amount': '18.5', 'tax_amount': '1.5', 'transaction_uuid': 'txn-full',
+                                          'order_id': order_id})
+    assert response.status_code == status.HTTP_200_OK
+    assert userPayment.objects.get().order_id == order_id
+
+
+@pytest.mark.django_db
+def test_order_history_keeps_the_price_paid(customer_client, stocked_products, django_assert_num_queries):
+    for product in stocked_products[:3]:
+        place(customer_client, [{'id': product.id, 'quantity': 2}])
+    Product.objects.update(price='99.00', name='Renamed')
+
+    with django_assert_num_queries(2):
+        response = customer_client.get(reverse('myapp:user-profile'))
+
+    lines = [line for order in response.data['orders'] for line in order['cart_items']]
+    assert len(lines) == 3
+    assert {(line['product_name'], line['price'], line['total_price']) for line in lines} == {
+        (f'Product {i}', 10.0, 20.0) for i in range(3)
+    }
+
+
+@pytest.mark.django_db
+def test_checkout_moves_cart_lines_to_the_order(customer, customer_client, stocked_products):
+    cart = Cart.objects.create(user=customer)
+    CartItem.objects.create(cart=cart, product=stocked_products[0], quantity=2)
+
+    response = customer_client.post(reverse('myapp:checkout'), {'address': '123 Test Street'})
+
+    assert response.status_code == status.HTTP_200_OK
+    order = Order.objects.get(id=response.data['order_id'])
+    assert order.total_price == 20
+    assert [str(line) for line in order.lines.all()] == ['2 x Product 0']
+    assert CartItem.objects.get().order_id == order.id
+    assert not CartItem.objects.filter(cart=cart).exists()
+
+
+@pytest.mark.django_db
+def test_backfill_copies_order_linked_cart_lines(customer, stocked_products):
+    migration = importlib.import_module('myapp.migrations.0043_backfill_orderlines')
+    order = Order.objects.create(user=customer, total_price=30)
+    CartItem.objects.bulk_create([
+        CartItem(order=order, product=product, quantity=1) for product in stocked_products[:3]
+    ])
+
+    migration.BATCH_SIZE = 2
+    migration.backfill_order_lines(apps, None)
+
+    assert sorted(order.lines.values_list('product_name', flat=True)) == ['Product 0', 'Product 1', 'Product 2']
+
+
+@pytest.mark.django_db
+def test_order_history_pages_with_a_cursor(customer, customer_client, django_assert_num_queries):
+    created_at = timezone.now()
+    orders = Order.objects.bulk_create([
+        Order(user=customer, total_price=10, address='Somewhere') for _ in range(5)
+    ])
+    # Two orders share a timestamp, the id breaks the tie
+    Order.objects.filter(id__in=[orders[1].id, orders[2].id]).update(created_at=created_at)
+    OrderLine.objects.bulk_create([
+        OrderLine(order=order, product_name='Paracetamol', unit_price=10, quantity=1) for order in orders
+    ])
+
+    seen, cursor = [], None
+    while True:
+        params = {'page_size': 2, **({'cursor': cursor} if cursor else {})}
+        with django_assert_num_queries(2):
+            response = customer_client.get(reverse('myapp:user-orders'), params)
+        assert response.status_code == status.HTTP_200_OK
+        assert all(len(order['cart_items']) == 1 for order in response.data['orders'])
+        seen += [order['order_id'] for order in response.data['orders']]
+        cursor = response.data['next_cursor']
+        if cursor is None:
+            break
+
+    expected = list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+    assert seen == expected
+
+    profile = customer_client.get(reverse('myapp:user-profile')).data
+    assert [order['order_id'] for order in profile['orders']] == expected
+    assert profile['orders_next_cursor'] is None
+
+
+@pytest.mark.django_db
+def test_order_history_rejects_a_bad_cursor(customer_client):
+    response = customer_client.get(reverse('myapp:user-orders'), {'cursor': 'not-a-cursor'})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.fixture
+def admin_orders(customer, staff_user):
+    orders = Order.objects.bulk_create(
+        [Order(user=customer, total_price=10, status='pending') for _ in range(6)] +
+        [Order(user=staff_user, total_price=10, status='shipped') for _ in range(3)]
+    )
+    OrderLine.objects.bulk_create([
+        OrderLine(order=order, product_name='Paracetamol', unit_price=10, quantity=1) for order in orders
+    ])
+    Order.objects.filter(id=orders[0].id).update(created_at=timezone.now() - timedelta(days=10))
+    return orders
+
+
+@pytest.mark.django_db
+def test_admin_orders_page_in_constant_queries(staff_client, admin_orders, django_assert_num_queries):
+    url = reverse('myapp:admin-orders')
+    with django_assert_num_queries(2):
+        first = staff_client.get(url, {'page_size': 4})
+    with django_assert_num_queries(2):
+        rest = staff_client.get(url, {'page_size': 10, 'cursor': first.data['next_cursor']})
+
+    ids = [order['id'] for order in first.data['orders'] + rest.data['orders']]
+    assert ids == list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+    assert rest.data['next_cursor'] is None
+
+
+@pytest.mark.django_db
+def test_admin_orders_filters(staff_client, customer, admin_orders):
+    url = reverse('myapp:admin-orders')
+    today = timezone.localdate().isoformat()
+
+    assert len(staff_client.get(url, {'status': 'shipped'}).data['orders']) == 3
+    assert len(staff_client.get(url, {'user_id': customer.id}).data['orders']) == 6
+    assert len(staff_client.get(url, {'date_from': today, 'date_to': today}).data['orders']) == 8
+    assert [order['id'] for order in staff_client.get(
+        url, {'date_to': (timezone.localdate() - timedelta(days=5)).isoformat()}).data['orders']] == [admin_orders[0].id]
+
+    for params in ({'status': 'lost'}, {'user_id': 'me'}, {'date_from': '2024-02-30'}, {'cursor': 'nope'}):
+        assert staff_client.get(url, params).status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_admin_orders_require_staff(customer_client):
+    assert customer_client.get(reverse('myapp:admin-orders')).status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+def test_bulk_transition_updates_allowed_orders_only(staff_user, staff_client, admin_orders,
+                                                     django_assert_max_num_queries):
+    pending = [order.id for order in admin_orders[:6]]
+    shipped = [order.id for order in admin_orders[6:]]
+    url = reverse('myapp:admin-orders-bulk-status')
+
+    with django_assert_max_num_queries(6):
+        response = staff_client.post(url, {'order_ids': pending + shipped[:1] + [999999], 'status': 'processing'},
+                                     format='json')
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['updated'] == sorted(pending)
+    assert response.data['rejected'] == {shipped[0]: 'shipped', 999999: None}
+    assert set(Order.objects.filter(id__in=pending).values_list('status', flat=True)) == {'processing'}
+    assert Order.objects.get(id=shipped[0]).status == 'shipped'
+
+    events = OrderStatusEvent.objects.filter(order_id__in=pending)
+    assert events.count() == 6
+    assert {(event.from_status, event.to_status, event.changed_by_id) for event in events} == {
+        ('pending', 'processing', staff_user.id)
+    }
+
+    response = staff_client.post(url, {'order_ids': shipped, 'status': 'pending'}, format='json')
+    assert response.data['updated'] == []
+
+
+@pytest.mark.django_db
+def test_bulk_transition_validates_input(staff_client, customer_client, admin_orders):
+    url = reverse('myapp:admin-orders-bulk-status')
+    assert staff_client.post(url, {'order_ids': [1], 'status': 'lost'}, format='json').status_code == 400
+    assert staff_client.post(url, {'order_ids': 'all', 'status': 'shipped'}, format='json').status_code == 400
+    assert customer_client.post(url, {'order_ids': [1], 'status': 'shipped'}, format='json').status_code == 403
+
+
+@pytest.mark.django_db
+def test_single_order_status_update_is_logged(staff_client, admin_orders):
+    order = admin_orders[0]
+    staff_client.patch(reverse('myapp:admin-order-status', args=[order.id]), {'status': 'shipped'}, format='json')
+    assert list(order.status_events.values_list('from_status', 'to_status')) == [('pending', 'shipped')]
+
+
+@pytest.mark.django_db
+def test_single_order_status_update_follows_the_flow(staff_client, admin_orders):
+    order = admin_orders[-1]
+    response = staff_client.patch(reverse('myapp:admin-order-status', args=[order.id]), {'status': 'pending'},
+                                  format='json')
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert Order.objects.get(id=order.id).status == 'shipped'
+
+
+@pytest.mark.django_db
+def test_cancelling_returns_stock(staff_user, staff_client, customer_client, stocked_products):
+    cod, online, paid = stocked_products[:3]
+    cod_order = place(customer_client, [{'id': cod.id, 'quantity': 2}]).data['order_id']
+    online_order = place(customer_client, [{'id': online.id, 'quantity': 3}], 'online').data['order_id']
+    paid_order = place(customer_client, [{'id': paid.id, 'quantity': 1}], 'online').data['order_id']
+    pay(customer_client, paid_order)
+
+    response = staff_client.post(reverse('myapp:admin-orders-bulk-status'),
+                                 {'order_ids': [cod_order, online_order, paid_order], 'status': 'cancelled'},
+                                 format='json')
+
+    assert response.data['updated'] == sorted([cod_order, online_order, paid_order])
+    assert [Product.objects.get(id=product.id).stock for product in (cod, online, paid)] == [5, 5, 5]
+    assert set(InventoryHold.objects.values_list('status', flat=True)) == {'cancelled'}
+
+
+@pytest.mark.django_db
+def test_cancelling_a_checkout_order_leaves_stock_alone(customer, customer_client, stocked_products):
+    product = stocked_products[0]
+    CartItem.objects.create(cart=Cart.objects.create(user=customer), product=product, quantity=3)
+    order_id = customer_client.post(reverse('myapp:checkout'), {'address': '123 Test Street'}).data['order_id']
+    assert Product.objects.get(id=product.id).stock == 5
+
+    # Checkout never took the stock, so there is nothing to give back
+    assert transition_orders([order_id], 'cancelled')['updated'] == [order_id]
+    assert Product.objects.get(id=product.id).stock == 5
+
+
+@pytest.mark.django_db
+def test_payment_for_a_cancelled_order_is_refunded_not_reserved(staff_client, customer_client, stocked_products):
+    product = stocked_products[0]
+    order_id = place(customer_client, [{'id': product.id, 'quantity': 2}], 'online').data['order_id']
+    staff_client.post(reverse('myapp:admin-orders-bulk-status'), {'order_ids': [order_id], 'status': 'cancelled'},
+                      format='json')
+
+    pay(customer_client, order_id)
+
+    assert Order.objects.get(id=order_id).status == 'cancelled'
+    assert Product.objects.get(id=product.id).stock == 5
+    assert Task.objects.filter(name='send_refund_notice').count() == 1
+    assert not Task.objects.filter(name='send_payment_confirmation').exists()
+
+
+@pytest.mark.django_db
+def test_order_serializers_use_prefetched_lines(admin_orders, django_assert_num_queries):
+    payments = userPayment.objects.bulk_create([
+        userPayment(order=order, user=order.user, amount=10, total_amount=10, transaction_uuid=f'txn-{order.id}')
+        for order in admin_orders
+    ])
+
+    with django_assert_num_queries(2):
+        orders = OrderSerializer(Order.objects.with_lines(), many=True).data
+    with django_assert_num_queries(2):
+        listed = UserPaymentSerializer(userPayment.objects.for_listing(), many=True).data
+
+    assert len(orders) == len(listed) == len(payments)
+    assert all(len(order['items']) == 1 for order in orders)
+    assert all(payment['order']['items'][0]['product_name'] == 'Paracetamol' for payment in listed)
+
+
+@pytest.fixture
+def admin_payments(admin_orders):
+    payments = userPayment.objects.bulk_create([
+        userPayment(order=order, user=order.user, amount=10, total_amount=10, transaction_uuid=f'txn-{order.id}',
+                    status='PAID' if order.status == 'shipped' else 'PENDING')
+        for order in admin_orders
+    ])
+    userPayment.objects.filter(id=payments[0].id).update(created_at=timezone.now() - timedelta(days=10))
+    return payments
+
+
+@pytest.mark.django_db
+def test_admin_payments_page_in_constant_queries(staff_client, admin_payments, django_assert_num_queries):
+    url = reverse('myapp:admin-payments')
+    with django_assert_num_queries(1):
+        first = staff_client.get(url, {'page_size': 4})
+    with django_assert_num_queries(1):
+        rest = staff_client.get(url, {'page_size': 10, 'cursor': first.data['next_cursor']})
+
+    listed = first.data['payments'] + rest.data['payments']
+    assert [payment['id'] for payment in listed] == list(
+        userPayment.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+    assert first.data['count'] == 4
+    assert rest.data['next_cursor'] is None
+    assert {payment['user_username'] for payment in listed} == {'customer', 'staff'}
+    assert listed[0]['total_amount'] == '10.00'
+    assert listed[0]['order_id'] == admin_payments[-1].order_id
+    assert listed[0]['order_status'] == 'shipped'
+
+
+@pytest.mark.django_db
+def test_admin_payments_filters(staff_client, customer, admin_payments):
+    url = reverse('myapp:admin-payments')
+    today = timezone.localdate().isoformat()
+
+    assert len(staff_client.get(url, {'status': 'PAID'}).data['payments']) == 3
+    assert len(staff_client.get(url, {'user_id': customer.id}).data['payments']) == 6
+    assert len(staff_client.get(url, {'date_from': today, 'date_to': today}).data['payments']) == 8
+    assert [payment['id'] for payment in staff_client.get(
+        url, {'date_to': (timezone.localdate() - timedelta(days=5)).isoformat()}).data['payments']
+    ] == [admin_payments[0].id]
+
+    for params in ({'status': 'paid'}, {'user_id': 'me'}, {'date_from': '2024-02-30'}, {'cursor': 'nope'}):
+        assert staff_client.get(url, params).status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_admin_payments_require_staff(customer_client):
+    assert customer_client.get(reverse('myapp:admin-payments')).status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+def test_order_detail_in_constant_queries(customer_client, stocked_products, django_assert_num_queries):
+    response = place(customer_client, [{'id': product.id, 'quantity': 1} for product in stocked_products])
+    order_id = response.data['order_id']
+
+    with django_assert_num_queries(2):
+        response = customer_client.get(reverse('myapp:order-detail', args=[order_id]))
+
+    assert [item['product_name'] for item in response.data['items']] == [f'Product {i}' for i in range(6)]
@@ -0,0 +1,205 @@
+import base64
+import json
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from myapp.models import Order, OrderStatusEvent, Task, userPayment
+from myapp.payment_reconcile import reconcile_pending_payments
+from myapp.payment_utils import PaymentTransitionError, transition_payment
+from myapp.tests.esewa_standin import StandInGateway, callback_data
+
+
+@pytest.fixture
+def payment(customer):
+    order = Order.objects.create(user=customer, total_price=110)
+    return userPayment.objects.create(user=customer, order=order, amount=100, tax_amount=10, total_amount=110,
+                                      transaction_uuid='TID-1-abc')
+
+
+def callback(client, callback_status, transaction_code='CODE1', total_amount='110.0'):
+    return client.post(reverse('myapp:payment-process'), {
+        'transaction_uuid': 'TID-1-abc', 'status': callback_status,
+        'data': callback_data('TID-1-abc', total_amount, transaction_code=transaction_code),
+    })
+
+
+@pytest.mark.django_db
+def test_success_callback_pays_payment_and_order(customer_client, payment):
+    response = callback(customer_client, 'complete')
+
+    assert response.status_code == status.HTTP_200_OK
+    payment.refresh_from_db()
+    assert (payment.status, payment.version, payment.transaction_code) == ('PAID', 1, 'CODE1')
+    assert Order.objects.get(id=payment.order_id).status == 'paid'
+    assert OrderStatusEvent.objects.get(order_id=payment.order_id).to_status == 'paid'
+    assert Task.objects.filter(name='send_payment_confirmation').count() == 1
+
+
+@pytest.mark.django_db
+def test_duplicate_callbacks_are_no_op_reads(customer_client, payment, django_assert_max_num_queries):
+    callback(customer_client, 'COMPLETE')
+
+    for _ in range(3):
+        # Payment lookup only, no UPDATE
+        with django_assert_max_num_queries(1):
+            assert callback(customer_client, 'COMPLETE', 'CODE2').status_code == status.HTTP_200_OK
+
+    payment.refresh_from_db()
+    assert (payment.version, payment.transaction_code) == (1, 'CODE1')
+    assert Task.objects.filter(name='send_payment_confirmation').count() == 1
+
+
+@pytest.mark.django_db
+def test_late_failure_cannot_undo_a_payment(customer_client, payment):
+    callback(customer_client, 'COMPLETE')
+
+    assert callback(customer_client, 'FAILED').status_code == status.HTTP_409_CONFLICT
+    assert callback(customer_client, 'AMBIGUOUS').status_code == status.HTTP_400_BAD_REQUEST
+    assert userPayment.objects.get().status == 'PAID'
+
+
+@pytest.mark.django_db
+def test_stale_writer_loses_to_the_first(payment):
+    stale = userPayment.objects.get(pk=payment.pk)
+    transition_payment(payment, 'FAILED')
+
+    # The stale copy still says PENDING: its conditional UPDATE misses, it re-reads and decides again
+    assert transition_payment(stale, 'PAID') is True
+    assert (stale.status, stale.version) == ('PAID', 2)
+    with pytest.raises(PaymentTransitionError):
+        transition_payment(userPayment.objects.get(pk=payment.pk), 'PENDING')
+
+
+@pytest.mark.django_db
+def test_admin_status_update_follows_the_state_machine(staff_client, payment):
+    url = reverse('myapp:admin-payment-status', args=[payment.id])
+
+    assert staff_client.patch(url, {'status': 'PAID'}).status_code == status.HTTP_200_OK
+    assert Order.objects.get(id=payment.order_id).status == 'paid'
+
+    response = staff_client.patch(url, {'status': 'PENDING'})
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.data['allowed'] == ['REFUNDED']
+    assert userPayment.objects.get().status == 'PAID'
+
+
+@pytest.mark.django_db
+def test_success_callback_needs_a_valid_signature(customer_client, payment):
+    url = reverse('myapp:payment-process')
+    forged = json.loads(base64.b64decode(callback_data('TID-1-abc', '110.0')))
+    forged['signature'] = forged['signature'][::-1]
+
+    for data in ['x', base64.b64encode(json.dumps(forged).encode()).decode()]:
+        response = customer_client.post(url, {'transaction_uuid': 'TID-1-abc', 'status': 'COMPLETE', 'data': data})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    assert callback(customer_client, 'COMPLETE', total_amount='1.0').status_code == status.HTTP_400_BAD_REQUEST
+    assert userPayment.objects.get().status == 'PENDING'
+
+
+@pytest.mark.django_db
+def test_initiation_signature_cannot_pass_for_a_callback(customer_client, customer):
+    order = Order.objects.create(user=customer, total_price=110)
+    url = reverse('myapp:payment-process')
+    signed = customer_client.post(url, {'amount': 100, 'tax_amount': 10, 'transaction_uuid': 'TID-2-def',
+                                        'order_id': order.id}).data
+
+    # The request signature covers amount, uuid and product code; status rides along unsigned
+    replayed = {name: signed[name] for name in ('total_amount', 'transaction_uuid', 'product_code',
+                                                'signed_field_names', 'signature')}
+    replayed.update(status='COMPLETE', transaction_code='FORGED')
+    response = customer_client.post(url, {
+        'transaction_uuid': 'TID-2-def', 'status': 'COMPLETE',
+        'data': base64.b64encode(json.dumps(replayed).encode()).decode(),
+    })
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert userPayment.objects.get(transaction_uuid='TID-2-def').status == 'PENDING'
+    assert Order.objects.get(id=order.id).status != 'paid'
+
+
+@pytest.fixture
+def standin_gateway(settings):
+    with StandInGateway() as gateway:
+        settings.ESEWA_STATUS_URL = gateway.url
+        yield gateway
+
+
+@pytest.mark.django_db
+def test_failure_callback_is_confirmed_with_the_gateway(customer_client, payment, standin_gateway):
+    standin_gateway.statuses['TID-1-abc'] = 'PENDING'
+    response = customer_client.post(reverse('myapp:payment-process'),
+                                    {'transaction_uuid': 'TID-1-abc', 'status': 'FAILED'})
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert userPayment.objects.get().status == 'PENDING'
+
+    standin_gateway.statuses['TID-1-abc'] = 'CANCELED'
+    response = customer_client.post(reverse('myapp:payment-process'),
+                                    {'transaction_uuid': 'TID-1-abc', 'status': 'FAILED'})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert userPayment.objects.get().status == 'FAILED'
+    assert [request['transaction_uuid'] for request in standin_gateway.requests] == ['TID-1-abc'] * 2
+
+
+@pytest.mark.django_db
+def test_failure_callback_stays_pending_when_gateway_is_down(customer_client, payment, settings):
+    settings.ESEWA_STATUS_URL = 'http://127.0.0.1:9/api/epay/transaction/status/'
+    response = customer_client.post(reverse('myapp:payment-process'),
+                                    {'transaction_uuid': 'TID-1-abc', 'status': 'FAILED'})
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert userPayment.objects.get().status == 'PENDING'
+
+
+def pending_payments(customer, count):
+    payments = userPayment.objects.bulk_create([
+        userPayment(user=customer, amount=10, total_amount=10, transaction_uuid=f'TID-{i}',
+                    created_at=timezone.now() - timedelta(hours=1))
+        for i in range(count)
+    ])
+    userPayment.objects.create(user=customer, amount=10, total_amount=10, transaction_uuid='TID-fresh')
+    return payments
+
+
+@pytest.mark.django_db
+def test_reconcile_settles_stale_pending_payments(customer, standin_gateway):
+    pending_payments(customer, 4)
+    standin_gateway.statuses.update({'TID-0': 'COMPLETE', 'TID-1': 'CANCELED', 'TID-2': 'PENDING'})
+
+    totals = reconcile_pending_payments(batch_size=3)
+
+    assert totals == {'checked': 4, 'paid': 1, 'failed': 2, 'unchanged': 1, 'errors': 0}
+    assert dict(userPayment.objects.values_list('transaction_uuid', 'status')) == {
+        'TID-0': 'PAID', 'TID-1': 'FAILED', 'TID-2': 'PENDING', 'TID-3': 'FAILED', 'TID-fresh': 'PENDING',
+    }
+    assert {request['product_code'] for request in standin_gateway.requests} == {'EPAYTEST'}
+    assert 'TID-fresh' not in {request['transaction_uuid'] for request in standin_gateway.requests}
+
+
+@pytest.mark.django_db
+def test_reconcile_bounds_concurrency_and_reuses_connections(customer, standin_gateway):
+    pending_payments(customer, 40)
+    standin_gateway.statuses.update({f'TID-{i}': 'PENDING' for i in range(40)})
+    standin_gateway.delay = 0.02
+
+    call_command('reconcile_payments', '--concurrency', '5', '--batch-size', '40')
+
+    assert len(standin_gateway.requests) == 40
+    assert standin_gateway.max_in_flight <= 5
+    assert standin_gateway.connections <= 5
+
+
+@pytest.mark.django_db
+def test_reconcile_counts_gateway_errors(customer, settings):
+    settings.ESEWA_STATUS_URL = 'http://127.0.0.1:9/unreachable/'
+    settings.ESEWA_TIMEOUT = 1
+    pending_payments(customer, 2)
+
+    assert reconcile_pending_payments()['errors'] == 2
+    assert set(userPayment.objects.values_list('status', flat=True)) == {'PENDING'}
@@ -0,0 +1,149 @@
+import io
+import pytest
+from PIL import Image, ImageDraw
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework import status
+from myapp.models import CartItem, Order, PrescriptionBlob, PrescriptionHash
+from myapp import prescription_hashing
+from myapp.prescription_hashing import build_hash_row, find_similar_blobs, find_similar_orders, hash_pending_blobs
+from myapp.prescription_storage import ingest_legacy_prescriptions, store_prescription
+
+
+pytestmark = pytest.mark.usefixtures('media_root')
+
+
+@pytest.fixture
+def rx_products(make_product):
+    return [make_product(name=f'Antibiotic {i}', price='12.00', stock=10, category='RX', prescription_required=True)
+            for i in range(2)]
+
+
+def upload(content=b'same prescription photo'):
+    return SimpleUploadedFile('rx.jpg', content, content_type='image/jpeg')
+
+
+@pytest.mark.django_db
+def test_repeated_prescription_uploads_share_one_blob(customer_client, rx_products, media_root):
+    for product in rx_products:
+        url = reverse('myapp:add-to-cart', kwargs={'product_id': product.id})
+        response = customer_client.post(url, {'prescription': upload()}, format='multipart')
+        assert response.status_code == status.HTTP_200_OK
+
+    blob = PrescriptionBlob.objects.get()
+    assert blob.ref_count == 2
+    assert blob.size == len(b'same prescription photo')
+    assert set(CartItem.objects.values_list('prescription_file', flat=True)) == {blob.file.name}
+    assert len([path for path in media_root.rglob('*') if path.is_file()]) == 1
+
+
+@pytest.mark.django_db
+def test_last_reference_removes_blob_file(customer_client, rx_products, media_root,
+                                          django_capture_on_commit_callbacks):
+    for product in rx_products:
+        url = reverse('myapp:add-to-cart', kwargs={'product_id': product.id})
+        customer_client.post(url, {'prescription': upload()}, format='multipart')
+
+    with django_capture_on_commit_callbacks(execute=True):
+        for product in rx_products:
+            customer_client.delete(reverse('myapp:remove-from-cart', kwargs={'product_id': product.id}))
+
+    assert not PrescriptionBlob.objects.exists()
+    assert not [path for path in media_root.rglob('*') if path.is_file()]
+
+
+@pytest.mark.django_db
+def test_legacy_uploads_are_ingested_into_blobs(customer, rx_products, media_root,
+                                                 django_capture_on_commit_callbacks):
+    for name in ('prescriptions/old.jpg', 'cart_prescriptions/old.jpg'):
+        (media_root / name).parent.mkdir(parents=True, exist_ok=True)
+        (media_root / name).write_bytes(b'legacy prescription photo')
+    order = Order.objects.create(user=customer, total_price=0, prescription='prescriptions/old.jpg')
+    line = CartItem.objects.create(order=order, product=rx_products[0], prescription_file='cart_prescriptions/old.jpg')
+    CartItem.objects.create(order=order, product=rx_products[1], prescription_file='cart_prescriptions/gone.jpg')
+
+    with django_capture_on_commit_callbacks(execute=True):
+        call_command('ingest_prescriptions', stdout=io.StringIO())
+
+    blob = PrescriptionBlob.objects.get()
+    assert blob.ref_count == 2
+    order.refresh_from_db()
+    line.refresh_from_db()
+    assert (order.prescription_blob_id, order.prescription.name) == (blob.id, blob.file.name)
+    assert (line.prescription_blob_id, line.prescription_file.name) == (blob.id, blob.file.name)
+    assert [path.relative_to(media_root).as_posix() for path in media_root.rglob('*') if path.is_file()] == [
+        blob.file.name
+    ]
+    # Ingested blobs are hashed like new uploads, and a second run has nothing left to move
+    assert hash_pending_blobs(workers=1) == 1
+    assert ingest_legacy_prescriptions() == {'ingested': 0, 'missing': 1}
+
+
+def prescription_image(seed, brightness=0, size=(400, 300)):
+    image = Image.new('L', size, 255)
+    draw = ImageDraw.Draw(image)
+    for line in range(8):
+        y = 30 + line * 30
+        draw.rectangle([20, y, 20 + ((seed * (line + 3) * 37) % 340), y + 12], fill=40)
+    if brightness:
+        image = image.point(lambda value: max(0, min(255, value + brightness)))
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+@pytest.mark.django_db
+def test_near_duplicate_prescriptions_are_matched(customer, media_root):
+    original = store_prescription(SimpleUploadedFile('a.jpg', prescription_image(seed=3)))
+    rephoto = store_prescription(SimpleUploadedFile('b.jpg', prescription_image(seed=3, brightness=-25)))
+    other = store_prescription(SimpleUploadedFile('c.jpg', prescription_image(seed=11)))
+    pdf = store_prescription(SimpleUploadedFile('d.pdf', b'%PDF-1.4 not an image'))
+    assert len({original.id, rephoto.id, other.id, pdf.id}) == 4
+
+    assert hash_pending_blobs(workers=1) == 4
+    assert PrescriptionHash.objects.get(blob=pdf).phash is None
+
+    matches = dict(find_similar_blobs([original.id]))
+    assert rephoto.id in matches
+    assert other.id not in matches
+
+    first = Order.objects.create(user=customer, total_price=0, prescription_blob=rephoto)
+    second = Order.objects.create(user=customer, total_price=0, prescription_blob=original)
+    assert [match[0] for match in find_similar_orders(second)] == [first.id]
+
+
+def hashed_blobs(hashes):
+    """Blobs with the given (phash, dhash) pairs, no image files needed"""
+    blobs = PrescriptionBlob.objects.bulk_create([
+        PrescriptionBlob(digest=f'{index:064x}', file=f'prescription_blobs/{index}.jpg')
+        for index in range(len(hashes))
+    ])
+    PrescriptionHash.objects.bulk_create([build_hash_row(blob.id, pair) for blob, pair in zip(blobs, hashes)])
+    return blobs
+
+
+@pytest.mark.django_db
+def test_band_probes_find_every_match_within_the_threshold():
+    source = 0x0123456789ABCDEF
+    # Six bits apart, spread so no 16-bit band is left untouched
+    spread = source ^ (0b11 << 2) ^ (0b11 << 20) ^ (1 << 40) ^ (1 << 60)
+    blobs = hashed_blobs([
+        (source, source),
+        (spread, source),
+        (spread, ~source & (2 ** 64 - 1)),  # Same pHash neighbourhood, unrelated dHash
+        (~source & (2 ** 64 - 1), source),
+    ])
+
+    assert find_similar_blobs([blobs[0].id]) == [(blobs[1].id, 6)]
+
+
+@pytest.mark.django_db
+def test_crowded_band_still_finds_the_oldest_match(django_assert_num_queries):
+    source = 0x0123456789ABCDEF
+    crowd = [source & 0xFFFF | (index + 1) << 16 for index in range(prescription_hashing.CANDIDATE_BATCH_SIZE + 100)]
+    # The match is older than every row crowding band0 with it
+    blobs = hashed_blobs([(source ^ 0b111, source), *[(value, source) for value in crowd], (source, source)])
+
+    with django_assert_num_queries(3):
+        assert find_similar_blobs([blobs[-1].id]) == [(blobs[0].id, 3)]
@@ -0,0 +1,53 @@
+import pytest
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from myapp.models import Product
+
+
+def make_product(name, generic_name, price, stock):
+    return Product.objects.create(
+        name=name,
+        generic_name=generic_name,
+        price=price,
+        stock=stock,
+        category='OTC'
+    )
+
+
+@pytest.mark.django_db
+def test_generic_key_is_normalized_on_save():
+    product = make_product('Panadol', '  Paracetamol   500mg ', 5, 10)
+    assert product.generic_key == 'paracetamol 500mg'
+
+    product.generic_name = 'Ibuprofen'
+    product.save(update_fields=['generic_name'])
+    product.refresh_from_db()
+    assert product.generic_key == 'ibuprofen'
+
+
+@pytest.mark.django_db
+def test_product_alternatives_in_stock_sorted_by_price():
+    brand = make_product('Panadol', 'Paracetamol', 50, 0)
+    expensive = make_product('Calpol', 'PARACETAMOL', 40, 5)
+    cheap = make_product('Cetamol', 'paracetamol', 10, 5)
+    make_product('Out Of Stock', 'Paracetamol', 5, 0)
+    make_product('Brufen', 'Ibuprofen', 8, 5)
+
+    url = reverse('myapp:product-alternatives', kwargs={'pk': brand.id})
+    response = APIClient().get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [item['id'] for item in response.data['alternatives']] == [cheap.id, expensive.id]
+
+
+@pytest.mark.django_db
+def test_product_alternatives_without_generic_name():
+    product = make_product('Bandage', None, 3, 5)
+    make_product('Gauze', None, 2, 5)
+
+    url = reverse('myapp:product-alternatives', kwargs={'pk': product.id})
+    response = APIClient().get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['alternatives'] == []
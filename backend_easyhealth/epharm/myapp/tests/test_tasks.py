@@ -0,0 +1,120 @@
+from datetime import timedelta
+
+import pytest
+from django.core import mail
+from django.core.files.storage import default_storage
+from django.db import OperationalError
+from django.utils import timezone
+from myapp import tasks
+from myapp.management.commands import run_tasks
+from myapp.models import Task
+from myapp.tests.conftest import place
+
+pytestmark = pytest.mark.usefixtures('media_root')
+
+
+@pytest.fixture
+def flaky_task(monkeypatch):
+    calls = []
+
+    def flaky(fail):
+        calls.append(fail)
+        if fail:
+            raise RuntimeError("gateway timeout")
+
+    monkeypatch.setitem(tasks.TASKS, 'flaky', flaky)
+    return calls
+
+
+@pytest.mark.django_db
+def test_order_jobs_run_after_the_order_commits(customer, customer_client, settings, make_product):
+    settings.PHARMACIST_EMAILS = ['pharmacist@example.com']
+    product = make_product(name='Amoxicillin', price='12.00', stock=3, category='RX', prescription_required=True)
+
+    assert place(customer_client, [{'id': product.id, 'quantity': 5}]).status_code == 400
+    assert not Task.objects.exists()
+
+    order_id = place(customer_client, [{'id': product.id, 'quantity': 1}]).data['order_id']
+    assert sorted(Task.objects.values_list('name', flat=True)) == [
+        'generate_invoice', 'notify_pharmacist', 'send_order_confirmation'
+    ]
+    assert not mail.outbox
+
+    assert tasks.run_pending() == 3
+    assert set(Task.objects.values_list('status', flat=True)) == {'done'}
+    assert sorted(message.to[0] for message in mail.outbox) == [customer.email, 'pharmacist@example.com']
+    with default_storage.open(f'invoices/order_{order_id}.html') as invoice:
+        assert b'Amoxicillin' in invoice.read()
+
+
+@pytest.mark.django_db
+def test_failed_jobs_back_off_then_give_up(flaky_task):
+    job = tasks.enqueue('flaky', max_attempts=2, fail=True)
+
+    assert tasks.run_pending() == 1
+    job.refresh_from_db()
+    assert (job.status, job.attempts) == ('queued', 1)
+    assert job.available_at > timezone.now() + timedelta(seconds=20)
+    assert 'gateway timeout' in job.last_error
+    assert tasks.run_pending() == 0
+
+    Task.objects.update(available_at=timezone.now())
+    tasks.run_pending()
+    job.refresh_from_db()
+    assert (job.status, job.attempts) == ('failed', 2)
+    assert flaky_task == [True, True]
+
+
+@pytest.mark.django_db
+def test_expired_lease_is_picked_up_again(flaky_task):
+    tasks.enqueue('flaky', fail=False)
+    [stalled] = tasks.claim_tasks()
+    assert tasks.claim_tasks() == []
+
+    # The first worker died; once its lease runs out another one takes over
+    Task.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+    [retried] = tasks.claim_tasks()
+    assert retried.attempts == 2
+    assert tasks.run_task(retried)
+
+    # A late result from the dead worker does not overwrite the outcome
+    Task.objects.update(status='running')
+    tasks.run_task(stalled)
+    assert Task.objects.get().status == 'running'
+
+
+@pytest.mark.django_db
+def test_a_job_read_by_two_workers_is_claimed_once(flaky_task):
+    job = tasks.enqueue('flaky', fail=False)
+    locked_until = timezone.now() + timedelta(minutes=5)
+
+    # Both workers read the row as queued with no attempts; only the first UPDATE matches
+    assert tasks.claim_task(job.id, 'queued', 0, locked_until) is True
+    assert tasks.claim_task(job.id, 'queued', 0, locked_until) is False
+    assert Task.objects.get().attempts == 1
+    assert tasks.claim_tasks() == []
+
+
+@pytest.mark.django_db
+def test_worker_backs_off_when_the_database_is_locked(flaky_task, monkeypatch):
+    results = [OperationalError("database is locked"), OperationalError("database is locked"), 1, 0]
+    sleeps = []
+
+    def run_pending(batch_size):
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(run_tasks, 'run_pending', run_pending)
+    monkeypatch.setattr(run_tasks.time, 'sleep', sleeps.append)
+    run_tasks.work(batch_size=10, interval=1, once=True)
+
+    assert results == []
+    assert sleeps == [2, 4]
+
+
+@pytest.mark.django_db
+def test_unknown_tasks_are_rejected():
+    with pytest.raises(ValueError):
+        tasks.enqueue('does_not_exist')
@@ -4,6 +4,7 @@ from rest_framework import status
 from rest_framework.test import APIClient
 from django.contrib.auth import get_user_model
 from myapp.models import Product, Order, userPayment
+from myapp.tests.esewa_standin import callback_data
 import json
 import uuid
 
@@ -180,8 +181,7 @@ def test_payment_callback(authenticated_client, create_user):
     payload = {
         'transaction_uuid': transaction_uuid,
         'status': 'SUCCESS',
-        'transaction_code': 'TEST123',
-        'data': 'test-data'
+        'data': callback_data(transaction_uuid, '110.0', transaction_code='TEST123')
     }
     response = authenticated_client.post(url, payload)
     assert response.status_code == status.HTTP_200_OK
@@ -189,5 +189,5 @@ def test_payment_callback(authenticated_client, create_user):
 
     # Verify payment was updated
     payment = userPayment.objects.get(transaction_uuid=transaction_uuid)
-    assert payment.status == 'SUCCESS'
+    assert payment.status == 'PAID'
     assert payment.transaction_code == 'TEST123'
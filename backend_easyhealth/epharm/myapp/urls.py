@@ -3,7 +3,9 @@ from . import views
 from .views import (
     CustomLoginAPIView,
     UserProfileView,
+    UserOrdersView,
     PlaceOrderView,
+    OrderRequestStatusView,
     update_cart_item_quantity,
     update_order_status,
     OrderDetailView,
@@ -13,6 +15,7 @@ from .views import (
     verify_admin_access,
     ProcessPaymentView,
     AdminOrdersView,
+    AdminOrderBulkStatusView,
     AdminOrderStatusUpdateView,
     AdminProductsView,
     AdminProductStockUpdateView,
@@ -41,21 +44,25 @@ urlpatterns = [
     path('token/verify/', TokenVerifyView.as_view(), name='token_verify'),
     path('check-email/', views.check_email, name='check_email'),
     path('user/profile/', UserProfileView.as_view(), name='user-profile'),
+    path('user/orders/', UserOrdersView.as_view(), name='user-orders'),
     path('verify-admin/', verify_admin_access, name='verify-admin'),
 
     # Product Routes
     path('products/', views.getProducts, name='products'),
     path('product/<int:pk>/', views.getProduct, name='product-detail'),
+    path('product/<int:pk>/alternatives/', views.getProductAlternatives, name='product-alternatives'),
 
     # Cart Routes
     path('cart/', ViewCart.as_view(), name='cart'),
     path('cart/add/<int:product_id>/', views.add_to_cart, name='add-to-cart'),
     path('cart/remove/<int:product_id>/', views.remove_from_cart, name='remove-from-cart'),
     path('cart/update-item/<int:product_id>/', update_cart_item_quantity, name='update-cart-item'),
+    path('cart/batch/', views.cart_batch, name='cart-batch'),
     path('cart/checkout/', views.checkout, name='checkout'),
 
     # Order Routes
     path('order/place/', PlaceOrderView.as_view(), name='order-place'),
+    path('order/requests/<int:pk>/', OrderRequestStatusView.as_view(), name='order-request-status'),
     path('order/<int:pk>/', OrderDetailView.as_view(), name='order-detail'),
     path('order/<int:order_id>/status/', update_order_status, name='order-status-update'),
 
@@ -67,6 +74,7 @@ urlpatterns = [
 
     # Admin Routes
     path('admin/orders/', AdminOrdersView.as_view(), name='admin-orders'),
+    path('admin/orders/status/', AdminOrderBulkStatusView.as_view(), name='admin-orders-bulk-status'),
     path('admin/orders/<int:order_id>/status/', AdminOrderStatusUpdateView.as_view(), name='admin-order-status'),
     path('admin/products/', AdminProductsView.as_view(), name='admin-products'),
     path('admin/products/<int:product_id>/stock/', AdminProductStockUpdateView.as_view(), name='admin-product-stock'),
@@ -1,7 +1,34 @@
 from rest_framework import permissions
-from .serializers import ProductSerializer, RegisterSerializer, OrderSerializer, CustomTokenObtainPairSerializer
-
-from .models import  CustomUser, Cart, CartItem, Order, Product, userPayment
+from .serializers import ProductSerializer, RegisterSerializer, OrderSerializer, CustomTokenObtainPairSerializer, admin_payment_row
+
+from .models import  CustomUser, Cart, CartItem, Order, OrderLine, OrderRequest, Product, userPayment, normalize_generic_name
+from .cart_store import get_cart_store, redis_cart_enabled
+from .prescription_storage import attach_prescription, release_prescription
+from .order_utils import (
+    MAX_BULK_TRANSITION,
+    StockShortfall,
+    line_for,
+    parse_order_items,
+    place_order,
+    serialize_line,
+    transition_order,
+    transition_orders,
+)
+from .idempotency import idempotent
+from .order_intake import queued_intake_enabled, submit_order_request
+from .esewa import InvalidSignature, get_gateway, parse_amount
+from .payment_utils import PAYMENT_TRANSITIONS, PaymentTransitionError, payment_status_for_callback, transition_payment
+from .pagination import keyset_page, page_size_from
+from .tasks import order_created
+from .cart_utils import (
+    apply_cart_operations,
+    bump_cart_version,
+    cart_response,
+    empty_cart_snapshot,
+    get_cart_delta,
+    get_cart_snapshot,
+    parse_cart_operations,
+)
 from django.shortcuts import redirect, render
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.authentication import JWTAuthentication
@@ -23,17 +50,19 @@ from rest_framework import generics, views
 
 from rest_framework.permissions import AllowAny
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 
-from django.db.models import Q
+from django.db.models import F, Q
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-import hmac
-import hashlib
-import base64
 import logging
+import requests
 import time
+import datetime
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.core.cache import cache
 
 
@@ -94,6 +123,39 @@ def getProduct(request, pk):
         return Response({'error': 'Product not found'}, status=404)
 
 
+def find_alternatives(product, limit=10):
+    """In-stock products sharing the product's generic, cheapest first"""
+    generic_key = product.generic_key or normalize_generic_name(product.generic_name)
+    if not generic_key:
+        return []
+
+    alternatives = Product.objects.filter(
+        generic_key=generic_key,
+        stock__gt=0
+    ).exclude(id=product.id).order_by('price', 'id')[:limit]
+
+    return [{
+        'id': alternative.id,
+        'name': alternative.name,
+        'generic_name': alternative.generic_name,
+        'category': alternative.category,
+        'price': float(alternative.price),
+        'stock': alternative.stock,
+        'prescription_required': alternative.prescription_required,
+        'image': alternative.image.url if alternative.image else None,
+    } for alternative in alternatives]
+
+
+@api_view(['GET'])
+def getProductAlternatives(request, pk):
+    product = get_object_or_404(Product.objects.only('id', 'generic_name', 'generic_key'), pk=pk)
+    return Response({
+        'product_id': product.id,
+        'generic_name': product.generic_name,
+        'alternatives': find_alternatives(product),
+    })
+
+
 # Register new user
 class RegisterAPIView(generics.CreateAPIView):
     serializer_class = RegisterSerializer
@@ -159,42 +221,39 @@ def check_email(request):
 def add_to_cart(request, product_id):
     try:
         product = get_object_or_404(Product, id=product_id)
+
+        if redis_cart_enabled():
+            store = get_cart_store()
+            store.add(request.user.id, product.id)
+            prescription_file = request.FILES.get('prescription')
+            if product.prescription_required and prescription_file:
+                store.attach_prescription(request.user.id, product.id, prescription_file)
+            return cart_response(get_cart_delta(request, None, [product.id]))
+
         cart, created = Cart.objects.get_or_create(user=request.user)
 
+        # The open-line unique constraint lets get_or_create recover from a racing insert
         cart_item, created = CartItem.objects.get_or_create(
             cart=cart,
             product=product,
+            order__isnull=True,
             defaults={'quantity': 1}
         )
 
         if not created:
-            cart_item.quantity += 1
+            CartItem.objects.filter(pk=cart_item.pk).update(quantity=F('quantity') + 1)
 
         # Handle prescription file upload if required
         if product.prescription_required:
             prescription_file = request.FILES.get('prescription')
             if prescription_file:
-                cart_item.prescription_file = prescription_file
+                previous_blob_id = attach_prescription(cart_item, prescription_file, 'prescription_file')
+                cart_item.save(update_fields=['prescription_file', 'prescription_blob'])
+                release_prescription(previous_blob_id)
 
-        cart_item.save()
+        bump_cart_version(cart)
 
-        items = cart.cart_items.all()
-        cart_items = [{
-            'id': item.id,
-            'product_id': item.product.id,
-            'name': item.product.name,
-            'quantity': item.quantity,
-            'price': float(item.product.price),
-            'total_item_price': float(item.product.price * item.quantity),
-            'image': request.build_absolute_uri(item.product.image.url) if item.product.image else None,
-        } for item in items]
-
-        total_price = float(sum(item['total_item_price'] for item in cart_items))
-
-        return Response({
-            'cart_items': cart_items,
-            'total_price': total_price
-        }, status=200)
+        return cart_response(get_cart_delta(request, cart, [product.id]))
 
     except Product.DoesNotExist:
         logger.error(f"Product with ID {product_id} not found.")
@@ -208,46 +267,28 @@ def add_to_cart(request, product_id):
 @permission_classes([permissions.IsAuthenticated])
 def remove_from_cart(request, product_id):
     try:
+        if redis_cart_enabled():
+            if not get_cart_store().remove(request.user.id, product_id):
+                logger.warning(
+                    f"Attempted to remove non-existent cart item. User: {request.user.id}, Product: {product_id}")
+            return cart_response(get_cart_delta(request, None, [product_id]))
+
         cart = Cart.objects.filter(user=request.user).first()
 
         # If cart doesn't exist, return empty response
         if not cart:
-            return Response({
-                'cart_items': [],
-                'total_price': 0
-            }, status=status.HTTP_200_OK)
+            return cart_response(empty_cart_snapshot())
 
-        # Try to get the cart item
-        cart_item = CartItem.objects.filter(cart=cart, product_id=product_id).first()
+        deleted, _ = CartItem.objects.filter(cart=cart, product_id=product_id, order__isnull=True).delete()
 
         # If cart item doesn't exist, log it and return current cart state
-        if not cart_item:
+        if not deleted:
             logger.warning(
                 f"Attempted to remove non-existent cart item. User: {request.user.id}, Product: {product_id}")
-            items = cart.cart_items.all()
         else:
-            # Delete the cart item if it exists
-            cart_item.delete()
-            items = cart.cart_items.all()
-
-        # Get updated cart items
-        cart_items = [{
-            'id': item.id,
-            'product_id': item.product.id,
-            'name': item.product.name,
-            'quantity': item.quantity,
-            'price': float(item.product.price),
-            'total_item_price': float(item.product.price * item.quantity),
-            'image': request.build_absolute_uri(item.product.image.url) if item.product.image else None,
-            'prescription': request.build_absolute_uri(item.prescription_file.url) if item.prescription_file else None
-        } for item in items]
-
-        total_price = float(sum(item['total_item_price'] for item in cart_items))
+            bump_cart_version(cart)
 
-        return Response({
-            'cart_items': cart_items,
-            'total_price': total_price
-        }, status=status.HTTP_200_OK)
+        return cart_response(get_cart_delta(request, cart, [product_id]))
 
     except Exception as e:
         logger.error(f"Error removing item from cart: {str(e)}", exc_info=True)
@@ -262,29 +303,11 @@ class ViewCart(APIView):
 
     def get(self, request):
         try:
-            cart = get_object_or_404(Cart, user=request.user)
-            items = cart.cart_items.all()
-
-            if not items:
-                return Response({'cart_items': []}, status=200)
-
-            cart_items = [{
-                'id': item.id,
-                'product_id': item.product.id,
-                'name': item.product.name,
-                'quantity': item.quantity,
-                'price': float(item.product.price),
-                'total_item_price': float(item.product.price * item.quantity),
-                'image': request.build_absolute_uri(item.product.image.url) if item.product.image else None,
-                'prescription': request.build_absolute_uri(item.prescription_file.url) if item.prescription_file else None
-            } for item in items]
-
-            total_price = float(sum(item['total_item_price'] for item in cart_items))
-
-            return Response({
-                'cart_items': cart_items,
-                'total_price': total_price
-            }, status=200)
+            snapshot = get_cart_snapshot(request)
+            # Clients that already hold this version skip the payload entirely
+            if request.headers.get('If-None-Match', '').strip('W/"') == str(snapshot['version']):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': f'"{snapshot["version"]}"'})
+            return cart_response(snapshot)
 
         except Exception as e:
             logger.error(f"Error viewing cart: {e}")
@@ -299,62 +322,88 @@ def update_cart_item_quantity(request, product_id):
     if action not in ['increase', 'decrease']:
         return Response({"error": "Invalid action"}, status=status.HTTP_400_BAD_REQUEST)
 
+    if redis_cart_enabled():
+        store = get_cart_store()
+        if not store.contains(request.user.id, product_id):
+            return Response({"error": "Item not found in cart."}, status=status.HTTP_404_NOT_FOUND)
+        if action == 'increase':
+            store.add(request.user.id, product_id)
+        elif not store.decrement(request.user.id, product_id):
+            return Response({"error": "Quantity cannot be decreased further."}, status=status.HTTP_400_BAD_REQUEST)
+        return cart_response(get_cart_delta(request, None, [product_id]))
+
     try:
         cart = Cart.objects.get(user=request.user)
-        cart_item = CartItem.objects.get(cart=cart, product_id=product_id)
+        cart_items = CartItem.objects.filter(cart=cart, product_id=product_id, order__isnull=True)
 
+        # Conditional single-column UPDATEs, so parallel clicks never lose a change
         if action == 'increase':
-            cart_item.quantity += 1
-        elif action == 'decrease' and cart_item.quantity > 1:
-            cart_item.quantity -= 1
+            updated = cart_items.update(quantity=F('quantity') + 1)
         else:
-            return Response({"error": "Quantity cannot be decreased further."}, status=status.HTTP_400_BAD_REQUEST)
-
-        cart_item.save()
+            updated = cart_items.filter(quantity__gt=1).update(quantity=F('quantity') - 1)
 
-        # Get all cart items for response
-        items = cart.cart_items.all()
-        cart_items = [{
-            'id': item.id,
-            'product_id': item.product.id,
-            'name': item.product.name,
-            'quantity': item.quantity,
-            'price': float(item.product.price),
-            'total_item_price': float(item.product.price * item.quantity),
-            'image': request.build_absolute_uri(item.product.image.url) if item.product.image else None,
-        } for item in items]
+        if not updated:
+            if not cart_items.exists():
+                return Response({"error": "Item not found in cart."}, status=status.HTTP_404_NOT_FOUND)
+            return Response({"error": "Quantity cannot be decreased further."}, status=status.HTTP_400_BAD_REQUEST)
 
-        total_price = float(sum(item['total_item_price'] for item in cart_items))
+        bump_cart_version(cart)
 
-        return Response({
-            'cart_items': cart_items,
-            'total_price': total_price
-        })
+        return cart_response(get_cart_delta(request, cart, [product_id]))
 
     except Cart.DoesNotExist:
         return Response({"error": "Cart not found."}, status=status.HTTP_404_NOT_FOUND)
-    except CartItem.DoesNotExist:
-        return Response({"error": "Item not found in cart."}, status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def cart_batch(request):
+    """
+    Apply an ordered list of cart operations in one request, e.g.
+    [{"op": "add", "product_id": 3, "quantity": 2}, {"op": "remove", "product_id": 5}]
+    """
+    try:
+        operations = parse_cart_operations(request.data.get('operations'), request.FILES)
+        cart = apply_cart_operations(request.user, operations)
+        product_ids = [operation['product_id'] for operation in operations]
+        return cart_response(get_cart_delta(request, cart, product_ids))
+
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Product.DoesNotExist as e:
+        return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        logger.error(f"Error applying cart batch: {e}", exc_info=True)
+        return Response({'error': 'An error occurred while updating the cart'},
+                        status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def checkout(request):
     try:
+        if redis_cart_enabled():
+            # Write-behind is asynchronous, so flush this cart before reading it
+            get_cart_store().persist(request.user.id)
+
         cart = get_object_or_404(Cart, user=request.user)
+        items = list(CartItem.objects.filter(cart=cart, order__isnull=True).select_related('product'))
 
-        if cart.cart_items.count() == 0:
+        if not items:
             return Response({'message': 'Your cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
 
-        total_price = sum([item.product.price * item.quantity for item in cart.cart_items.all()])
-        order = Order.objects.create(user=request.user, total_price=total_price, status="pending", address=request.data.get('address'))
+        with transaction.atomic():
+            total_price = sum(item.product.price * item.quantity for item in items)
+            order = Order.objects.create(user=request.user, total_price=total_price, status="pending", address=request.data.get('address'))
+            OrderLine.objects.bulk_create([line_for(order, item.product, item.quantity) for item in items])
 
-        for cart_item in cart.cart_items.all():
-            cart_item.order = order
-            cart_item.save()
+            # The cart lines move to the order, keeping any prescription attached to them
+            CartItem.objects.filter(id__in=[item.id for item in items]).update(order=order, cart=None)
+            bump_cart_version(cart)
+            order_created(order)
 
-        # Clear the cart after creating the order
-        cart.cart_items.all().delete()
+        if redis_cart_enabled():
+            get_cart_store().clear(request.user.id)
 
         return Response({'message': 'Checkout complete, your cart is now empty.', 'order_id': order.id}, status=status.HTTP_200_OK)
 
@@ -367,6 +416,7 @@ class PlaceOrderView(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
 
+    @idempotent
     def post(self, request):
         try:
             cart_items_data = request.data.get('cart_items')
@@ -377,68 +427,102 @@ class PlaceOrderView(APIView):
             if not cart_items_data or not address:
                 return Response({"detail": "Missing cart items or address."}, status=status.HTTP_400_BAD_REQUEST)
 
-            cart_items = json.loads(cart_items_data)
-            total_price = 0
-
-            with transaction.atomic():
-                # Create the order first
-                order = Order.objects.create(user=request.user, total_price=0, address=address)
-
-                for item in cart_items:
-                    product = get_object_or_404(Product, id=item['id'])
+            quantities = parse_order_items(json.loads(cart_items_data))
 
-                    # Check stock availability
-                    if product.stock < item['quantity']:
-                        return Response({"detail": f"Not enough stock for {product.name}."},
-                                        status=status.HTTP_400_BAD_REQUEST)
-
-                    total_price += product.price * item['quantity']
-
-                    # Reduce stock **before** payment
-                    product.stock -= item['quantity']
-                    product.save()
-
-                    # Link cart items to the order
-                    CartItem.objects.create(
-                        product=product,
-                        quantity=item['quantity'],
-                        order=order
-                    )
+            if queued_intake_enabled():
+                return self.queue_order(request, address, quantities, payment_method)
 
-                # Save the final total price
-                order.total_price = total_price
-                order.save()
+            with transaction.atomic():
+                order = place_order(request.user, address, quantities, hold=payment_method == "online")
 
                 # Handle prescription upload
                 if prescription:
                     prescription_file = request.FILES.get('prescription')
                     if prescription_file:
-                        order.prescription = prescription_file
-                        order.save()
+                        attach_prescription(order, prescription_file, 'prescription')
+                        order.save(update_fields=['prescription', 'prescription_blob'])
 
-                # Check payment method
-                if payment_method == "online":
-                    return Response({
-                        "order_id": order.id,
-                        "message": "Proceed to eSewa payment",
-                        "total_price": total_price
-                    }, status=status.HTTP_200_OK)
+            # Check payment method
+            if payment_method == "online":
+                return Response({
+                    "order_id": order.id,
+                    "message": "Proceed to eSewa payment",
+                    "total_price": order.total_price
+                }, status=status.HTTP_200_OK)
 
-                return Response({"order_id": order.id}, status=status.HTTP_201_CREATED)
+            return Response({"order_id": order.id}, status=status.HTTP_201_CREATED)
 
+        except StockShortfall as e:
+            return Response({"detail": str(e),
+                             "product_id": e.product.id,
+                             "alternatives": find_alternatives(e.product)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Product.DoesNotExist:
             return Response({"detail": "Product not found."}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             logger.error(f"Error placing order: {str(e)}")
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def queue_order(self, request, address, quantities, payment_method):
+        """Queued intake: store the request for process_order_requests and answer 202 straight away"""
+        known = Product.objects.filter(id__in=quantities).count()
+        if known != len(quantities):
+            return Response({"detail": "Product not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        prescription = request.FILES.get('prescription') if request.data.get('prescription') else None
+        order_request = submit_order_request(request.user, address, quantities, payment_method, prescription)
+        status_url = request.build_absolute_uri(reverse('myapp:order-request-status', args=[order_request.id]))
+        response = Response({
+            "request_id": order_request.id,
+            "status": order_request.status,
+            "status_url": status_url,
+        }, status=status.HTTP_202_ACCEPTED)
+        response['Location'] = status_url
+        return response
+
+
+class OrderRequestStatusView(APIView):
+    """Polled by clients after a queued order placement, one indexed lookup per call"""
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+
+    def get(self, request, pk):
+        order_request = (OrderRequest.objects
+                         .filter(pk=pk, user=request.user)
+                         .values('id', 'status', 'payment_method', 'error', 'order_id', 'order__total_price')
+                         .first())
+        if order_request is None:
+            return Response({"detail": "Order request not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        data = {"request_id": order_request['id'], "status": order_request['status']}
+        if order_request['status'] in ('queued', 'placing'):
+            # Being claimed is internal to the intake worker, clients keep waiting
+            data['status'] = 'queued'
+            response = Response(data, status=status.HTTP_200_OK)
+            response['Retry-After'] = '1'
+            return response
+
+        if order_request['status'] == 'rejected':
+            data.update(order_request['error'] or {})
+            product = Product.objects.filter(pk=data['product_id']).first() if data.get('product_id') else None
+            if product is not None:
+                data['alternatives'] = find_alternatives(product)
+            return Response(data, status=status.HTTP_200_OK)
+
+        data.update({"order_id": order_request['order_id'], "total_price": order_request['order__total_price']})
+        if order_request['payment_method'] == 'online':
+            data['message'] = "Proceed to eSewa payment"
+        return Response(data, status=status.HTTP_200_OK)
+
 
 class OrderDetailView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
         try:
-            order = Order.objects.get(pk=pk, user=request.user)
+            order = Order.objects.with_lines().get(pk=pk, user=request.user)
             serializer = OrderSerializer(order)
             return Response(serializer.data)
         except Order.DoesNotExist:
@@ -452,18 +536,31 @@ def update_order_status(request, order_id):
     except Order.DoesNotExist:
         return Response({"message": "Order not found."}, status=status.HTTP_404_NOT_FOUND)
 
-    status = request.data.get('status')
+    new_status = request.data.get('status')
 
-    if status not in ['pending', 'shipped', 'delivered']:  # Example statuses
+    if new_status not in ['pending', 'shipped', 'delivered']:  # Example statuses
         return Response({"message": "Invalid status."}, status=status.HTTP_400_BAD_REQUEST)
 
-    order.status = status
-    order.save()
+    old_status = order.status
+    if not transition_order(order, new_status, request.user if request.user.is_authenticated else None):
+        return Response({"message": f"An order cannot go from {old_status} to {new_status}."},
+                        status=status.HTTP_409_CONFLICT)
 
     return Response({"message": "Order status updated successfully.", "order_id": order.id}, status=status.HTTP_200_OK)
 
 
 class ProcessPaymentView(APIView):
+    def gateway_status(self, payment):
+        """The gateway's status for payment, None when it cannot be reached"""
+        gateway = get_gateway()
+        try:
+            with gateway.session(pool_size=1) as session:
+                return gateway.check_status(session, payment.transaction_uuid, payment.total_amount)
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Status check failed for payment {payment.transaction_uuid}: {e}")
+            return None
+
+    @idempotent
     def post(self, request):
         try:
             if 'data' in request.data or 'status' in request.data:
@@ -473,20 +570,50 @@ class ProcessPaymentView(APIView):
 
                 try:
                     payment = userPayment.objects.get(transaction_uuid=transaction_uuid)
-                    payment.transaction_code = transaction_code
-                    payment.status = status_code
-                    payment.save()
-
-                    logger.info(f"Payment callback processed successfully for transaction {transaction_uuid}")
-                    return Response({
-                        "message": "Payment successful",
-                        "transaction_uuid": transaction_uuid
-                    }, status=status.HTTP_200_OK)
-
                 except userPayment.DoesNotExist:
                     logger.error(f"Payment not found for transaction {transaction_uuid}")
                     return Response({"error": "Payment not found"}, status=status.HTTP_404_NOT_FOUND)
 
+                new_status = payment_status_for_callback(status_code)
+                if new_status is None:
+                    return Response({"error": f"Unknown payment status '{status_code}'"},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+                if new_status == 'PAID':
+                    # Only eSewa's signed success payload can mark a payment paid
+                    try:
+                        verified = get_gateway().decode_callback(request.data.get('data'))
+                    except InvalidSignature as e:
+                        logger.error(f"Rejected payment callback for {transaction_uuid}: {e}")
+                        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                    if (verified.get('transaction_uuid') != transaction_uuid
+                            or payment_status_for_callback(verified.get('status')) != 'PAID'
+                            or parse_amount(verified.get('total_amount')) != payment.total_amount):
+                        logger.error(f"Payment callback for {transaction_uuid} does not match its signed data")
+                        return Response({"error": "Payment data does not match this transaction"},
+                                        status=status.HTTP_400_BAD_REQUEST)
+                    transaction_code = verified.get('transaction_code')
+                elif payment.status == 'PENDING':
+                    # Failure redirects are not signed, so only the gateway's own answer can fail a payment
+                    if payment_status_for_callback(self.gateway_status(payment)) != 'FAILED':
+                        logger.warning(f"Unconfirmed failure callback for {transaction_uuid}, left pending")
+                        return Response({
+                            "message": "Payment is pending confirmation",
+                            "transaction_uuid": transaction_uuid
+                        }, status=status.HTTP_202_ACCEPTED)
+                try:
+                    # A repeated callback finds the status already set and writes nothing
+                    transition_payment(payment, new_status, transaction_code=transaction_code)
+                except PaymentTransitionError as e:
+                    logger.error(f"Payment callback rejected: {e}")
+                    return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+
+                logger.info(f"Payment callback processed successfully for transaction {transaction_uuid}")
+                return Response({
+                    "message": "Payment successful" if new_status == 'PAID' else "Payment failed",
+                    "transaction_uuid": transaction_uuid
+                }, status=status.HTTP_200_OK)
+
             amount = float(request.data.get('amount', 0))
             tax_amount = float(request.data.get('tax_amount', 0))
             transaction_uuid = request.data.get('transaction_uuid')
@@ -496,6 +623,18 @@ class ProcessPaymentView(APIView):
 
             total_amount = amount + tax_amount
 
+            # Linking the order lets the success callback confirm its inventory holds
+            order = None
+            order_id = request.data.get('order_id')
+            if order_id:
+                order = Order.objects.filter(pk=order_id, user_id=request.user.id).first()
+                if order is None:
+                    return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
+                # The callback only checks against this payment, so it has to be for the whole order
+                if parse_amount(f"{total_amount:.2f}") != order.total_price:
+                    return Response({"error": "Payment amount does not match the order total",
+                                     "total_price": order.total_price}, status=status.HTTP_400_BAD_REQUEST)
+
             payment = userPayment.objects.create(
                 amount=amount,
                 tax_amount=tax_amount,
@@ -503,31 +642,21 @@ class ProcessPaymentView(APIView):
                 transaction_uuid=transaction_uuid,
                 status="PENDING",
                 user=request.user if request.user.is_authenticated else None,
+                order=order,
             )
 
-            message = f"total_amount={total_amount},transaction_uuid={transaction_uuid},product_code=EPAYTEST"
-            secret_key = "8gBm/:&EnhH.1/q"
-            signature = base64.b64encode(
-                hmac.new(
-                    secret_key.encode(),
-                    message.encode(),
-                    hashlib.sha256
-                ).digest()
-            ).decode()
-
-            user_payment_data = {
+            gateway = get_gateway()
+            user_payment_data = gateway.sign({
                 "amount": str(amount),
                 "tax_amount": str(tax_amount),
                 "total_amount": str(total_amount),
                 "transaction_uuid": transaction_uuid,
-                "product_code": "EPAYTEST",
+                "product_code": gateway.product_code,
                 "product_service_charge": "0",
                 "product_delivery_charge": "0",
                 "success_url": f"http://localhost:5173/payment-success",
                 "failure_url": f"http://localhost:5173/payment-failure",
-                "signed_field_names": "total_amount,transaction_uuid,product_code",
-                "signature": signature
-            }
+            })
 
             return Response(user_payment_data, status=status.HTTP_200_OK)
 
@@ -581,32 +710,10 @@ class UserProfileView(APIView):
                 'last_name': request.user.last_name,
             }
 
-            # Fetch the user's orders and related cart items
-            orders = Order.objects.filter(user=request.user)
-            orders_data = []
-
-            for order in orders:
-                cart_items = CartItem.objects.filter(order=order)
-                cart_items_data = [
-                    {
-                        'product_id': item.product.id,
-                        'product_name': item.product.name,
-                        'quantity': item.quantity,
-                        'price': item.product.price,
-                        'total_price': item.product.price * item.quantity
-                    } for item in cart_items
-                ]
-                order_data = {
-                    'order_id': order.id,
-                    'total_price': order.total_price,
-                    'status': order.status,
-                    'address': order.address,
-                    'cart_items': cart_items_data,
-                }
-                orders_data.append(order_data)
-
-            # Add orders to the response
-            user_data['orders'] = orders_data
+            # Only the newest orders, the rest of the history is paged through /api/user/orders/
+            orders, next_cursor = keyset_page(Order.objects.filter(user=request.user).with_lines())
+            user_data['orders'] = [order_history_entry(order) for order in orders]
+            user_data['orders_next_cursor'] = next_cursor
 
             return Response(user_data)
 
@@ -615,6 +722,38 @@ class UserProfileView(APIView):
             return Response({"detail": "Error fetching profile data."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def order_history_entry(order):
+    return {
+        'order_id': order.id,
+        'total_price': order.total_price,
+        'status': order.status,
+        'address': order.address,
+        'created_at': order.created_at,
+        'cart_items': [serialize_line(line) for line in order.lines.all()],
+    }
+
+
+class UserOrdersView(APIView):
+    """The user's order history, newest first, paged with ?cursor= and ?page_size="""
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+
+    def get(self, request):
+        try:
+            orders, next_cursor = keyset_page(
+                Order.objects.filter(user=request.user).with_lines(),
+                cursor=request.query_params.get('cursor'),
+                page_size=page_size_from(request)
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'orders': [order_history_entry(order) for order in orders],
+            'next_cursor': next_cursor,
+        }, status=status.HTTP_200_OK)
+
+
 # Admin Verification Endpoint
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -647,6 +786,12 @@ def verify_admin_access(request):
 
 # Admin: Get All Orders
 class AdminOrdersView(APIView):
+    """
+    Orders newest first, paged with ?cursor= and ?page_size=.
+
+    Optional filters: status, user_id, date_from and date_to (YYYY-MM-DD,
+    inclusive). Every page costs the same two queries.
+    """
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
@@ -654,20 +799,20 @@ class AdminOrdersView(APIView):
         if not request.user.is_staff and not request.user.is_superuser:
             return Response({'error': 'Admin access required'}, status=status.HTTP_403_FORBIDDEN)
         
-        orders = Order.objects.all().order_by('-created_at')
+        try:
+            orders = filter_admin_list(Order.objects.all(), request.query_params, Order.STATUS_CHOICES)
+            orders, next_cursor = keyset_page(
+                orders.with_lines(),
+                cursor=request.query_params.get('cursor'),
+                page_size=page_size_from(request, default=50)
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         orders_data = []
         
         for order in orders:
-            cart_items = CartItem.objects.filter(order=order)
-            cart_items_data = [
-                {
-                    'product_id': item.product.id,
-                    'product_name': item.product.name,
-                    'quantity': item.quantity,
-                    'price': float(item.product.price),
-                    'total_price': float(item.product.price * item.quantity)
-                } for item in cart_items
-            ]
+            cart_items_data = [serialize_line(line) for line in order.lines.all()]
             
             order_data = {
                 'id': order.id,
@@ -686,7 +831,36 @@ class AdminOrdersView(APIView):
             }
             orders_data.append(order_data)
         
-        return Response({'orders': orders_data}, status=status.HTTP_200_OK)
+        return Response({'orders': orders_data, 'next_cursor': next_cursor}, status=status.HTTP_200_OK)
+
+
+def filter_admin_list(queryset, params, status_choices):
+    """Apply the admin list filters, raises ValueError for malformed ones"""
+    list_status = params.get('status')
+    if list_status:
+        if list_status not in dict(status_choices):
+            raise ValueError(f"Unknown status '{list_status}'")
+        queryset = queryset.filter(status=list_status)
+
+    user_id = params.get('user_id')
+    if user_id:
+        if not user_id.isdigit():
+            raise ValueError("user_id must be a number")
+        queryset = queryset.filter(user_id=int(user_id))
+
+    # Whole-day bounds as datetimes, so the created_at index is used
+    for param, lookup, offset in (('date_from', 'created_at__gte', 0), ('date_to', 'created_at__lt', 1)):
+        value = params.get(param)
+        if value:
+            try:
+                day = parse_date(value)
+            except ValueError:
+                day = None
+            if day is None:
+                raise ValueError(f"{param} must be a date like 2024-01-31")
+            start = datetime.datetime.combine(day + datetime.timedelta(days=offset), datetime.time.min)
+            queryset = queryset.filter(**{lookup: timezone.make_aware(start)})
+    return queryset
 
 
 # Admin: Update Order Status
@@ -709,8 +883,9 @@ class AdminOrderStatusUpdateView(APIView):
             return Response({'error': 'Invalid status. Use: pending, shipped, or delivered'}, status=status.HTTP_400_BAD_REQUEST)
         
         old_status = order.status
-        order.status = new_status
-        order.save()
+        if not transition_order(order, new_status, request.user):
+            return Response({'error': f'An order cannot go from {old_status} to {new_status}'},
+                            status=status.HTTP_409_CONFLICT)
         
         return Response({
             'message': 'Order status updated successfully',
@@ -720,6 +895,35 @@ class AdminOrderStatusUpdateView(APIView):
         }, status=status.HTTP_200_OK)
 
 
+# Admin: Move many orders to one status
+class AdminOrderBulkStatusView(APIView):
+    """POST {"order_ids": [...], "status": "shipped"}; orders that cannot make the move are reported, not changed"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if not request.user.is_staff and not request.user.is_superuser:
+            return Response({'error': 'Admin access required'}, status=status.HTTP_403_FORBIDDEN)
+
+        new_status = request.data.get('status')
+        order_ids = request.data.get('order_ids')
+
+        if new_status not in dict(Order.STATUS_CHOICES):
+            return Response({'error': f"Invalid status '{new_status}'"}, status=status.HTTP_400_BAD_REQUEST)
+        if (not isinstance(order_ids, list) or not order_ids
+                or not all(type(order_id) is int for order_id in order_ids)):
+            return Response({'error': 'order_ids must be a non-empty list of ids'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(order_ids) > MAX_BULK_TRANSITION:
+            return Response({'error': f'At most {MAX_BULK_TRANSITION} orders per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        result = transition_orders(order_ids, new_status, changed_by=request.user)
+        return Response({
+            'message': f"{len(result['updated'])} order(s) moved to {new_status}",
+            'updated': result['updated'],
+            'rejected': result['rejected'],
+        }, status=status.HTTP_200_OK)
+
+
 # Admin: Get All Products with Stock Management
 class AdminProductsView(APIView):
     permission_classes = [IsAuthenticated]
@@ -783,6 +987,13 @@ class AdminProductStockUpdateView(APIView):
 
 # Admin: Get All Payments
 class AdminPaymentsView(APIView):
+    """
+    Payments newest first, paged with ?cursor= and ?page_size=.
+
+    Takes the same filters as AdminOrdersView, with payment statuses. Each
+    page is one query over the (status, created_at) or created_at index,
+    read with values() instead of through a ModelSerializer.
+    """
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
@@ -790,14 +1001,22 @@ class AdminPaymentsView(APIView):
         if not request.user.is_staff and not request.user.is_superuser:
             return Response({'error': 'Admin access required'}, status=status.HTTP_403_FORBIDDEN)
         
-        from .serializers import AdminPaymentSerializer
-        
-        payments = userPayment.objects.all().order_by('-created_at')
-        serializer = AdminPaymentSerializer(payments, many=True)
+        try:
+            payments = filter_admin_list(userPayment.objects.all(), request.query_params, userPayment.STATUS_CHOICES)
+            payments, next_cursor = keyset_page(
+                payments.admin_rows(),
+                cursor=request.query_params.get('cursor'),
+                page_size=page_size_from(request, default=50)
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        payments_data = [admin_payment_row(row) for row in payments]
         
         return Response({
-            'payments': serializer.data,
-            'count': len(serializer.data)
+            'payments': payments_data,
+            'count': len(payments_data),
+            'next_cursor': next_cursor
         }, status=status.HTTP_200_OK)
 
 
@@ -818,21 +1037,21 @@ class AdminPaymentStatusUpdateView(APIView):
         new_status = request.data.get('status')
         
         # Validate status
-        valid_statuses = ['PENDING', 'PAID', 'FAILED', 'REFUNDED']
+        valid_statuses = list(PAYMENT_TRANSITIONS)
         if new_status not in valid_statuses:
             return Response({
                 'error': f'Invalid status. Use: {", ".join(valid_statuses)}'
             }, status=status.HTTP_400_BAD_REQUEST)
         
         old_status = payment.status
-        payment.status = new_status
-        payment.save()
-        
-        # If payment is marked as PAID, update related order status
-        if new_status == 'PAID' and payment.order:
-            payment.order.status = 'paid'
-            payment.order.save()
-            logger.info(f"Order {payment.order.id} status updated to 'paid' after payment confirmation")
+        try:
+            # Marking it PAID also moves the order to 'paid', in the same transaction
+            transition_payment(payment, new_status, changed_by=request.user)
+        except PaymentTransitionError as e:
+            return Response({
+                'error': str(e),
+                'allowed': sorted(PAYMENT_TRANSITIONS.get(payment.status, set()))
+            }, status=status.HTTP_409_CONFLICT)
         
         return Response({
             'message': 'Payment status updated successfully',
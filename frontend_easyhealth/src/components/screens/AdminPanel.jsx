@@ -7,8 +7,10 @@ import './pages.css';
 
 const AdminPanel = () => {
   const [orders, setOrders] = useState([]);
+  const [ordersCursor, setOrdersCursor] = useState(null);
   const [products, setProducts] = useState([]);
   const [payments, setPayments] = useState([]);
+  const [paymentsCursor, setPaymentsCursor] = useState(null);
   const [loading, setLoading] = useState(true);
   const [activeTab, setActiveTab] = useState('orders');
   const [updatingOrder, setUpdatingOrder] = useState(null);
@@ -37,12 +39,15 @@ const AdminPanel = () => {
     }
   };
 
-  const fetchOrders = async () => {
+  const fetchOrders = async (cursor = null) => {
     try {
       const response = await axios.get('http://localhost:8000/api/admin/orders/', {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: cursor ? { cursor } : {}
       });
-      setOrders(response.data.orders || []);
+      const page = response.data.orders || [];
+      setOrders((prevOrders) => (cursor ? [...prevOrders, ...page] : page));
+      setOrdersCursor(response.data.next_cursor || null);
     } catch (err) {
       console.error('Failed to fetch orders:', err);
     }
@@ -59,12 +64,15 @@ const AdminPanel = () => {
     }
   };
 
-  const fetchPayments = async () => {
+  const fetchPayments = async (cursor = null) => {
     try {
       const response = await axios.get('http://localhost:8000/api/admin/payments/', {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: cursor ? { cursor } : {}
       });
-      setPayments(response.data.payments || []);
+      const page = response.data.payments || [];
+      setPayments((prevPayments) => (cursor ? [...prevPayments, ...page] : page));
+      setPaymentsCursor(response.data.next_cursor || null);
     } catch (err) {
       console.error('Failed to fetch payments:', err);
     }
@@ -344,6 +352,13 @@ const AdminPanel = () => {
                       })}
                     </tbody>
                   </table>
+                  {ordersCursor && (
+                    <div style={{ padding: '16px', textAlign: 'center' }}>
+                      <Button variant="secondary" onClick={() => fetchOrders(ordersCursor)}>
+                        Load more orders
+                      </Button>
+                    </div>
+                  )}
                 </div>
               )}
             </Card>
@@ -589,6 +604,13 @@ const AdminPanel = () => {
                       })}
                     </tbody>
                   </table>
+                  {paymentsCursor && (
+                    <div style={{ padding: '16px', textAlign: 'center' }}>
+                      <Button variant="secondary" onClick={() => fetchPayments(paymentsCursor)}>
+                        Load more payments
+                      </Button>
+                    </div>
+                  )}
                 </div>
               )}
             </Card>
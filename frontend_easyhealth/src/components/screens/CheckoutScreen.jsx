@@ -7,6 +7,8 @@ import { Card, CardContent } from '../ui/card';
 import Button from '../ui/button';
 import { motion } from 'framer-motion';
 
+const ORDER_WAIT_MS = 60000;
+
 const CheckoutScreen = () => {
   const { cartItems } = useCart();
   const navigate = useNavigate();
@@ -17,6 +19,7 @@ const CheckoutScreen = () => {
   const [loading, setLoading] = useState(false);
   const [totalPrice, setTotalPrice] = useState(0);
   const [showEsewaPayment, setShowEsewaPayment] = useState(false);
+  const [placedOrderId, setPlacedOrderId] = useState(null);
 
   useEffect(() => {
     const requiresPrescription = cartItems.some(item => item.prescriptionRequired);
@@ -31,6 +34,26 @@ const CheckoutScreen = () => {
     setPrescription(e.target.files[0]);
   };
 
+  // Queued intake answers 202 with a status URL; poll it until the order is placed or rejected,
+  // giving up after ORDER_WAIT_MS so a stalled queue does not spin forever
+  const waitForOrder = async (statusUrl, token) => {
+    const deadline = Date.now() + ORDER_WAIT_MS;
+    while (Date.now() < deadline) {
+      const { data, headers } = await axios.get(statusUrl, {
+        headers: { 'Authorization': `Bearer ${token}` },
+      });
+      if (data.status === 'placed') {
+        return data;
+      }
+      if (data.status === 'rejected') {
+        throw new Error(data.detail || 'Your order could not be placed.');
+      }
+      const retryAfter = Number(headers['retry-after']) || 1;
+      await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
+    }
+    throw new Error('Your order is still being processed. Please check your orders in a moment.');
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
 
@@ -82,25 +105,32 @@ const CheckoutScreen = () => {
           'Authorization': `Bearer ${token}`,
         },
       });
+      const order = response.status === 202
+        ? await waitForOrder(response.data.status_url, token)
+        : response.data;
 
       if (paymentMethod === 'online') {
         // First, ensure stock is reduced by placing the order
+        setPlacedOrderId(order.order_id);
         setShowEsewaPayment(true);
         return;
       }
 
-      navigate(`/order-success/${response.data.order_id}`);
+      navigate(`/order-success/${order.order_id}`);
 
     } catch (error) {
       console.error('Error during checkout:', error);
-      alert('There was an error processing your checkout. Please try again.');
+      // Errors raised while waiting on a queued order carry their own message
+      alert(error.isAxiosError || !error.message
+        ? 'There was an error processing your checkout. Please try again.'
+        : error.message);
     } finally {
       setLoading(false);
     }
   };
 
   if (showEsewaPayment) {
-    return <EsewaPayment totalPrice={totalPrice} />;
+    return <EsewaPayment totalPrice={totalPrice} orderId={placedOrderId} />;
   }
 
   if (cartItems.length === 0) {
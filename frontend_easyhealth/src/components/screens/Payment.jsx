@@ -3,7 +3,7 @@ import axios from 'axios';
 import { useNavigate, useLocation } from 'react-router-dom';
 import { Loader2 } from 'lucide-react';
 
-const EsewaPayment = ({ totalPrice }) => {
+const EsewaPayment = ({ totalPrice, orderId }) => {
     const [error, setError] = useState(null);
     const [loading, setLoading] = useState(false);
     const [transactionUuid, setTransactionUuid] = useState(null);
@@ -90,7 +90,8 @@ const EsewaPayment = ({ totalPrice }) => {
             const formData = {
                 amount: formattedAmount,
                 tax_amount: formattedTaxAmount,
-                transaction_uuid: transactionUuid
+                transaction_uuid: transactionUuid,
+                order_id: orderId
             };
 
             console.log('Sending payment request with data:', formData); // Debug log
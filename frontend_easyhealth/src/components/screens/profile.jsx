@@ -8,6 +8,9 @@ import './pages.css';
 
 const Profile = () => {
   const [user, setUser] = useState(null);
+  const [orders, setOrders] = useState([]);
+  const [ordersCursor, setOrdersCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState(null);
   const [loading, setLoading] = useState(true);
   const [refreshing, setRefreshing] = useState(false);
@@ -30,6 +33,9 @@ const Profile = () => {
         },
       });
       setUser(response.data);
+      // The profile carries the newest orders; older ones are paged in from /api/user/orders/
+      setOrders(response.data.orders || []);
+      setOrdersCursor(response.data.orders_next_cursor || null);
       setError(null);
     } catch (err) {
       setError('Error fetching profile: ' + (err.response?.data?.detail || err.message));
@@ -43,6 +49,30 @@ const Profile = () => {
     fetchProfile();
   }, [fetchProfile]);
 
+  const fetchMoreOrders = async () => {
+    const authTokens = sessionStorage.getItem('authTokens');
+    if (!authTokens || !ordersCursor) {
+      return;
+    }
+
+    setLoadingMore(true);
+    try {
+      const parsedTokens = JSON.parse(authTokens);
+      const response = await axios.get('http://localhost:8000/api/user/orders/', {
+        headers: {
+          'Authorization': `Bearer ${parsedTokens.access}`,
+        },
+        params: { cursor: ordersCursor },
+      });
+      setOrders((prevOrders) => [...prevOrders, ...(response.data.orders || [])]);
+      setOrdersCursor(response.data.next_cursor || null);
+    } catch (err) {
+      setError('Error fetching orders: ' + (err.response?.data?.error || err.message));
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleRefresh = () => {
     setRefreshing(true);
     fetchProfile();
@@ -214,16 +244,16 @@ const Profile = () => {
               marginBottom: '20px'
             }}>
               <h2 style={{ fontSize: '1.25rem', fontWeight: 700 }}>
-                📦 Your Orders ({user.orders?.length || 0})
+                📦 Your Orders ({orders.length}{ordersCursor ? '+' : ''})
               </h2>
               <Button variant="secondary" size="sm" onClick={handleRefresh} disabled={refreshing}>
                 {refreshing ? '...' : '↻'}
               </Button>
             </div>
             
-            {user.orders && user.orders.length > 0 ? (
+            {orders.length > 0 ? (
               <div style={{ display: 'grid', gap: '20px' }}>
-                {user.orders.map((order) => {
+                {orders.map((order) => {
                   const statusInfo = getStatusInfo(order.status);
                   const progress = getStatusProgress(order.status);
                   
@@ -351,6 +381,13 @@ const Profile = () => {
                     </motion.div>
                   );
                 })}
+                {ordersCursor && (
+                  <div style={{ textAlign: 'center' }}>
+                    <Button variant="secondary" onClick={fetchMoreOrders} disabled={loadingMore}>
+                      {loadingMore ? 'Loading...' : 'Load more orders'}
+                    </Button>
+                  </div>
+                )}
               </div>
             ) : (
               <Card>